@@ -14,14 +14,20 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 django.setup()
 
 from channels.auth import AuthMiddlewareStack
+from django.urls import re_path
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
-from base.routing import websocket_urlpatterns
+from base.routing import http_urlpatterns, websocket_urlpatterns
+
+django_asgi_app = get_asgi_application()
 
 application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
+    # Long-poll/SSE and quiz generation consumers first; everything else goes to Django
+    'http': URLRouter(
+        http_urlpatterns + [re_path(r'', django_asgi_app)]
+    ),
     'websocket': AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,7 +47,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.middleware.MetricsMiddleware',
+    'base.querybudget.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'base.middleware.RoomAffinityMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,7 +75,7 @@ SWAGGER_SETTINGS = {
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",  # Your frontend React/Vue URL
     "http://127.0.0.1:5173",  # Also allow 127.0.0.1 for consistency
-    "https://mind-clash.netlify.app/", # allow from netlify
+    "https://mind-clash.netlify.app", # allow from netlify
 ]
 
 # Allow CSRF token to be read by the frontend
@@ -106,12 +110,16 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'if-none-match',
     'origin',
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
 ]
 
+# Let the frontend read the game status ETag for conditional polling
+CORS_EXPOSE_HEADERS = ['etag']
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'base.authentication.BearerTokenAuthentication',  # Our custom Bearer token auth
@@ -165,7 +173,7 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DJANGO_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -214,11 +222,139 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Channels configuration
 ASGI_APPLICATION = 'backend.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+# Set CHANNEL_BROKER_URL (e.g. redis://127.0.0.1:6379) to share game groups
+# between worker processes. `python manage.py runbroker` starts a local
+# Redis-compatible stand-in.
+CHANNEL_BROKER_URL = os.environ.get('CHANNEL_BROKER_URL')
+
+if CHANNEL_BROKER_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'base.layers.PubSubChannelLayer',
+            'CONFIG': {
+                'url': CHANNEL_BROKER_URL,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Room affinity: with several workers, each game room is owned by one of
+# them so its in-memory state stays authoritative. ROOM_WORKERS lists the
+# public HTTP base URL of every worker (comma separated, e.g.
+# https://worker-1.example.com); redirects to the owner are built from it
+# and clients switch the scheme to ws(s) for the game socket.
+# ROOM_WORKER_URL is this worker's own entry.
+ROOM_WORKERS = [url for url in os.environ.get('ROOM_WORKERS', '').split(',') if url]
+ROOM_WORKER_URL = os.environ.get('ROOM_WORKER_URL')
+
+GROQ_API_KEY='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'
+GROQ_API_URL = 'https://api.groq.com/v1'
+
+# Set QUIZ_GENERATOR=stub to answer quiz and chat requests with the offline
+# fake client (base.service.fakeGroq) instead of calling Groq, e.g. for load
+# tests. FAKE_GROQ_LATENCY adds a delay in seconds to each fake completion
+# and FAKE_GROQ_TOKENS_PER_SECOND makes it take longer the more it writes.
+QUIZ_GENERATOR = os.environ.get('QUIZ_GENERATOR', 'groq')
+FAKE_GROQ_LATENCY = float(os.environ.get('FAKE_GROQ_LATENCY', '0'))
+FAKE_GROQ_TOKENS_PER_SECOND = float(os.environ.get('FAKE_GROQ_TOKENS_PER_SECOND', '0'))
+
+# Quizzes of more than QUIZ_CHUNK_SIZE questions are generated as several
+# smaller completions run in parallel (base.service.quizPlanner).
+QUIZ_CHUNK_SIZE = int(os.environ.get('QUIZ_CHUNK_SIZE', '10'))
+# Parts of one quiz generated at the same time, so a single large quiz
+# can't take every GROQ_CONCURRENCY slot.
+QUIZ_MAX_PARALLEL_PARTS = int(os.environ.get('QUIZ_MAX_PARALLEL_PARTS', '8'))
+# Largest quiz one request may ask for; larger counts get a 400.
+QUIZ_MAX_QUESTIONS = int(os.environ.get('QUIZ_MAX_QUESTIONS', '50'))
+
+# Groq calls made from the async endpoints (base.consumers) share one pooled
+# client per worker. GROQ_BASE_URL points them elsewhere, e.g. at
+# `manage.py runfakegroq`; GROQ_TIMEOUT bounds each completion in seconds;
+# at most GROQ_CONCURRENCY run at once and requests queue for a free slot
+# for up to GROQ_QUEUE_TIMEOUT seconds before getting a 503.
+# Set ASYNC_QUIZ_ENDPOINTS=0 to serve them with the sync views instead.
+GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL') or None
+GROQ_TIMEOUT = float(os.environ.get('GROQ_TIMEOUT', '60'))
+GROQ_CONCURRENCY = int(os.environ.get('GROQ_CONCURRENCY', '32'))
+GROQ_MAX_CONNECTIONS = int(os.environ.get('GROQ_MAX_CONNECTIONS', '64'))
+GROQ_QUEUE_TIMEOUT = float(os.environ.get('GROQ_QUEUE_TIMEOUT', '10'))
+ASYNC_QUIZ_ENDPOINTS = os.environ.get('ASYNC_QUIZ_ENDPOINTS', '1') != '0'
+
+# Generated quizzes are reused for identical (topic, difficulty, count,
+# model) requests for QUIZ_CACHE_TTL seconds; QUIZ_CACHE_SIZE of them are
+# kept in memory per process, the rest in the GeneratedQuiz table.
+QUIZ_CACHE_TTL = int(os.environ.get('QUIZ_CACHE_TTL', 24 * 60 * 60))
+QUIZ_CACHE_SIZE = int(os.environ.get('QUIZ_CACHE_SIZE', 1000))
+
+# Quizzes are assembled from the question bank (base.service.questionBank)
+# when it holds enough questions on the topic and difficulty; requests
+# with "fresh": true always go to the model.
+QUESTION_BANK = os.environ.get('QUESTION_BANK', '1') != '0'
+
+# `manage.py runpregen` keeps the bank stocked for the PREGEN_TOPICS most
+# requested (topic, difficulty) pairs with a score of at least
+# PREGEN_MIN_SCORE requests, halved every PREGEN_HALF_LIFE seconds: each
+# gets PREGEN_STOCK_QUIZZES quizzes' worth of questions, plus new ones for
+# those served from the bank since, generated PREGEN_BATCH at a time and
+# at most PREGEN_RATE generations a minute.
+# Stock is checked every PREGEN_INTERVAL seconds.
+PREGEN_TOPICS = int(os.environ.get('PREGEN_TOPICS', '20'))
+PREGEN_MIN_SCORE = float(os.environ.get('PREGEN_MIN_SCORE', '3'))
+PREGEN_HALF_LIFE = float(os.environ.get('PREGEN_HALF_LIFE', 6 * 60 * 60))
+PREGEN_STOCK_QUIZZES = int(os.environ.get('PREGEN_STOCK_QUIZZES', '5'))
+PREGEN_BATCH = int(os.environ.get('PREGEN_BATCH', '20'))
+PREGEN_RATE = float(os.environ.get('PREGEN_RATE', '10'))
+PREGEN_INTERVAL = float(os.environ.get('PREGEN_INTERVAL', '30'))
+
+# Cheap password hashing for throwaway load-test users. Never set this in
+# production.
+if os.environ.get('FAST_PASSWORD_HASHING'):
+    PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# Logging: JSON lines written by a background thread (base.logs). Levels can
+# be set per subsystem with LOG_LEVELS, e.g. "game=DEBUG,ws=INFO". Below
+# WARNING, each event is limited to LOG_RATE_LIMIT (records/s, burst).
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_RATE_LIMIT = (20, 50)
+LOG_LEVELS = dict(
+    item.split('=', 1) for item in os.environ.get('LOG_LEVELS', '').split(',') if '=' in item
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'queue': {
+            '()': 'base.logs.QueueLogHandler',
+            'stream': 'ext://sys.stdout',
+            'maxsize': 10000,
+        },
+    },
+    'loggers': {
+        'mindclash': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        **{
+            f'mindclash.{subsystem}': {'level': level.upper()}
+            for subsystem, level in LOG_LEVELS.items()
+        },
     },
 }
 
-GROQ_API_KEY='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'
-GROQ_API_URL = 'https://api.groq.com/v1'
\ No newline at end of file
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Where the global leaderboards are snapshotted so a restart doesn't have
+# to rebuild them from every Player row. Set it empty to disable.
+LEADERBOARD_SNAPSHOT_PATH = os.environ.get('LEADERBOARD_SNAPSHOT_PATH', str(BASE_DIR / 'leaderboards.json'))
+
+# What to do when a request goes over its view's query budget or repeats a
+# query shape (N+1): 'off', 'log' or 'raise' (tests). See base.querybudget.
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'log' if DEBUG else 'off')
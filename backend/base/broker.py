@@ -0,0 +1,137 @@
+"""
+Minimal Redis-compatible pub/sub broker.
+
+Speaks the subset of the Redis protocol (RESP2) that base.layers needs:
+PING, ECHO, PUBLISH, SUBSCRIBE, UNSUBSCRIBE and QUIT. It lets the
+multi-process channel layer run on one box without an external Redis;
+start it with `python manage.py runbroker`.
+"""
+import asyncio
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_command(*args):
+    """
+    Encode a command as a RESP array of bulk strings.
+    """
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = str(arg).encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(out)
+
+
+def encode_reply(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, ProtocolError):
+        return b'-ERR %s\r\n' % str(value).encode()
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode_reply(v) for v in value)
+    if isinstance(value, str):
+        value = value.encode()
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+async def read_value(reader):
+    """
+    Read one RESP value from a stream. Bulk strings come back as bytes.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError('connection closed')
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode()
+    if kind == b'-':
+        return ProtocolError(body.decode())
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_value(reader) for _ in range(length)]
+    # Inline command, e.g. typed into telnet
+    return line.strip().split()
+
+
+class Broker:
+    """
+    In-process pub/sub hub. One instance serves all client connections.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+
+    def publish(self, channel, payload):
+        writers = self.subscribers.get(channel, ())
+        frame = encode_reply([b'message', channel, payload])
+        for writer in writers:
+            writer.write(frame)
+        return len(writers)
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                command = await read_value(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(encode_reply(ProtocolError('invalid command')))
+                    continue
+                name, args = command[0].upper(), command[1:]
+
+                if name == b'PUBLISH' and len(args) == 2:
+                    writer.write(encode_reply(self.publish(args[0], args[1])))
+                elif name == b'SUBSCRIBE' and args:
+                    for channel in args:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(encode_reply([b'subscribe', channel, len(subscribed)]))
+                elif name == b'UNSUBSCRIBE':
+                    for channel in args or list(subscribed):
+                        self._unsubscribe(channel, writer)
+                        subscribed.discard(channel)
+                        writer.write(encode_reply([b'unsubscribe', channel, len(subscribed)]))
+                elif name == b'PING':
+                    writer.write(b'+PONG\r\n')
+                elif name == b'ECHO' and len(args) == 1:
+                    writer.write(encode_reply(args[0]))
+                elif name == b'QUIT':
+                    writer.write(b'+OK\r\n')
+                    break
+                else:
+                    writer.write(encode_reply(ProtocolError('unknown command')))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self._unsubscribe(channel, writer)
+            writer.close()
+
+    def _unsubscribe(self, channel, writer):
+        writers = self.subscribers.get(channel)
+        if writers is not None:
+            writers.discard(writer)
+            if not writers:
+                del self.subscribers[channel]
+
+
+async def serve(host='127.0.0.1', port=6379):
+    broker = Broker()
+    return await asyncio.start_server(broker.handle, host, port)
@@ -1,257 +1,216 @@
+import asyncio
 import json
+import time
+from urllib.parse import parse_qs
+from channels.generic.http import AsyncHttpConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from . import metrics
+from .logs import get_logger
 from .models import GameRoom, Player
-from django.utils import timezone
-import asyncio
+from .service.roomState import rooms, group_name
+from .service.questionTimer import scheduler
+from .service.answerPipeline import answers
+from .service.roomAffinity import is_local_room, owner_for_room
+from .service import questionBank, quizGenerator, quizPlanner
+from .service.gameService import create_generating_game
+from .service.pregeneration import record_demand
+from .service.quizCache import quiz_cache
+from .service.quizCompiler import time_per_question
+from .service.quizGenerator import GeneratorBusy, GeneratorTimeout, QuizParseError
+
+log = get_logger('ws')
+
+MESSAGE_TYPES = ('player_ready', 'start_game', 'next_question', 'submit_answer', 'resync', 'chat_message')
 
 class GameConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.game_code = self.scope['url_route']['kwargs']['game_code']
-        self.game_group_name = f'game_{self.game_code}'
-        
+        self.game_group_name = group_name(self.game_code)
+        self.room = None
+
         # Get user ID from query string
         query_string = self.scope.get('query_string', b'').decode()
         query_params = {}
         for param in query_string.split('&'):
             if '=' in param:
-                key, value = param.split('=')
+                key, value = param.split('=', 1)
                 query_params[key] = value
-        
+
         # Store user ID for later use
         self.user_id = query_params.get('user_id')
-        
+        user = self.scope.get('user')
+        if (not user or not user.is_authenticated) and query_params.get('token'):
+            # Browsers can't set headers on a WebSocket; accept the API token
+            user = await self.user_for_token(query_params['token'])
+        if user and user.is_authenticated:
+            self.user_id = self.user_id or user.id
+            self.username = user.username
+            # Chat is only posted under an authenticated identity
+            self.chat_user_id = user.id
+        else:
+            self.username = query_params.get('username')
+            self.chat_user_id = None
+
+        # Rooms live in the memory of a single worker; send clients that
+        # landed on another one to the owner
+        if not is_local_room(self.game_code):
+            await self.accept()
+            await self.send(text_data=json.dumps({
+                'type': 'redirect',
+                'url': owner_for_room(self.game_code).rstrip('/') + self.scope['path']
+            }))
+            await self.close(code=4001)
+            return
+
         # Join room group
         await self.channel_layer.group_add(
             self.game_group_name,
             self.channel_name
         )
-        
+
         await self.accept()
-        
-        # Send initial game state to the client
-        game = await self.get_game()
-        if game:
-            game_state = await self.get_game_state()
-            await self.send(text_data=json.dumps({
-                'type': 'game_state',
-                'game': game_state
-            }))
-    
+        metrics.ws_connects.inc()
+
+        # Load the room into memory on first connect and send its state
+        self.room = await rooms.acquire(self.game_code)
+        if self.room:
+            await self.send_snapshot()
+
     async def disconnect(self, close_code):
+        metrics.ws_disconnects.inc()
         # Leave room group
         await self.channel_layer.group_discard(
             self.game_group_name,
             self.channel_name
         )
-    
+        if self.room:
+            await rooms.release(self.game_code)
+            self.room = None
+
     # Receive message from WebSocket
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
-        
+
         # Check the message type
-        if 'type' not in text_data_json:
+        if 'type' not in text_data_json or not self.room:
             return
-        
+
         message_type = text_data_json['type']
-        
+        log.debug('message_received', game=self.game_code, user=self.username, type=message_type)
+        # Only known types become metric labels
+        label = message_type if message_type in MESSAGE_TYPES else 'other'
+        metrics.ws_messages.inc(label)
+        with metrics.ws_latency.time(label):
+            await self.handle_message(message_type, text_data_json)
+
+    async def handle_message(self, message_type, text_data_json):
+        room = self.room
+
         if message_type == 'player_ready':
             # Update player ready status
             user_id = text_data_json.get('user_id', self.user_id)
             is_ready = text_data_json.get('is_ready', True)
-            
-            await self.update_player_ready_by_id(user_id, is_ready)
-            game_state = await self.get_game_state()
-            
-            # Send updated game state to group
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'game_state_update',
-                    'game': game_state
-                }
-            )
-            
+
+            player = room.get_player(user_id=user_id)
+            if player:
+                room.set_ready(player, is_ready)
+            else:
+                # First time we see this player: create the row, then track it
+                player = await self.get_or_create_player(user_id, is_ready)
+                if player is None:
+                    return
+                room.add_player(player)
+            rooms.schedule_flush(room)
+            await self.broadcast_ops()
+
         elif message_type == 'start_game':
             # Start the game (only host can do this)
             username = text_data_json.get('username', self.username)
-            game = await self.get_game()
-            host_user = await self.get_user_by_username(username)
-            
-            if game and host_user and game.host == host_user:
-                await self.start_game()
-                game_state = await self.get_game_state()
-                
-                # Send game started message to group
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        'type': 'game_started',
-                        'game': game_state
-                    }
-                )
-                
+
+            if username and username == room.host and room.start():
+                rooms.schedule_flush(room)
+                scheduler.question_opened(room)
+                await self.broadcast_ops()
+
         elif message_type == 'next_question':
             # Move to next question (only host can do this)
             username = text_data_json.get('username', self.username)
-            game = await self.get_game()
-            host_user = await self.get_user_by_username(username)
-            
-            if game and host_user and game.host == host_user:
-                await self.next_question()
-                game_state = await self.get_game_state()
-                
-                # Send next question message to group
-                await self.channel_layer.group_send(
-                    self.game_group_name,
-                    {
-                        'type': 'next_question',
-                        'game': game_state
-                    }
-                )
-                
+            # The question the host is leaving, so a late click cannot skip
+            # the one the reveal timer has just opened
+            expected = text_data_json.get('current_question')
+            if isinstance(expected, bool) or not isinstance(expected, int):
+                expected = None
+
+            if username and username == room.host and room.next_question(expected=expected):
+                rooms.schedule_flush(room)
+                scheduler.question_opened(room)
+                await self.broadcast_ops()
+
         elif message_type == 'submit_answer':
             # Submit player answer
             username = text_data_json.get('username', self.username)
             answer = text_data_json.get('answer')
-            answer_time = text_data_json.get('answer_time')
-            
+
             if username and answer is not None:
-                # Update the player's answer and calculate score
-                player = await self.update_player_answer_by_username(username, answer, answer_time)
-                
-                if player:
-                    # Get the updated game state with scores
-                    game_state = await self.get_game_state()
-                    
-                    # Send both the answer submission and updated game state
-                    await self.channel_layer.group_send(
-                        self.game_group_name,
-                        [
-                            {
-                                'type': 'answer_submitted',
-                                'player': player.user.username,
-                                'answer': answer,
-                                'is_correct': player.current_answer == answer  # Add this if needed
-                            },
-                            {
-                                'type': 'game_state_update',
-                                'game': game_state
-                            }
-                        ]
-                    )
-    
-    # Handlers for different message types to send to WebSocket
-    async def game_state_update(self, event):
-        game_data = event.get('game', {})
-        print(f"[WEBSOCKET] Sending game state update to client:")
-        print(f"  Type: game_state_update")
-        print(f"  Game status: {game_data.get('status')}")
-        print(f"  Players: {len(game_data.get('players', []))} players")
-        
-        # Log player scores
-        if 'players' in game_data:
-            print("  Player scores:")
-            for player in game_data['players']:
-                print(f"    {player.get('username')}: score={player.get('score')}, answered={player.get('has_answered')}")
-        
-        await self.send(text_data=json.dumps({
-            'type': 'game_state_update',
-            'game': game_data
-        }))
-    
-    async def game_started(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'game_started',
-            'game': event['game']
-        }))
-    
-    async def next_question(self, event):
+                # Scored and stored by the room's answer writer. The answer
+                # time is measured on the server, not taken from the client.
+                await answers.submit(room, username, answer)
+
+        elif message_type == 'chat_message':
+            # Only authenticated players of the room can chat, under their
+            # own name; ?username= is not proof of who is sending
+            player = room.get_player(user_id=self.chat_user_id) if self.chat_user_id is not None else None
+            if player is None:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'error': 'Only signed-in players of this game can chat'
+                }))
+                return
+            message = room.add_chat(player.user_id, player.username, text_data_json.get('message'))
+            if message is not None:
+                await rooms.send_chat(room, message)
+
+        elif message_type == 'resync':
+            # Client detected a gap in the op sequence
+            since = text_data_json.get('since')
+            ops = room.ops_since(since) if isinstance(since, int) else None
+            if ops is None:
+                await self.send_snapshot()
+            else:
+                await self.send(text_data=json.dumps({
+                    'type': 'state_delta',
+                    'ops': ops
+                }))
+
+    async def send_snapshot(self):
         await self.send(text_data=json.dumps({
-            'type': 'next_question',
-            'game': event['game']
+            'type': 'game_state',
+            'game': self.room.snapshot()
         }))
-    
-    async def answer_submitted(self, event):
-        # If this is a game state update, send it directly
-        if 'game' in event:
-            game_data = event['game']
-            print(f"[WEBSOCKET] Sending answer submission with game state update:")
-            print(f"  Type: game_state_update")
-            print(f"  Game status: {game_data.get('status')}")
-            
-            # Log player scores
-            if 'players' in game_data:
-                print("  Player scores after answer:")
-                for player in game_data['players']:
-                    print(f"    {player.get('username')}: score={player.get('score')}, answered={player.get('has_answered')}")
-            
-            await self.send(text_data=json.dumps({
-                'type': 'game_state_update',
-                'game': game_data
-            }))
-        # Otherwise, send the answer submission
-        else:
-            print(f"[WEBSOCKET] Sending answer submission:")
-            print(f"  Player: {event.get('player')}")
-            print(f"  Answer: {event.get('answer')}")
-            print(f"  Is correct: {event.get('is_correct', False)}")
-            
-            await self.send(text_data=json.dumps({
-                'type': 'answer_submitted',
-                'player': event['player'],
-                'answer': event['answer'],
-                'is_correct': event.get('is_correct', False)
-            }))
-    
+
+    async def broadcast_ops(self):
+        # Send the ops produced by the last mutation to everyone in the room
+        await rooms.broadcast(self.room)
+
+    # Handlers for different message types to send to WebSocket
+    async def state_delta(self, event):
+        await self.send(text_data=event['text'])
+
+    async def chat_message(self, event):
+        await self.send(text_data=event['text'])
+
     # Database access methods
     @database_sync_to_async
-    def get_game(self):
-        try:
-            return GameRoom.objects.get(code=self.game_code)
-        except GameRoom.DoesNotExist:
-            return None
-    
-    @database_sync_to_async
-    def get_game_state(self):
-        try:
-            game = GameRoom.objects.get(code=self.game_code)
-            players = Player.objects.filter(game=game).select_related('user')
-            
-            # Log game state before sending
-            print(f"[WEBSOCKET] Preparing game state for {self.game_code}:")
-            print(f"  Status: {game.status}, Current Question: {game.current_question}")
-            print("  Players:")
-            
-            # Format the data for the frontend
-            player_data = []
-            for player in players:
-                player_data.append({
-                    'username': player.user.username,
-                    'score': player.score,
-                    'is_ready': player.is_ready,
-                    'has_answered': player.current_answer is not None
-                })
-                print(f"    {player.user.username}: score={player.score}, answered={player.current_answer is not None}, answer={player.current_answer}")
-                
-            # Log the complete player data being sent
-            print(f"[WEBSOCKET] Sending player data: {player_data}")
-            
-            # Return game state with current question
-            return {
-                'code': game.code,
-                'status': game.status,
-                'host': game.host.username,
-                'current_question': game.current_question,
-                'players': player_data,
-                'quiz_data': game.quiz_data
-            }
-        except GameRoom.DoesNotExist:
-            return None
-    
+    def user_for_token(self, key):
+        token = Token.objects.select_related('user').filter(key=key, user__is_active=True).first()
+        return token.user if token else None
+
     @database_sync_to_async
-    def update_player_ready(self, user_id, is_ready):
+    def get_or_create_player(self, user_id, is_ready):
         try:
             game = GameRoom.objects.get(code=self.game_code)
             user = User.objects.get(id=user_id)
@@ -260,146 +219,455 @@ class GameConsumer(AsyncWebsocketConsumer):
                 game=game,
                 defaults={'is_ready': is_ready}
             )
-            
+
             if not created:
                 player.is_ready = is_ready
                 player.save()
-            
+
             return player
-        except (GameRoom.DoesNotExist, User.DoesNotExist):
+        except (GameRoom.DoesNotExist, User.DoesNotExist, ValueError, TypeError):
             return None
-    
-    @database_sync_to_async
-    def start_game(self):
-        try:
-            game = GameRoom.objects.get(code=self.game_code)
-            if game.status == 'waiting':
-                game.status = 'in_progress'
-                game.started_at = timezone.now()
-                game.current_question = 0
-                game.save()
-            return game
-        except GameRoom.DoesNotExist:
+
+
+# Upper bound on how long a long-poll request is parked
+LONG_POLL_TIMEOUT = 55
+
+# SSE streams send a comment this often so proxies keep them open, and end
+# after STREAM_LIFETIME; EventSource reconnects with Last-Event-ID
+SSE_HEARTBEAT = 15
+STREAM_LIFETIME = 300
+
+
+class ApiHttpConsumer(AsyncHttpConsumer):
+    """
+    Base for API endpoints served by consumers rather than Django views,
+    for requests that spend most of their time waiting.
+
+    These run on the ASGI app directly, outside Django's middleware, so
+    token authentication and CORS headers are handled here. Subclasses
+    implement serve(); the authenticated user is in self.user.
+    """
+    methods = ('GET',)
+    allow_headers = b'authorization, content-type'
+
+    async def handle(self, body):
+        self.params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.headers = {k.decode().lower(): v.decode() for k, v in self.scope.get('headers', [])}
+        method = self.scope['method']
+
+        if method == 'OPTIONS':
+            await self.send_response(204, b'', headers=self.cors_headers() + [
+                (b'Access-Control-Allow-Methods', ', '.join(self.methods + ('OPTIONS',)).encode()),
+                (b'Access-Control-Allow-Headers', self.allow_headers),
+            ])
+            return
+
+        if method not in self.methods:
+            await self.send_json(405, {'detail': f'Method "{method}" not allowed.'})
+            return
+
+        self.user = await self.authenticate()
+        if self.user is None:
+            await self.send_json(401, {'detail': 'Authentication credentials were not provided.'})
+            return
+
+        await self.serve(body)
+
+    async def serve(self, body):
+        raise NotImplementedError
+
+    async def authenticate(self):
+        """
+        Accept "Token <key>" or "Bearer <key>" in Authorization, or ?token=
+        for clients that can't set headers (EventSource). Returns the user
+        or None.
+        """
+        key = None
+        auth = self.headers.get('authorization', '').split()
+        if len(auth) == 2 and auth[0] in ('Token', 'Bearer'):
+            key = auth[1]
+        elif self.params.get('token'):
+            key = self.params['token'][0]
+        if not key:
             return None
-    
+        return await self.user_for_token(key)
+
     @database_sync_to_async
-    def next_question(self):
+    def user_for_token(self, key):
+        token = Token.objects.select_related('user').filter(key=key, user__is_active=True).first()
+        return token.user if token else None
+
+    def cors_headers(self):
+        origin = self.headers.get('origin')
+        allowed = [o.rstrip('/') for o in settings.CORS_ALLOWED_ORIGINS]
+        if not origin or (origin not in allowed and not getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False)):
+            return []
+        return [
+            (b'Access-Control-Allow-Origin', origin.encode()),
+            (b'Access-Control-Allow-Credentials', b'true'),
+            (b'Access-Control-Expose-Headers', b'ETag'),
+            (b'Vary', b'Origin'),
+        ]
+
+    async def send_json(self, status, data, headers=()):
+        await self.send_response(status, json.dumps(data).encode(), headers=self.cors_headers() + [
+            (b'Content-Type', b'application/json'),
+        ] + list(headers))
+
+    def json_body(self, body):
+        """
+        The request body as a dict, or None if it isn't a JSON object.
+        """
         try:
-            game = GameRoom.objects.get(code=self.game_code)
-            if game.status == 'in_progress':
-                # Reset all player answers for the next question
-                Player.objects.filter(game=game).update(current_answer=None, answer_time=None)
-                
-                # Move to the next question
-                total_questions = len(game.quiz_data.get('questions', []))
-                game.current_question += 1
-                
-                # Check if the game is complete
-                if game.current_question >= total_questions:
-                    game.status = 'completed'
-                    game.ended_at = timezone.now()
-                
-                game.save()
-            return game
-        except GameRoom.DoesNotExist:
+            data = json.loads(body or b'{}')
+        except ValueError:
             return None
-    
-    @database_sync_to_async
-    def get_user_by_username(self, username):
+        return data if isinstance(data, dict) else None
+
+
+class RoomHttpConsumer(ApiHttpConsumer):
+    """
+    Base for the HTTP endpoints that park on a room instead of polling it.
+    Requests for rooms owned by another worker are redirected there.
+    """
+    allow_headers = b'authorization, if-none-match, last-event-id'
+
+    async def serve(self, body):
+        self.game_code = self.scope['url_route']['kwargs']['game_code']
+        if not is_local_room(self.game_code):
+            location = owner_for_room(self.game_code).rstrip('/') + self.scope['path']
+            await self.send_response(307, b'', headers=self.cors_headers() + [
+                (b'Location', location.encode()),
+            ])
+            return
+
+        await self.respond()
+
+    async def respond(self):
+        raise NotImplementedError
+
+
+class GameStatusPollConsumer(RoomHttpConsumer):
+    """
+    GET /api/game/<code>/poll/
+
+    Long-poll version of the status endpoint. A request whose If-None-Match
+    (or ?etag=) matches the room's current ETag is parked until the room
+    changes, then gets the new status; after ?timeout= seconds (default and
+    max LONG_POLL_TIMEOUT) it gets a 304 and the client asks again.
+    """
+
+    async def respond(self):
+        etag = self.headers.get('if-none-match') or self.params.get('etag', [''])[0]
         try:
-            return User.objects.get(username=username)
-        except User.DoesNotExist:
-            return None
-            
-    @database_sync_to_async
-    def update_player_ready_by_username(self, username, is_ready):
+            timeout = min(float(self.params.get('timeout', [LONG_POLL_TIMEOUT])[0]), LONG_POLL_TIMEOUT)
+        except ValueError:
+            timeout = LONG_POLL_TIMEOUT
+
+        room = await rooms.wait(self.game_code, etag, max(timeout, 0))
+        if room is None:
+            await self.send_json(404, {'success': False, 'error': 'Game not found'})
+            return
+
+        current, body = room.rendered_status()
+        headers = self.cors_headers() + [
+            (b'ETag', current.encode()),
+            (b'Cache-Control', b'no-cache'),
+        ]
+        if current == etag:
+            await self.send_response(304, b'', headers=headers)
+        else:
+            await self.send_response(200, body, headers=headers + [(b'Content-Type', b'application/json')])
+
+
+class GameEventsConsumer(RoomHttpConsumer):
+    """
+    GET /api/game/<code>/events/
+
+    Server-sent events stream of the status endpoint: one `status` event
+    (id = ETag) per change, starting from Last-Event-ID if given. The stream
+    closes when the game completes or after STREAM_LIFETIME seconds.
+    """
+
+    async def respond(self):
+        loop = asyncio.get_running_loop()
+        last = self.headers.get('last-event-id', '')
+        room = await rooms.wait(self.game_code, last, 0)
+        if room is None:
+            await self.send_json(404, {'success': False, 'error': 'Game not found'})
+            return
+
+        await self.send_headers(headers=self.cors_headers() + [
+            (b'Content-Type', b'text/event-stream'),
+            (b'Cache-Control', b'no-cache'),
+            (b'X-Accel-Buffering', b'no'),
+        ])
+        deadline = loop.time() + STREAM_LIFETIME
+        while room is not None and loop.time() < deadline:
+            etag, body = room.rendered_status()
+            if etag != last:
+                last = etag
+                await self.send_body(b'id: %s\nevent: status\ndata: %s\n\n' % (etag.encode(), body), more_body=True)
+                if room.status == 'completed':
+                    break
+            else:
+                await self.send_body(b': keepalive\n\n', more_body=True)
+            room = await rooms.wait(self.game_code, last, min(SSE_HEARTBEAT, deadline - loop.time()))
+        await self.send_body(b'')
+
+
+def quiz_options(data):
+    """
+    ((topic, difficulty, count, model), None) from a generate-quiz request
+    body, or (None, error message).
+    """
+    if data is None:
+        return None, 'Request body must be a JSON object'
+    topic = data.get('topic')
+    if not topic:
+        return None, 'Topic is required'
+    try:
+        count = int(data.get('count', 5))
+    except (TypeError, ValueError):
+        return None, 'Count must be a number'
+    if not 1 <= count <= settings.QUIZ_MAX_QUESTIONS:
+        return None, f'Count must be between 1 and {settings.QUIZ_MAX_QUESTIONS}'
+    return (topic, data.get('difficulty', 'medium'), count, data.get('model', quizGenerator.DEFAULT_MODEL)), None
+
+
+async def bank_quiz(data, topic, difficulty, count):
+    """
+    Record the request's demand, then return (quiz, 'bank') assembled
+    from the question bank, or (None, None) if it can't be or the request
+    asks for a fresh quiz.
+    """
+    await database_sync_to_async(record_demand)(topic, difficulty, count)
+    if data.get('fresh'):
+        return None, None
+    quiz_data = await database_sync_to_async(questionBank.assemble)(topic, difficulty, count)
+    if quiz_data is None:
+        return None, None
+    metrics.quiz_cache.inc('bank')
+    return quiz_data, 'bank'
+
+
+# Seconds a client should wait before retrying when all generation slots are taken
+BUSY_RETRY_AFTER = 5
+
+
+class QuizGenerateConsumer(ApiHttpConsumer):
+    """
+    POST /api/generate-quiz/
+
+    Same request and response as views.generate_quiz, with the call to the
+    model awaited on the pooled async client, so a slow generation holds a
+    socket rather than a worker thread. 503 when every generation slot is
+    taken, 504 when the model doesn't answer within GROQ_TIMEOUT.
+    """
+    methods = ('POST',)
+
+    async def serve(self, body):
+        data = self.json_body(body)
+        options, error = quiz_options(data)
+        if error:
+            await self.send_json(400, {"error": error})
+            return
+        topic, difficulty, count, model = options
+
         try:
-            user = User.objects.get(username=username)
-            game = GameRoom.objects.get(code=self.game_code)
-            
-            player, created = Player.objects.get_or_create(
-                user=user,
-                game=game,
-                defaults={'is_ready': is_ready}
-            )
-            
-            if not created:
-                player.is_ready = is_ready
-                player.save()
-            
-            return player
-        except (GameRoom.DoesNotExist, User.DoesNotExist):
-            return None
-    
-    @database_sync_to_async
-    def update_player_answer_by_username(self, username, answer, answer_time):
+            quiz_data, source = await bank_quiz(data, topic, difficulty, count)
+            if quiz_data is None:
+                quiz_data, source = await quiz_cache.aget_or_generate(
+                    topic, difficulty, count, model,
+                    lambda: quizPlanner.agenerate(topic, difficulty, count, model)
+                )
+        except QuizParseError as json_error:
+            await self.send_json(400, {
+                "success": False,
+                "error": f"Failed to parse quiz data: {str(json_error)}",
+                "raw_response": json_error.raw_response
+            })
+            return
+        except GeneratorBusy as busy:
+            await self.send_json(503, {"error": str(busy)},
+                                 headers=[(b'Retry-After', str(BUSY_RETRY_AFTER).encode())])
+            return
+        except GeneratorTimeout as timeout:
+            await self.send_json(504, {"error": str(timeout)})
+            return
+        except Exception as e:
+            log.exception('generate_quiz_failed')
+            await self.send_json(500, {"error": str(e)})
+            return
+
+        # Games created from this quiz are ranked under its topic
+        quiz_data.setdefault("topic", topic)
+        await self.send_json(200, {
+            "success": True,
+            "quiz": quiz_data,
+            "topic": topic,
+            "difficulty": difficulty,
+            "count": count,
+            "cache": source
+        })
+
+
+class GroqChatConsumer(ApiHttpConsumer):
+    """
+    POST /api/groq-chat/
+
+    Async version of views.groq_chat, on the pooled client.
+    """
+    methods = ('POST',)
+
+    async def serve(self, body):
+        data = self.json_body(body)
+        if data is None or not data.get('prompt'):
+            await self.send_json(400, {"error": "Prompt is required"})
+            return
+        model = data.get('model', quizGenerator.DEFAULT_MODEL)
+
         try:
-            game = GameRoom.objects.get(code=self.game_code)
-            user = User.objects.get(username=username)
-            player = Player.objects.get(user=user, game=game)
-            
-            # Only update if the player hasn't answered yet
-            if player.current_answer is None:
-                player.current_answer = answer
-                player.answer_time = answer_time
-                
-                # Update score if correct
-                if game.status == 'in_progress' and game.quiz_data:
-                    current_q_index = game.current_question
-                    questions = game.quiz_data.get('questions', [])
-                    
-                    if current_q_index < len(questions):
-                        current_question = questions[current_q_index]
-                        correct_answer = current_question.get('correct_answer')
-                        
-                        if answer == correct_answer:
-                            # Calculate score based on answer time (faster = more points)
-                            max_time = game.quiz_data.get('timePerQuestion', 30)
-                            # Ensure answer_time is not None and is a number
-                            answer_time_float = float(answer_time) if answer_time is not None else max_time
-                            # Calculate time factor (1.0 for instant answer, decreasing to 0.1 for last second)
-                            time_factor = max(0.1, 1.0 - (answer_time_float / max_time) * 0.9)
-                            # Base points per question (1000) multiplied by time factor
-                            points = int(1000 * time_factor)
-                            player.score = player.score + points if player.score else points
-                            print(f"Player {username} scored {points} points (total: {player.score})")
-                
-                player.save()
-            
-            return player
+            completion = await quizGenerator.achat(
+                data['prompt'], model,
+                max_tokens=data.get('max_tokens', 1024),
+                temperature=data.get('temperature', 1.0),
+            )
+        except GeneratorBusy as busy:
+            await self.send_json(503, {"error": str(busy)},
+                                 headers=[(b'Retry-After', str(BUSY_RETRY_AFTER).encode())])
+            return
+        except GeneratorTimeout as timeout:
+            await self.send_json(504, {"error": str(timeout)})
+            return
         except Exception as e:
-            print(f"Error in update_player_answer_by_username: {str(e)}")
-            return None
-    
-    @database_sync_to_async
-    def update_player_answer(self, user_id, answer, answer_time):
+            log.exception('groq_chat_failed')
+            await self.send_json(500, {"error": str(e)})
+            return
+
+        await self.send_json(200, {
+            "success": True,
+            "response": completion.choices[0].message.content,
+            "model": model,
+            "usage": {
+                "input_tokens": completion.usage.prompt_tokens,
+                "output_tokens": completion.usage.completion_tokens,
+                "total_tokens": completion.usage.total_tokens
+            }
+        })
+
+
+class QuizStreamConsumer(ApiHttpConsumer):
+    """
+    POST /api/generate-quiz/stream/
+
+    Quiz generation as server-sent events, each question sent as soon as
+    the model has written it:
+
+        event: meta      {"topic", "difficulty", "count", "game_code"}
+        event: question  {"index", "question"}, one per question
+        event: done      {"success", "quiz", "cache", "game_code"}
+        event: error     {"error", "status"[, "raw_response"]}
+
+    With "create_game": true in the body a game room is created first
+    (its code is in `meta`) and questions go straight into it, so the host
+    can open the lobby and start while the rest are still being written;
+    players who reach the last available question wait for the next one.
+    A cached quiz, or one from the question bank, arrives all at once.
+    """
+    methods = ('POST',)
+
+    async def serve(self, body):
+        data = self.json_body(body)
+        options, error = quiz_options(data)
+        if error:
+            await self.send_json(400, {"error": error})
+            return
+        topic, difficulty, count, model = options
+
+        room = None
+        if data.get('create_game'):
+            seconds, error = time_per_question(data)
+            if error:
+                await self.send_json(400, {"error": error})
+                return
+            room = await database_sync_to_async(create_generating_game)(self.user, topic, seconds)
+
+        await self.send_headers(headers=self.cors_headers() + [
+            (b'Content-Type', b'text/event-stream'),
+            (b'Cache-Control', b'no-cache'),
+            (b'X-Accel-Buffering', b'no'),
+        ])
+        game_code = room.code if room is not None else None
+        await self.send_event('meta', {'topic': topic, 'difficulty': difficulty, 'count': count,
+                                       'game_code': game_code})
         try:
-            game = GameRoom.objects.get(code=self.game_code)
-            user = User.objects.get(id=user_id)
-            player = Player.objects.get(user=user, game=game)
-            
-            # Only update if the player hasn't answered yet
-            if player.current_answer is None:
-                player.current_answer = answer
-                player.answer_time = answer_time
-                
-                # Update score if correct
-                if game.status == 'in_progress':
-                    current_q_index = game.current_question
-                    if current_q_index < len(game.quiz_data.get('questions', [])):
-                        current_question = game.quiz_data['questions'][current_q_index]
-                        correct_answer = current_question.get('correct_answer')
-                        
-                        if answer == correct_answer:
-                            # Calculate score based on answer time (faster = more points)
-                            # For example, max 1000 points, decreasing with time
-                            max_time = game.quiz_data.get('timePerQuestion', 30)
-                            time_factor = max(0, 1 - (answer_time / max_time))
-                            points = int(1000 * time_factor)
-                            player.score += points
-                
-                player.save()
-            
-            return player
-        except (GameRoom.DoesNotExist, User.DoesNotExist, Player.DoesNotExist):
-            return None 
\ No newline at end of file
+            quiz_data, source = await bank_quiz(data, topic, difficulty, count)
+            if quiz_data is not None:
+                await self.questions_ready(room, quiz_data['questions'], 0)
+                if room is not None:
+                    await rooms.generation_finished(room, quiz_data)
+            else:
+                quiz_data, source = await self.generate(room, topic, difficulty, count, model)
+        except QuizParseError as json_error:
+            await self.send_event('error', {'error': f'Failed to parse quiz data: {json_error}', 'status': 400,
+                                            'raw_response': json_error.raw_response})
+        except GeneratorBusy as busy:
+            await self.send_event('error', {'error': str(busy), 'status': 503})
+        except GeneratorTimeout as timeout:
+            await self.send_event('error', {'error': str(timeout), 'status': 504})
+        except Exception as e:
+            log.exception('generate_quiz_failed', stream=True)
+            await self.send_event('error', {'error': str(e), 'status': 500})
+        else:
+            quiz_data.setdefault('topic', topic)
+            await self.send_event('done', {'success': True, 'quiz': quiz_data, 'cache': source,
+                                           'game_code': game_code})
+        finally:
+            if room is not None and room.generating:
+                # Keep what arrived before the failure
+                await rooms.generation_finished(room)
+        await self.send_body(b'')
+
+    async def generate(self, room, topic, difficulty, count, model):
+        quiz_data, source = await quiz_cache.aget(topic, difficulty, count, model)
+        if quiz_data is not None:
+            await self.questions_ready(room, quiz_data['questions'], 0)
+            if room is not None:
+                await rooms.generation_finished(room, quiz_data)
+            return quiz_data, source
+
+        started = time.perf_counter()
+        first_question = None
+        # Large quizzes are written by several completions at once; their
+        # questions arrive interleaved, duplicates already dropped
+        quiz_plan = quizPlanner.QuizPlan(count)
+        sent = 0
+        async for question in quizPlanner.astream(quiz_plan, topic, difficulty, model):
+            if first_question is None:
+                first_question = time.perf_counter() - started
+                metrics.quiz_first_question.observe(first_question)
+            await self.questions_ready(room, [question], sent)
+            sent += 1
+        quiz_data = quiz_plan.quiz()
+        if room is not None:
+            await rooms.generation_finished(room, quiz_data)
+        # A quiz left short by failed or cut-off parts isn't cached
+        if quiz_plan.complete:
+            await quiz_cache.aput(topic, difficulty, count, model, quiz_data)
+        log.info('quiz_streamed', topic=topic, questions=len(quiz_data['questions']), parts=quiz_plan.rounds,
+                 duplicates=quiz_plan.duplicates, first_question=round(first_question, 3) if first_question is not None else None,
+                 seconds=round(time.perf_counter() - started, 3))
+        return quiz_data, 'generated'
+
+    async def questions_ready(self, room, questions, first_index):
+        if not questions:
+            return
+        if room is not None:
+            await rooms.questions_generated(room, questions)
+        for i, question in enumerate(questions):
+            await self.send_event('question', {'index': first_index + i, 'question': question})
+
+    async def send_event(self, event, data):
+        await self.send_body(b'event: %s\ndata: %s\n\n' % (event.encode(), json.dumps(data).encode()),
+                             more_body=True)
@@ -0,0 +1,262 @@
+"""
+Channel layer that shares groups between worker processes over pub/sub.
+
+Works against Redis or the bundled stand-in broker (base.broker). Each
+process keeps its own sockets' queues in memory, subscribes to one pub/sub
+channel per group it has local members in, and one for messages addressed
+to its own specific channels. A group_send is a single PUBLISH, so its cost
+does not grow with the number of workers.
+"""
+import asyncio
+import json
+import random
+import string
+import uuid
+from collections import deque
+from urllib.parse import urlparse
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .broker import ProtocolError, encode_command, read_value
+from .logs import get_logger
+
+log = get_logger('ws')
+
+
+class PubSubChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, url='redis://127.0.0.1:6379', prefix='asgi', expiry=60,
+                 capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.prefix = prefix
+        # Unique id of this process; specific channel names embed it so
+        # any worker can tell where to deliver them
+        self.client_id = uuid.uuid4().hex[:12]
+
+        self.channels = {}
+        self.groups = {}
+        self._loop = None
+        self._publisher = None
+        self._subscriber = None
+        self._tasks = []
+        self._replies = deque()
+        self._connect_lock = None
+
+    # Pub/sub channel names
+
+    def _group_topic(self, group):
+        return f'{self.prefix}:group:{group}'
+
+    def _client_topic(self, client_id):
+        return f'{self.prefix}:client:{client_id}'
+
+    # Connections
+
+    async def _ensure_connected(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First use, or the previous loop went away (e.g. async_to_sync)
+            self._loop = loop
+            self._publisher = None
+            self._subscriber = None
+            self._tasks = []
+            self._replies = deque()
+            self._connect_lock = asyncio.Lock()
+        if self._publisher is not None:
+            return
+        async with self._connect_lock:
+            if self._publisher is not None:
+                return
+            subscriber = await asyncio.open_connection(self.host, self.port)
+            topics = [self._client_topic(self.client_id)] + [self._group_topic(g) for g in self.groups]
+            subscriber[1].write(encode_command('SUBSCRIBE', *topics))
+            try:
+                publisher = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                subscriber[1].close()
+                raise
+            self._subscriber = subscriber
+            self._tasks = [
+                loop.create_task(self._read_messages(subscriber)),
+                loop.create_task(self._read_replies(publisher)),
+            ]
+            self._publisher = publisher
+
+    async def _command(self, *args):
+        """
+        Pipelined command: write it and wait for its reply in order.
+        """
+        await self._ensure_connected()
+        if self._publisher is None:
+            raise ConnectionError('channel layer publisher disconnected')
+        reply = self._loop.create_future()
+        self._replies.append(reply)
+        self._publisher[1].write(encode_command(*args))
+        return await reply
+
+    async def _read_replies(self, connection):
+        while True:
+            try:
+                value = await read_value(connection[0])
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                self._disconnected(connection, e)
+                return
+            reply = self._replies.popleft()
+            if reply.done():
+                continue
+            if isinstance(value, ProtocolError):
+                # -ERR reply: the command failed
+                reply.set_exception(value)
+            else:
+                reply.set_result(value)
+
+    def _disconnected(self, connection, error):
+        """
+        Drop both connections after either one failed, so the next command
+        opens a fresh pair and subscribes again. A subscriber left open
+        would keep delivering next to its replacement, so every message
+        would arrive twice.
+        """
+        if connection is not self._publisher and connection is not self._subscriber:
+            # A connection replaced already
+            return
+        log.warning('channel_layer_disconnected', error=repr(error))
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        for pair in (self._publisher, self._subscriber):
+            if pair is not None:
+                pair[1].close()
+        self._tasks = []
+        self._publisher = None
+        self._subscriber = None
+        while self._replies:
+            reply = self._replies.popleft()
+            if not reply.done():
+                reply.set_exception(ConnectionError(str(error)))
+
+    async def _subscribe(self, command, topic):
+        await self._ensure_connected()
+        if self._subscriber is None:
+            raise ConnectionError('channel layer subscriber disconnected')
+        writer = self._subscriber[1]
+        writer.write(encode_command(command, topic))
+        await writer.drain()
+
+    async def _read_messages(self, connection):
+        while True:
+            try:
+                reply = await read_value(connection[0])
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                self._disconnected(connection, e)
+                return
+            if isinstance(reply, ProtocolError):
+                # A failed SUBSCRIBE leaves groups without messages; start
+                # over with a new pair of connections
+                self._disconnected(connection, reply)
+                return
+            if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                self._deliver(json.loads(reply[2]))
+
+    def _deliver(self, envelope):
+        if envelope.get('origin') == self.client_id:
+            # Already delivered locally by group_send
+            return
+        if 'group' in envelope:
+            self._deliver_group(envelope['group'], envelope['message'])
+        else:
+            self._put(envelope['channel'], envelope['message'])
+
+    # Local queues
+
+    def _put(self, channel, message):
+        queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            raise ChannelFull(channel)
+
+    def _deliver_group(self, group, message):
+        for channel in list(self.groups.get(group, ())):
+            try:
+                self._put(channel, dict(message))
+            except ChannelFull:
+                # Same as the other layers: a full socket drops group messages
+                pass
+
+    def _is_local(self, channel):
+        return f'.{self.client_id}!' in channel
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        if self._is_local(channel):
+            self._put(channel, dict(message))
+            return
+        client_id = channel.split('!', 1)[0].rsplit('.', 1)[-1]
+        await self._command('PUBLISH', self._client_topic(client_id), json.dumps({
+            'channel': channel,
+            'message': message,
+        }))
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        await self._ensure_connected()
+        queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+        return await queue.get()
+
+    async def new_channel(self, prefix='specific'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{prefix}.{self.client_id}!{suffix}'
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        members = self.groups.setdefault(group, set())
+        first = not members
+        members.add(channel)
+        if first:
+            await self._subscribe('SUBSCRIBE', self._group_topic(group))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        members = self.groups.get(group)
+        if not members:
+            return
+        members.discard(channel)
+        if not members:
+            del self.groups[group]
+            await self._subscribe('UNSUBSCRIBE', self._group_topic(group))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        self._deliver_group(group, message)
+        await self._command('PUBLISH', self._group_topic(group), json.dumps({
+            'origin': self.client_id,
+            'group': group,
+            'message': message,
+        }))
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = {}
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for connection in (self._publisher, self._subscriber):
+            if connection is not None:
+                connection[1].close()
+        self._publisher = None
+        self._subscriber = None
+        self._loop = None
@@ -0,0 +1,204 @@
+"""
+Structured logging for the game server.
+
+Loggers live under `mindclash.<subsystem>` (game, ws, answers, quiz) so each
+subsystem's level can be set on its own (LOG_LEVELS in settings). Records
+are written as one JSON object per line by a background thread:
+QueueLogHandler only drops the record on a bounded queue, so logging from
+the daphne event loop never waits on stdout. Hot paths log through
+`get_logger(...)`, whose calls return before building anything when the
+level is disabled or the event is over its rate limit (RateLimitFilter).
+"""
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT = 'mindclash'
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """
+    log.info('answer_received', game=code, answer=answer)
+
+    Keyword arguments become fields of the JSON record. The level check
+    and the rate limit come before any record is built, so a disabled or
+    sampled-out call costs next to nothing.
+    """
+
+    def __init__(self, logger, limiter=None):
+        super().__init__(logger, {})
+        self.limiter = limiter
+
+    def log(self, level, event, *args, exc_info=None, stack_info=False, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.limiter is not None:
+            allowed, suppressed = self.limiter.allow(self.logger.name, event, level)
+            if not allowed:
+                return
+            if suppressed:
+                fields['suppressed'] = suppressed
+        self.logger._log(level, event, args, exc_info=exc_info, stack_info=stack_info,
+                         extra={'fields': fields})
+
+    def debug(self, event, *args, **fields):
+        self.log(logging.DEBUG, event, *args, **fields)
+
+    def info(self, event, *args, **fields):
+        self.log(logging.INFO, event, *args, **fields)
+
+    def warning(self, event, *args, **fields):
+        self.log(logging.WARNING, event, *args, **fields)
+
+    def error(self, event, *args, **fields):
+        self.log(logging.ERROR, event, *args, **fields)
+
+    def exception(self, event, *args, **fields):
+        self.log(logging.ERROR, event, *args, exc_info=True, **fields)
+
+
+_limiter = None
+
+
+def get_logger(subsystem):
+    """
+    Logger for `mindclash.<subsystem>`, sharing one rate limiter configured
+    by LOG_RATE_LIMIT (records per second, burst) in settings.
+    """
+    global _limiter
+    if _limiter is None:
+        from django.conf import settings
+        rate, burst = getattr(settings, 'LOG_RATE_LIMIT', (20, 50))
+        _limiter = RateLimitFilter(rate, burst)
+    return StructuredLogger(logging.getLogger(f'{ROOT}.{subsystem}'), _limiter)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per (logger, event): at most `rate` records per second with
+    bursts of `burst`. The next record let through carries the number
+    dropped in between as `suppressed`. Records at `exempt_level` or above
+    always pass. Used by StructuredLogger before a record is built, and
+    usable as a handler filter for other loggers.
+    """
+
+    def __init__(self, rate=10, burst=20, exempt_level='WARNING'):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.exempt_level = logging._checkLevel(exempt_level)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, name, event, level):
+        """
+        Return (allowed, number suppressed since the last allowed record).
+        """
+        if level >= self.exempt_level:
+            return True, 0
+        key = (name, event)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                return False, 0
+            self._buckets[key] = (tokens - 1, now, 0)
+        return True, dropped
+
+    def filter(self, record):
+        allowed, suppressed = self.allow(record.name, record.msg, record.levelno)
+        if allowed and suppressed:
+            record.fields = dict(getattr(record, 'fields', None) or {}, suppressed=suppressed)
+        return allowed
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Hands records to a background thread that writes them to `stream`.
+
+    The queue is bounded; when it is full the record is dropped and
+    counted instead of blocking the caller. The number dropped is logged
+    once the queue has room again.
+    """
+
+    def __init__(self, stream='ext://sys.stdout', maxsize=10000, level=logging.NOTSET):
+        super().__init__(queue.Queue(maxsize))
+        self.setLevel(level)
+        if stream == 'ext://sys.stderr':
+            stream = sys.stderr
+        elif stream == 'ext://sys.stdout' or stream is None:
+            stream = sys.stdout
+        self.target = logging.StreamHandler(stream)
+        self.target.setFormatter(JsonFormatter())
+        self.dropped = 0
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the writer thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Keep the record as is (fields, exc_info) and let the writer thread
+        # format it; only resolve the message and traceback text here since
+        # args and tracebacks may not outlive the call
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._listener is None:
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            note = logging.LogRecord(record.name, logging.WARNING, __file__, 0, 'log_records_dropped', None, None)
+            note.fields = {'count': dropped}
+            try:
+                self.queue.put_nowait(note)
+            except queue.Full:
+                self.dropped += dropped
+
+    def _start(self):
+        with self._start_lock:
+            if self._listener is None:
+                self._listener = QueueListener(self.queue, self.target)
+                self._listener.start()
+                atexit.register(self.close)
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        self.target.close()
+        super().close()
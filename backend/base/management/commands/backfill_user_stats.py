@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from base.models import GameRoom, UserStats
+from base.service.userStats import pending_games, record_games
+
+
+class Command(BaseCommand):
+    help = 'Add completed games that are not in UserStats yet, e.g. games played before it existed'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Games recorded per transaction')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop all UserStats and recompute them from every completed game')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                UserStats.objects.all().delete()
+                GameRoom.objects.filter(stats_recorded=True).update(stats_recorded=False)
+
+        batch_size = max(1, options['batch_size'])
+        recorded = 0
+        last_id = 0
+        while True:
+            # Walk by id so games that can't be recorded are not picked again
+            ids = list(pending_games().filter(id__gt=last_id).order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            recorded += record_games(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'{recorded} games recorded')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {recorded} games, {UserStats.objects.count()} users with stats'))
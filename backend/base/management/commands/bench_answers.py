@@ -0,0 +1,86 @@
+import asyncio
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from base.models import GameRoom, Player
+from base.service.answerPipeline import answers
+from base.service.roomState import rooms
+
+
+class Command(BaseCommand):
+    help = 'Compare answers/second of the batched answer pipeline with per-request read-modify-write'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=100)
+        parser.add_argument('--questions', type=int, default=5)
+
+    def handle(self, *args, **options):
+        players, questions = options['players'], options['questions']
+        prefix = f'bench_{uuid.uuid4().hex[:6]}'
+        users = [User(username=f'{prefix}_{i}') for i in range(players)]
+        User.objects.bulk_create(users)
+        users = list(User.objects.filter(username__startswith=prefix))
+        quiz = {
+            'timePerQuestion': 30,
+            'questions': [{'question': f'Q{i}', 'options': ['A', 'B', 'C', 'D'], 'correct_answer': i % 4}
+                          for i in range(questions)],
+        }
+        games = []
+        try:
+            legacy = self.run_legacy(users, quiz, games)
+            batched = self.run_pipeline(users, quiz, games)
+        finally:
+            GameRoom.objects.filter(id__in=[g.id for g in games]).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+        self.stdout.write(f'read-modify-write: {legacy:10.0f} answers/s')
+        self.stdout.write(f'batched pipeline:  {batched:10.0f} answers/s')
+
+    def new_game(self, users, quiz, games):
+        game = GameRoom.objects.create(host=users[0], quiz_data=quiz, status='in_progress')
+        Player.objects.bulk_create([Player(user=user, game=game) for user in users])
+        games.append(game)
+        return game
+
+    def run_legacy(self, users, quiz, games):
+        """
+        The old path: every answer loads game, user and player, then saves.
+        """
+        game = self.new_game(users, quiz, games)
+        start = time.perf_counter()
+        count = 0
+        for index, question in enumerate(quiz['questions']):
+            for user in users:
+                game = GameRoom.objects.get(code=game.code)
+                player = Player.objects.get(user=User.objects.get(username=user.username), game=game)
+                player.current_answer = question['correct_answer']
+                player.score += 500
+                player.save()
+                count += 1
+            Player.objects.filter(game=game).update(current_answer=None)
+        return count / (time.perf_counter() - start)
+
+    def run_pipeline(self, users, quiz, games):
+        game = self.new_game(users, quiz, games)
+        room = rooms.get(game.code)
+
+        async def answer_all(question):
+            await asyncio.gather(*(
+                answers.submit(room, user.username, question['correct_answer'], 1.0)
+                for user in users
+            ))
+
+        start = time.perf_counter()
+        count = 0
+        for question in quiz['questions']:
+            asyncio.run(answer_all(question))
+            count += len(users)
+            room.next_question()
+            room.flush()
+        elapsed = time.perf_counter() - start
+        rooms.evict_if_idle(game.code)
+        return count / elapsed
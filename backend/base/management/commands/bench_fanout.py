@@ -0,0 +1,93 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from base.broker import serve
+from base.layers import PubSubChannelLayer
+
+GROUP = 'game_BENCH'
+
+
+def run_worker(url, sockets, messages, ready, results):
+    """
+    One worker process: `sockets` channels in the group, each reading until
+    it has seen every message. Reports the time the last one arrived.
+    """
+    async def main():
+        layer = PubSubChannelLayer(url=url, capacity=messages + 1)
+        channels = [await layer.new_channel() for _ in range(sockets)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        # Wait until the subscription is live before reporting ready
+        await layer._command('PING')
+        ready.put(True)
+
+        async def drain(channel):
+            for _ in range(messages):
+                await layer.receive(channel)
+
+        await asyncio.gather(*(drain(channel) for channel in channels))
+        results.put(time.time())
+        await layer.close()
+
+    asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = 'Measure group_send fan-out throughput of the pub/sub channel layer as workers are added'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8', help='Comma separated worker counts to try')
+        parser.add_argument('--sockets', type=int, default=400, help='Sockets in the room, spread over the workers')
+        parser.add_argument('--messages', type=int, default=500, help='group_send calls per run')
+        parser.add_argument('--port', type=int, default=6390, help='Port for the bundled broker')
+
+    def handle(self, *args, **options):
+        url = f"redis://127.0.0.1:{options['port']}"
+        threading.Thread(target=self.run_broker, args=(options['port'],), daemon=True).start()
+        time.sleep(0.2)
+
+        self.stdout.write(f"{'workers':>8} {'sockets':>8} {'sends/s':>10} {'deliveries/s':>14}")
+        for workers in [int(n) for n in options['workers'].split(',')]:
+            sends, deliveries = self.run_once(url, workers, options['sockets'], options['messages'])
+            self.stdout.write(f'{workers:>8} {options["sockets"]:>8} {sends:>10.0f} {deliveries:>14.0f}')
+
+    def run_broker(self, port):
+        async def main():
+            server = await serve('127.0.0.1', port)
+            async with server:
+                await server.serve_forever()
+        asyncio.run(main())
+
+    def run_once(self, url, workers, sockets, messages):
+        ready = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        per_worker = max(1, sockets // workers)
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(url, per_worker, messages, ready, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.get()
+
+        async def publish():
+            layer = PubSubChannelLayer(url=url)
+            start = time.time()
+            for i in range(messages):
+                await layer.group_send(GROUP, {'type': 'state_delta', 'text': f'{{"seq": {i}}}'})
+            await layer.close()
+            return start
+
+        start = asyncio.run(publish())
+        finished = max(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+
+        elapsed = finished - start
+        return messages / elapsed, messages * per_worker * workers / elapsed
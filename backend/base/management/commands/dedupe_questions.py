@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from base.models import Question
+from base.service.questionBank import backfill_signatures, remove_near_duplicates
+
+
+class Command(BaseCommand):
+    help = ('Remove near-duplicate questions from the question bank, keeping the oldest of each group. '
+            'Questions without a MinHash signature get one first, except with --dry-run')
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Questions given a signature per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be removed')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            unsigned = Question.objects.filter(minhash__isnull=True).count()
+            if unsigned:
+                self.stdout.write(f'{unsigned} questions have no signature yet and are not compared')
+        else:
+            signed = backfill_signatures(max(1, options['batch_size']))
+            if signed:
+                self.stdout.write(f'{signed} questions given a signature')
+        groups, removed = remove_near_duplicates(dry_run=options['dry_run'])
+        verb = 'would be removed' if options['dry_run'] else 'removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {groups} groups of near-duplicates, {removed} questions {verb}, '
+            f'{Question.objects.count()} questions in the bank'))
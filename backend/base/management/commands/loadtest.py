@@ -0,0 +1,482 @@
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import aiohttp
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PASSWORD = 'Load-test-pw-7731'
+
+
+class LoadStats:
+    """
+    Latency samples (seconds) and errors, keyed by message type.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = Counter()
+        self.error_examples = {}
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def error(self, name, detail):
+        self.errors[name] += 1
+        self.error_examples.setdefault(name, detail)
+
+    def summary(self):
+        rows = {}
+        for name, samples in sorted(self.samples.items()):
+            ms = np.asarray(samples) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            rows[name] = {
+                'count': len(samples),
+                'p50': round(float(p50), 2),
+                'p95': round(float(p95), 2),
+                'p99': round(float(p99), 2),
+                'max': round(float(ms.max()), 2),
+            }
+        return rows
+
+
+class SimulatedRoom:
+    def __init__(self, index):
+        self.index = index
+        self.code = None
+        self.quiz = None
+        self.players = []
+        self.done = asyncio.Event()
+        # perf_counter() of the message that triggered an op, so receivers
+        # can measure broadcast fan-out delay
+        self.triggered_at = {}
+
+
+class SimulatedPlayer:
+    """
+    One player: its own HTTP session (token + session cookie) and socket.
+    """
+
+    def __init__(self, test, room, username, is_host=False):
+        self.test = test
+        self.room = room
+        self.username = username
+        self.is_host = is_host
+        self.token = None
+        self.ws = None
+        self.reader = None
+        self.closing = False
+        self.question = None
+        # message type -> perf_counter() of sends still waiting for their op
+        self.pending = {}
+        self.session = aiohttp.ClientSession(
+            connector=test.connector,
+            connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+        )
+
+    @property
+    def stats(self):
+        return self.test.stats
+
+    async def call(self, name, method, path, data=None):
+        headers = {'Authorization': f'Token {self.token}'} if self.token else {}
+        start = time.perf_counter()
+        try:
+            async with self.session.request(method, self.test.base_url + path, json=data, headers=headers) as response:
+                text = await response.text()
+        except Exception as e:
+            self.stats.error(name, repr(e))
+            return None
+        self.stats.record(name, time.perf_counter() - start)
+        if response.status >= 400:
+            self.stats.error(name, f'HTTP {response.status}: {text[:200]}')
+            return None
+        try:
+            return json.loads(text)
+        except ValueError:
+            self.stats.error(name, f'invalid JSON: {text[:200]}')
+            return None
+
+    async def register(self):
+        body = await self.call('register', 'POST', '/register/', {
+            'username': self.username,
+            'email': f'{self.username}@loadtest.local',
+            'password1': PASSWORD,
+            'password2': PASSWORD,
+        })
+        if body:
+            self.token = body['token']
+        return self.token is not None
+
+    async def open_socket(self):
+        url = self.test.ws_url + f'/ws/game/{self.room.code}/'
+        start = time.perf_counter()
+        try:
+            self.ws = await self.session.ws_connect(url, heartbeat=None)
+            message = await self.ws.receive_json(timeout=self.test.timeout)
+        except Exception as e:
+            self.stats.error('ws_connect', repr(e))
+            return False
+        if message.get('type') != 'game_state':
+            self.stats.error('ws_connect', f'expected game_state, got {message.get("type")}')
+            return False
+        self.stats.record('ws_connect', time.perf_counter() - start)
+        self.reader = asyncio.create_task(self.read())
+        return True
+
+    async def send(self, message_type, trigger=None, **data):
+        now = time.perf_counter()
+        self.pending[message_type] = now
+        if trigger is not None:
+            self.room.triggered_at.setdefault(trigger, now)
+        try:
+            await self.ws.send_json({'type': message_type, **data})
+        except Exception as e:
+            self.pending.pop(message_type, None)
+            self.stats.error(message_type, repr(e))
+
+    def acked(self, message_type, now):
+        sent = self.pending.pop(message_type, None)
+        if sent is not None:
+            self.stats.record(message_type, now - sent)
+
+    async def read(self):
+        try:
+            async for message in self.ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                now = time.perf_counter()
+                data = json.loads(message.data)
+                if data.get('type') == 'state_delta':
+                    for op in data['ops']:
+                        self.apply(op, now)
+        except Exception as e:
+            self.stats.error('ws_receive', repr(e))
+        if not self.room.done.is_set() and not self.closing:
+            self.stats.error('ws_receive', 'socket closed before the game ended')
+
+    def apply(self, op, now):
+        name = op['op']
+        if name in ('player_ready', 'player_answered'):
+            key = (name, op['username'], self.question)
+        elif name in ('game_started', 'question_advanced'):
+            key = (name, op['current_question'])
+        else:
+            key = None
+        sent = self.room.triggered_at.get(key)
+        if sent is not None:
+            self.stats.record('fanout', now - sent)
+
+        if name in ('player_ready', 'player_answered') and op['username'] == self.username:
+            self.acked(name if name == 'player_ready' else 'submit_answer', now)
+        elif name == 'game_started':
+            if self.is_host:
+                self.acked('start_game', now)
+            self.question_opened(op['current_question'])
+        elif name == 'question_advanced':
+            if self.is_host:
+                self.acked('next_question', now)
+            if op['status'] == 'completed':
+                self.room.done.set()
+            else:
+                self.question_opened(op['current_question'])
+        elif name == 'question_closed' and self.is_host and self.test.host_advances:
+            asyncio.create_task(self.send(
+                'next_question', trigger=('question_advanced', op['current_question'] + 1),
+                username=self.username,
+            ))
+
+    def question_opened(self, index):
+        self.question = index
+        asyncio.create_task(self.answer(index))
+
+    async def answer(self, index):
+        await asyncio.sleep(self.test.think_time())
+        if self.question != index or self.room.done.is_set():
+            return
+        correct = self.room.quiz['questions'][index].get('correct_answer', 0)
+        if random.random() < self.test.accuracy:
+            choice = correct
+        else:
+            choice = random.choice([i for i in range(4) if i != correct])
+        await self.send('submit_answer', trigger=('player_answered', self.username, index),
+                        username=self.username, answer=choice)
+
+    async def close(self):
+        self.closing = True
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await asyncio.gather(self.reader, return_exceptions=True)
+        for message_type in self.pending:
+            self.stats.error(message_type, 'no acknowledgement before the game ended')
+        await self.session.close()
+
+
+class LoadTest:
+    def __init__(self, options):
+        self.base_url = options['url'].rstrip('/')
+        self.ws_url = 'ws' + self.base_url[len('http'):]
+        self.rooms = options['rooms']
+        self.room_size = options['room_size']
+        self.questions = options['questions']
+        self.time_per_question = options['time_per_question']
+        self.answer_time = [float(n) for n in options['answer_time'].split(',')]
+        self.accuracy = options['accuracy']
+        self.ramp = options['ramp']
+        self.timeout = options['timeout']
+        self.host_advances = not options['auto_advance']
+        self.quiz_load = options['quiz_load']
+        self.prefix = f'lt{uuid.uuid4().hex[:6]}'
+        self.stats = LoadStats()
+        self.connector = None
+
+    def think_time(self):
+        # Most players answer early, a few near the deadline
+        low, high = self.answer_time
+        return random.triangular(low, high, low + (high - low) / 4)
+
+    async def run(self):
+        self.connector = aiohttp.TCPConnector(limit=0)
+        start = time.perf_counter()
+        finished = asyncio.Event()
+        background = asyncio.ensure_future(self.generate_quizzes(finished))
+        try:
+            await asyncio.gather(*(self.run_room(i) for i in range(self.rooms)))
+        finally:
+            finished.set()
+            await asyncio.gather(background, return_exceptions=True)
+            await self.connector.close()
+        return time.perf_counter() - start
+
+    async def generate_quizzes(self, finished):
+        """
+        Keep quiz_load uncached quiz generations in flight until the rooms
+        are done, to show whether slow model calls hold up game traffic.
+        """
+        if not self.quiz_load:
+            return
+        client = SimulatedPlayer(self, SimulatedRoom(-1), f'{self.prefix}_quiz')
+        try:
+            if not await client.register():
+                return
+
+            async def generate():
+                while not finished.is_set():
+                    await client.call('quiz_background', 'POST', '/api/generate-quiz/', {
+                        'topic': f'background {uuid.uuid4().hex[:8]}', 'count': self.questions,
+                    })
+
+            await asyncio.gather(*(generate() for _ in range(self.quiz_load)))
+        finally:
+            await client.close()
+
+    async def run_room(self, index):
+        await asyncio.sleep(self.ramp * index / max(self.rooms, 1))
+        room = SimulatedRoom(index)
+        host = SimulatedPlayer(self, room, f'{self.prefix}_{index}_0', is_host=True)
+        room.players = [host] + [
+            SimulatedPlayer(self, room, f'{self.prefix}_{index}_{i}') for i in range(1, self.room_size)
+        ]
+        try:
+            await self.play(room, host)
+        finally:
+            await asyncio.gather(*(player.close() for player in room.players))
+
+    async def play(self, room, host):
+        if not await host.register():
+            return
+        generated = await host.call('generate_quiz', 'POST', '/api/generate-quiz/', {
+            'topic': f'load test {room.index}', 'count': self.questions,
+        })
+        if not generated:
+            return
+        room.quiz = dict(generated['quiz'], timePerQuestion=self.time_per_question)
+        created = await host.call('create_game', 'POST', '/api/game/create/', {'quiz_data': room.quiz})
+        if not created:
+            return
+        room.code = created['game_code']
+        # create_game normalizes answers server-side; mirror it for picking answers
+        for question in room.quiz['questions']:
+            question['correct_answer'] = 'ABCD'.index(question['correctAnswer'][0])
+
+        guests = room.players[1:]
+        registered = await asyncio.gather(*(player.register() for player in guests))
+        guests = [player for player, ok in zip(guests, registered) if ok]
+        await asyncio.gather(*(
+            player.call('join_game', 'POST', '/api/game/join/', {'game_code': room.code}) for player in guests
+        ))
+        await host.call('game_status', 'GET', f'/api/game/{room.code}/status/')
+
+        connected = await asyncio.gather(*(player.open_socket() for player in [host] + guests))
+        live = [player for player, ok in zip([host] + guests, connected) if ok]
+        if host not in live:
+            return
+        await asyncio.gather(*(
+            player.send('player_ready', trigger=('player_ready', player.username, None), is_ready=True)
+            for player in live
+        ))
+        await self.wait_for(lambda: not any('player_ready' in p.pending for p in live), 'player_ready')
+
+        await host.send('start_game', trigger=('game_started', 0), username=host.username)
+        try:
+            await asyncio.wait_for(room.done.wait(), self.timeout + self.questions * self.time_per_question * 2)
+        except asyncio.TimeoutError:
+            self.stats.error('game', f'room {room.code} did not finish')
+            return
+        await host.call('leaderboard', 'GET', f'/api/game/{room.code}/leaderboard/')
+
+    async def wait_for(self, condition, name):
+        deadline = time.perf_counter() + self.timeout
+        while not condition():
+            if time.perf_counter() > deadline:
+                self.stats.error(name, 'timed out waiting for acknowledgements')
+                return
+            await asyncio.sleep(0.05)
+
+
+class Command(BaseCommand):
+    help = ('Simulate concurrent players against a running server over REST and ws/game/<code>/, '
+            'reporting p50/p95/p99 latency per message type, broadcast fan-out delay and errors')
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to test')
+        parser.add_argument('--serve', action='store_true',
+                            help='Start a throwaway daphne server with the stub quiz generator and a scratch database')
+        parser.add_argument('--port', type=int, default=8765, help='Port for --serve')
+        parser.add_argument('--rooms', type=int, default=20)
+        parser.add_argument('--room-size', type=int, default=10, help='Players per room, host included')
+        parser.add_argument('--questions', type=int, default=5)
+        parser.add_argument('--time-per-question', type=int, default=15)
+        parser.add_argument('--answer-time', default='1,8', help='Think time range in seconds, "min,max"')
+        parser.add_argument('--accuracy', type=float, default=0.7, help='Share of correct answers')
+        parser.add_argument('--ramp', type=float, default=5, help='Seconds over which rooms are started')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for acknowledgements')
+        parser.add_argument('--auto-advance', action='store_true',
+                            help='Let the server pace questions instead of the host clicking next')
+        parser.add_argument('--report', help='Write the results as JSON to this file')
+        parser.add_argument('--max-p99', action='append', default=[], metavar='TYPE=MS',
+                            help='Fail if the p99 latency of TYPE exceeds MS milliseconds (repeatable)')
+        parser.add_argument('--max-errors', type=int, help='Fail if more errors than this occur')
+        parser.add_argument('--quiz-load', type=int, default=0, metavar='N',
+                            help='Keep N uncached quiz generations running alongside the games')
+        parser.add_argument('--groq-latency', type=float, metavar='SECONDS',
+                            help='With --serve, generate quizzes through `runfakegroq` with this latency '
+                                 'instead of the in-process stub')
+        parser.add_argument('--sync-quiz', action='store_true',
+                            help='With --serve, generate quizzes in the sync views instead of the async endpoints')
+
+    def handle(self, *args, **options):
+        # Thousands of sockets need more than the default descriptor limit
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+        server = None
+        fake_groq = None
+        try:
+            if options['serve']:
+                env = {}
+                if options['groq_latency'] is not None:
+                    groq_port = options['port'] + 1
+                    fake_groq = self.start_fake_groq(groq_port, options['groq_latency'])
+                    env.update(QUIZ_GENERATOR='groq', GROQ_BASE_URL=f'http://127.0.0.1:{groq_port}',
+                               GROQ_API_KEY='loadtest')
+                if options['sync_quiz']:
+                    env['ASYNC_QUIZ_ENDPOINTS'] = '0'
+                server = self.start_server(options['port'], env)
+                options['url'] = f"http://127.0.0.1:{options['port']}"
+            test = LoadTest(options)
+            players = options['rooms'] * options['room_size']
+            self.stdout.write(f"{options['rooms']} rooms x {options['room_size']} players = {players} against {options['url']}")
+            elapsed = asyncio.run(test.run())
+        finally:
+            for process in (server, fake_groq):
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+        summary = test.stats.summary()
+        self.stdout.write(f'finished in {elapsed:.1f}s\n')
+        self.stdout.write(f"{'type':<16} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+        for name in sorted(set(summary) | set(test.stats.errors)):
+            row = summary.get(name, {'count': 0, 'p50': 0, 'p95': 0, 'p99': 0, 'max': 0})
+            self.stdout.write(f"{name:<16} {row['count']:>7} {row['p50']:>9.1f} {row['p95']:>9.1f} "
+                              f"{row['p99']:>9.1f} {row['max']:>9.1f} {test.stats.errors[name]:>7}")
+        for name, detail in sorted(test.stats.error_examples.items()):
+            self.stdout.write(f'  {name}: {detail}')
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump({
+                    'options': {k: options[k] for k in ('rooms', 'room_size', 'questions', 'time_per_question',
+                                                        'quiz_load', 'groq_latency', 'sync_quiz')},
+                    'elapsed': elapsed,
+                    'latency_ms': summary,
+                    'errors': dict(test.stats.errors),
+                }, f, indent=2)
+
+        self.check_gates(options, summary, test.stats)
+
+    def check_gates(self, options, summary, stats):
+        failures = []
+        for gate in options['max_p99']:
+            name, limit = gate.split('=')
+            p99 = summary.get(name, {}).get('p99')
+            if p99 is None or p99 > float(limit):
+                failures.append(f'{name} p99 {p99} ms > {limit} ms')
+        total_errors = sum(stats.errors.values())
+        if options['max_errors'] is not None and total_errors > options['max_errors']:
+            failures.append(f'{total_errors} errors > {options["max_errors"]}')
+        if failures:
+            raise CommandError('Load test failed: ' + '; '.join(failures))
+
+    def start_server(self, port, extra_env=None):
+        """
+        Daphne on localhost with the stub quiz generator, fast password
+        hashing and a fresh SQLite database. extra_env overrides settings.
+        """
+        env = dict(
+            os.environ,
+            QUIZ_GENERATOR='stub',
+            FAST_PASSWORD_HASHING='1',
+            DJANGO_DB_PATH=os.path.join(tempfile.mkdtemp(prefix='mindclash-loadtest-'), 'db.sqlite3'),
+        )
+        env.update(extra_env or {})
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '--skip-checks', '--verbosity', '0'],
+                       cwd=settings.BASE_DIR, env=env, check=True)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'backend.asgi:application'],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        return self.wait_for_port(server, port)
+
+    def start_fake_groq(self, port, latency):
+        server = subprocess.Popen(
+            [sys.executable, 'manage.py', 'runfakegroq', '--port', str(port), '--latency', str(latency)],
+            cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        return self.wait_for_port(server, port)
+
+    def wait_for_port(self, server, port):
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError('Server did not start')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from base.models import Question
+from base.service.questionSearch import optimize_index, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of the question bank from the Question table'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize-only', action='store_true',
+                            help='Only merge the existing index into one segment, e.g. after a large import')
+
+    def handle(self, *args, **options):
+        if options['optimize_only']:
+            optimize_index()
+        else:
+            rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Done: {Question.objects.count()} questions indexed'))
@@ -0,0 +1,23 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from base.broker import serve
+
+
+class Command(BaseCommand):
+    help = 'Run the bundled Redis-compatible pub/sub broker for the channel layer'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6379)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options['host'], options['port']))
+
+    async def run(self, host, port):
+        server = await serve(host, port)
+        self.stdout.write(f'Broker listening on {host}:{port}')
+        async with server:
+            await server.serve_forever()
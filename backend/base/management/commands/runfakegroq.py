@@ -0,0 +1,66 @@
+import asyncio
+import json
+import random
+import uuid
+
+from aiohttp import web
+from django.core.management.base import BaseCommand
+
+from base.service.fakeGroq import chunk_payload, chunks, completion_payload, completion_seconds, fake_completion
+
+
+class Command(BaseCommand):
+    help = ('Serve a fake Groq chat completions API (JSON and streamed) with configurable latency. '
+            'Point the app at it with GROQ_BASE_URL=http://127.0.0.1:<port>')
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--latency', type=float, default=3.0,
+                            help='Seconds before the first token; streamed replies spread it over their chunks')
+        parser.add_argument('--tokens-per-second', type=float, default=0,
+                            help='Output speed, so longer replies take longer (0 for instant)')
+        parser.add_argument('--overlap', type=int, default=0,
+                            help='Questions each part of a quiz generated in parts repeats from the part before')
+        parser.add_argument('--jitter', type=float, default=0.2,
+                            help='Random +/- share of the latency, e.g. 0.2 for 20%%')
+
+    def handle(self, *args, **options):
+        self.latency = options['latency']
+        self.tokens_per_second = options['tokens_per_second']
+        self.overlap = options['overlap']
+        self.jitter = options['jitter']
+
+        app = web.Application()
+        app.router.add_post('/openai/v1/chat/completions', self.completions)
+        self.stdout.write(f"Fake Groq on http://{options['host']}:{options['port']} "
+                          f"({self.latency:g}s per completion)")
+        web.run_app(app, host=options['host'], port=options['port'], print=None)
+
+    def duration(self, content):
+        seconds = completion_seconds(content, self.latency, self.tokens_per_second)
+        return max(seconds * (1 + random.uniform(-self.jitter, self.jitter)), 0)
+
+    async def completions(self, request):
+        body = await request.json()
+        model = body.get('model', '')
+        messages = body.get('messages') or []
+        content, finish_reason = fake_completion(messages, body.get('max_completion_tokens'), self.overlap)
+
+        if not body.get('stream'):
+            await asyncio.sleep(self.duration(content))
+            return web.json_response(completion_payload(model, messages, content, finish_reason))
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        pieces = chunks(content)
+        delay = self.duration(content) / max(len(pieces), 1)
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            await response.write(b'data: %s\n\n' % json.dumps(chunk_payload(completion_id, model, piece)).encode())
+        await response.write(b'data: %s\n\n' % json.dumps(chunk_payload(completion_id, model, None, finish_reason)).encode())
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
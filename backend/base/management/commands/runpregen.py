@@ -0,0 +1,26 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from base.service.pregeneration import Pregenerator
+from base.service.quizGenerator import DEFAULT_MODEL
+
+
+class Command(BaseCommand):
+    help = ('Keep the question bank stocked for the most requested topics, generating in the background. '
+            'Run one per deployment')
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=DEFAULT_MODEL)
+        parser.add_argument('--once', action='store_true',
+                            help='Make one pass over the hot topics and exit')
+
+    def handle(self, *args, **options):
+        if not settings.QUESTION_BANK:
+            self.stderr.write('QUESTION_BANK is off, so pre-generated questions would never be served')
+            return
+        self.stdout.write(f'Pre-generating for up to {settings.PREGEN_TOPICS} topics, '
+                          f'{settings.PREGEN_RATE:g} generations a minute')
+        asyncio.run(Pregenerator(options['model']).run(once=options['once']))
@@ -0,0 +1,212 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms are sharded per thread: each thread only ever
+writes its own dict, so recording takes no lock, and the exporter adds the
+shards up when /metrics is scraped. Gauges are callbacks evaluated at
+scrape time, so live values such as open sockets cost nothing between
+scrapes.
+"""
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Buckets for calls to the model, which take seconds rather than milliseconds
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+
+# Buckets for per-request query counts
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            # Once per thread
+            with self._shards_lock:
+                self._shards.append(values)
+            return values
+
+    def _collect_shards(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict.copy() is atomic under the GIL, so a shard being written to
+        # by its thread is still read consistently
+        return [shard.copy() for shard in shards]
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        totals = {}
+        for shard in self._collect_shards():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.values().items()):
+            lines.append(f'{self.name}{self._labels(key)} {_number(value)}')
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # One slot per bucket, +Inf, then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def values(self):
+        totals = {}
+        for shard in self._collect_shards():
+            for key, series in shard.items():
+                series = list(series)
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = series
+                else:
+                    for i, value in enumerate(series):
+                        total[i] += value
+        return totals
+
+    def render(self):
+        lines = self.header()
+        for key, series in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._labels(key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(key)} {_number(series[-1])}')
+            lines.append(f'{self.name}_count{self._labels(key)} {cumulative}')
+        return lines
+
+
+class Gauge(Metric):
+    """
+    Value read from `fn` at scrape time. `fn` returns a number, or a dict
+    of label tuples to numbers when the gauge has labels.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, fn, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+
+    def render(self):
+        lines = self.header()
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, number in sorted(items):
+            lines.append(f'{self.name}{self._labels(key)} {_number(number)}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+registry = Registry()
+
+
+# HTTP (MetricsMiddleware)
+http_requests = Counter('mindclash_http_requests_total', 'HTTP requests handled',
+                        ['endpoint', 'method', 'status'])
+http_latency = Histogram('mindclash_http_request_seconds', 'HTTP request latency', ['endpoint'])
+http_queries = Histogram('mindclash_http_db_queries', 'Database queries per HTTP request', ['endpoint'],
+                         buckets=QUERY_BUCKETS)
+
+# WebSockets (GameConsumer)
+ws_connects = Counter('mindclash_ws_connects_total', 'WebSocket connections accepted')
+ws_disconnects = Counter('mindclash_ws_disconnects_total', 'WebSocket connections closed')
+ws_messages = Counter('mindclash_ws_messages_total', 'WebSocket messages received', ['type'])
+ws_latency = Histogram('mindclash_ws_message_seconds', 'Time to handle a WebSocket message', ['type'])
+group_send_latency = Histogram('mindclash_group_send_seconds', 'Time to hand a room broadcast to the channel layer')
+
+# Quiz generation
+quiz_cache = Counter('mindclash_quiz_cache_total', 'Quiz generation requests by where the quiz came from', ['source'])
+groq_latency = Histogram('mindclash_groq_request_seconds', 'Time to a complete Groq completion', ['kind'],
+                         buckets=SLOW_BUCKETS)
+groq_errors = Counter('mindclash_groq_errors_total', 'Groq completions that failed', ['kind', 'reason'])
+quiz_first_question = Histogram('mindclash_quiz_first_question_seconds',
+                                'Time from a streamed quiz request to its first parsed question',
+                                buckets=SLOW_BUCKETS)
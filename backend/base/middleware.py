@@ -0,0 +1,81 @@
+import json
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+from . import metrics
+from .service.roomAffinity import is_local_room, owner_for_room
+
+
+class MetricsMiddleware:
+    """
+    Records per-endpoint request counts, latency and the number of database
+    queries each request issued.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.url_name if match and match.url_name else 'unmatched'
+        metrics.http_requests.inc(endpoint, request.method, response.status_code)
+        metrics.http_latency.observe(elapsed, endpoint)
+        metrics.http_queries.observe(queries[0], endpoint)
+        return response
+
+
+class RoomAffinityMiddleware:
+    """
+    Redirects requests for a game room owned by another worker to that
+    worker with a 307, which keeps the method and body, as RoomHttpConsumer
+    does for the long-poll endpoints. A room's state lives in its owner's
+    memory; a copy loaded on another worker would flush over it.
+    """
+    # Views that take the room code in the body rather than the URL
+    BODY_CODES = {'join-game': 'game_code', 'send-chat-message': 'pin'}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.ROOM_WORKERS:
+            return None
+        code = view_kwargs.get('game_code') or view_kwargs.get('pin')
+        field = self.BODY_CODES.get(request.resolver_match.url_name)
+        if code is None and field is not None:
+            code = body_field(request, field)
+        if not isinstance(code, str) or not code or is_local_room(code):
+            return None
+        response = HttpResponse(status=307)
+        response['Location'] = owner_for_room(code).rstrip('/') + request.get_full_path()
+        return response
+
+
+def body_field(request, name):
+    """
+    A field of a JSON or form request body, or None.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data.get(name) if isinstance(data, dict) else None
+    return request.POST.get(name)
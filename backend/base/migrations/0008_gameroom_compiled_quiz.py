@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_chatmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='compiled_quiz',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 10:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_gameroom_compiled_quiz'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='answer_histograms',
+            field=models.JSONField(default=dict),
+        ),
+    ]
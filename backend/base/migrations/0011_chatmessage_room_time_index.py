@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-17 10:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_chatmessage_timestamp_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['game_room', 'timestamp', 'id'], name='chat_room_time_idx'),
+        ),
+    ]
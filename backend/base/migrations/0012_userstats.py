@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-17 10:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('base', '0011_chatmessage_room_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('games_played', models.IntegerField(default=0)),
+                ('total_score', models.IntegerField(default=0)),
+                ('correct_answers', models.IntegerField(default=0)),
+                ('total_questions', models.IntegerField(default=0)),
+                ('best_streak', models.IntegerField(default=0)),
+                ('total_answer_time', models.FloatField(default=0.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='gameroom',
+            name='stats_recorded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-17 10:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_userstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameroom',
+            name='topic',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='gameroom',
+            index=models.Index(fields=['status', 'ended_at'], name='game_status_ended_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-17 10:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_gameroom_topic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedQuiz',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64, unique=True)),
+                ('topic', models.CharField(max_length=100)),
+                ('difficulty', models.CharField(max_length=20)),
+                ('count', models.IntegerField()),
+                ('model', models.CharField(max_length=100)),
+                ('quiz_data', models.JSONField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:20
+
+import base.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0014_generatedquiz'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='difficulty',
+            field=models.CharField(default='medium', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='explanation',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='random_key',
+            field=models.FloatField(default=base.models.random_key),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='text_hash',
+            field=models.CharField(default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='topic',
+            field=models.CharField(default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='source',
+            field=models.CharField(default='generated', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='title',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['topic', 'difficulty', 'random_key'], name='question_sample_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='question',
+            constraint=models.UniqueConstraint(fields=('topic', 'difficulty', 'text_hash'), name='question_unique_text'),
+        ),
+    ]
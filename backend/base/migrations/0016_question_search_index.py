@@ -0,0 +1,56 @@
+from django.db import migrations
+
+# Full-text index over the question bank (see service/questionSearch.py).
+# An external-content FTS5 table: it stores only the index, the text stays
+# in base_question. Triggers keep it in step with every write, including
+# bulk_create() and update(), which send no signals.
+CREATE = [
+    """
+    CREATE VIRTUAL TABLE base_question_fts USING fts5(
+        question_text, options, explanation, topic,
+        content='base_question', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER base_question_fts_insert AFTER INSERT ON base_question BEGIN
+        INSERT INTO base_question_fts(rowid, question_text, options, explanation, topic)
+        VALUES (new.id, new.question_text, new.options, new.explanation, new.topic);
+    END
+    """,
+    """
+    CREATE TRIGGER base_question_fts_delete AFTER DELETE ON base_question BEGIN
+        INSERT INTO base_question_fts(base_question_fts, rowid, question_text, options, explanation, topic)
+        VALUES ('delete', old.id, old.question_text, old.options, old.explanation, old.topic);
+    END
+    """,
+    """
+    CREATE TRIGGER base_question_fts_update
+    AFTER UPDATE OF question_text, options, explanation, topic ON base_question BEGIN
+        INSERT INTO base_question_fts(base_question_fts, rowid, question_text, options, explanation, topic)
+        VALUES ('delete', old.id, old.question_text, old.options, old.explanation, old.topic);
+        INSERT INTO base_question_fts(rowid, question_text, options, explanation, topic)
+        VALUES (new.id, new.question_text, new.options, new.explanation, new.topic);
+    END
+    """,
+    # Index the questions already in the bank
+    "INSERT INTO base_question_fts(base_question_fts) VALUES ('rebuild')",
+]
+
+DROP = [
+    'DROP TRIGGER IF EXISTS base_question_fts_update',
+    'DROP TRIGGER IF EXISTS base_question_fts_delete',
+    'DROP TRIGGER IF EXISTS base_question_fts_insert',
+    'DROP TABLE IF EXISTS base_question_fts',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_question_bank'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE, DROP),
+    ]
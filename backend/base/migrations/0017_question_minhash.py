@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0016_question_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='minhash',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.CreateModel(
+            name='QuestionBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='base.question')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-17 11:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0017_question_minhash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicDemand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=100)),
+                ('difficulty', models.CharField(max_length=20)),
+                ('score', models.FloatField(default=0.0)),
+                ('requests', models.IntegerField(default=0)),
+                ('questions', models.IntegerField(default=0)),
+                ('last_requested', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['score'], name='topic_demand_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('topic', 'difficulty'), name='topic_demand_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0018_topicdemand'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topicdemand',
+            name='served',
+            field=models.IntegerField(default=0),
+        ),
+    ]
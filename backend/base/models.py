@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+import random
 import uuid
 
 class UserProfile(models.Model):
@@ -17,23 +19,66 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+def random_key():
+    return random.random()
+
 class Quiz(models.Model):
-    topic = models.CharField(max_length=255)
-    num_questions = models.IntegerField()
+    """
+    A batch of questions added to the question bank: one generated or
+    imported quiz.
+    """
+    topic = models.CharField(max_length=255)  # Normalized topic
+    num_questions = models.IntegerField()  # Questions it added to the bank
     difficulty_level = models.CharField(max_length=10) # easy, medium, hard
+    title = models.CharField(max_length=255, blank=True, default='')
+    source = models.CharField(max_length=20, default='generated')  # generated or imported
+    created_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f"{self.topic} - {self.num_questions} questions"
 
 class Question(models.Model):
+    """
+    A question in the bank (see service/questionBank.py). Topic and
+    difficulty are copied from its quiz so sampling reads one index.
+    """
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
     question_text = models.TextField()
     options = models.JSONField() # list of options
-    correct_answer = models.CharField(max_length=255)
+    correct_answer = models.CharField(max_length=255)  # Letter of the correct option
+    explanation = models.TextField(blank=True, default='')
+    topic = models.CharField(max_length=100, default='')  # Normalized, as GameRoom.topic
+    difficulty = models.CharField(max_length=20, default='medium')
+    text_hash = models.CharField(max_length=40, default='')  # sha1 of the normalized question text
+    # Uniform in [0, 1); quizzes are sampled as a run of consecutive keys
+    random_key = models.FloatField(default=random_key)
+    created_at = models.DateTimeField(default=timezone.now)
+    # MinHash signature of the question and its answer (see service/nearDuplicates.py)
+    minhash = models.BinaryField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['topic', 'difficulty', 'random_key'], name='question_sample_idx'),
+        ]
+        constraints = [
+            # The same question is kept once per topic and difficulty
+            models.UniqueConstraint(fields=['topic', 'difficulty', 'text_hash'], name='question_unique_text'),
+        ]
 
     def __str__(self):
         return self.question_text
 
+class QuestionBucket(models.Model):
+    """
+    One LSH bucket a question's signature falls in; questions sharing a
+    bucket are compared when looking for near-duplicates.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='buckets')
+    key = models.BigIntegerField(db_index=True)  # Hash of the scope, band number and band values
+
+    def __str__(self):
+        return f"{self.key} -> {self.question_id}"
+
 # New models for multiplayer functionality
 class GameRoom(models.Model):
     STATUS_CHOICES = [
@@ -51,6 +96,16 @@ class GameRoom(models.Model):
     max_players = models.IntegerField(default=10)
     current_question = models.IntegerField(default=0)
     quiz_data = models.JSONField(default=dict)  # Store the quiz questions
+    compiled_quiz = models.JSONField(default=dict)  # Answer key, option counts and time limits
+    answer_histograms = models.JSONField(default=dict)  # Per question: option counts and answered count
+    stats_recorded = models.BooleanField(default=False)  # Players' results added to UserStats
+    topic = models.CharField(max_length=100, blank=True, default='', db_index=True)  # Normalized quiz topic
+
+    class Meta:
+        indexes = [
+            # Completed games in completion order, read by the leaderboards
+            models.Index(fields=['status', 'ended_at'], name='game_status_ended_idx'),
+        ]
 
     def __str__(self):
         return f"Game {self.code} by {self.host.username}"
@@ -103,14 +158,82 @@ class Player(models.Model):
             self.average_time = ((self.average_time * (self.total_questions - 1)) + answer_time) / self.total_questions
         
         self.save()
+class UserStats(models.Model):
+    """
+    Lifetime totals of a user over their completed games, kept up to date
+    as games complete (see service/userStats.py) so the profile doesn't
+    have to add up every Player row.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    games_played = models.IntegerField(default=0)
+    total_score = models.IntegerField(default=0)
+    correct_answers = models.IntegerField(default=0)
+    total_questions = models.IntegerField(default=0)
+    best_streak = models.IntegerField(default=0)
+    total_answer_time = models.FloatField(default=0.0)  # Seconds spent answering, over all questions
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s stats"
+
+    @property
+    def average_time(self):
+        return self.total_answer_time / self.total_questions if self.total_questions else 0.0
+
+class GeneratedQuiz(models.Model):
+    """
+    A quiz returned by the model, kept so identical generation requests are
+    answered without calling it again (see service/quizCache.py).
+    """
+    cache_key = models.CharField(max_length=64, unique=True)  # sha256 of the normalized request
+    topic = models.CharField(max_length=100)
+    difficulty = models.CharField(max_length=20)
+    count = models.IntegerField()
+    model = models.CharField(max_length=100)
+    quiz_data = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.topic} ({self.difficulty}, {self.count} questions)"
+
+class TopicDemand(models.Model):
+    """
+    How often a quiz on a topic and difficulty is asked for, so the
+    pre-generation worker can keep the bank stocked for popular ones (see
+    service/pregeneration.py).
+    """
+    topic = models.CharField(max_length=100)  # Normalized, as Question.topic
+    difficulty = models.CharField(max_length=20)
+    score = models.FloatField(default=0.0)  # Requests, halved every PREGEN_HALF_LIFE seconds
+    requests = models.IntegerField(default=0)  # All-time requests
+    questions = models.IntegerField(default=0)  # Questions asked for over all requests
+    served = models.IntegerField(default=0)  # Bank questions served and not replaced yet
+    last_requested = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['topic', 'difficulty'], name='topic_demand_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['score'], name='topic_demand_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} ({self.difficulty}): {self.score:.1f}"
+
 class ChatMessage(models.Model):
     game_room = models.ForeignKey(GameRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent; rooms write chat in batches later
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination of a room's history; id breaks timestamp ties
+            models.Index(fields=['game_room', 'timestamp', 'id'], name='chat_room_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.message[:50]}"
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+Per-request query budgets and N+1 detection.
+
+Views declare how many SQL queries a request may issue:
+
+    @query_budget(4)
+    @api_view(['GET'])
+    def get_leaderboard(request, game_code):
+        ...
+
+QueryBudgetMiddleware records every query of a request. It flags requests
+that go over their view's budget, and query shapes (the SQL with its
+parameters stripped) that repeat N_PLUS_ONE_THRESHOLD times or more, which
+is what an N+1 loop looks like. Depending on QUERY_BUDGET_MODE a violation
+is ignored ('off'), logged ('log') or raised as QueryBudgetExceeded
+('raise'). Tests use 'raise' so a regression fails before deploy; see
+QueryBudgetTestMixin and assert_max_queries.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings
+
+from .logs import get_logger
+
+# A query shape seen this many times in one request is reported as an N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+log = get_logger('db')
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """
+    Declare the maximum number of queries a request to this view may run,
+    authentication included. Put it above @api_view.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def query_shape(sql):
+    """
+    SQL with literals and parameter lists collapsed, so the same query with
+    different arguments has the same shape.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _IN_LIST.sub('(%s...)', sql)
+
+
+class QueryRecorder:
+    """
+    Context manager recording (sql, seconds) of every query on the default
+    connection.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._wrapper = None
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self._record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._wrapper.__exit__(*exc)
+
+    def _record(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated_shapes(self, threshold=N_PLUS_ONE_THRESHOLD):
+        shapes = Counter(query_shape(sql) for sql, _ in self.queries)
+        return [(shape, count) for shape, count in shapes.most_common() if count >= threshold]
+
+    def problems(self, budget=None, threshold=N_PLUS_ONE_THRESHOLD):
+        found = []
+        if budget is not None and len(self.queries) > budget:
+            found.append(f'{len(self.queries)} queries, budget is {budget}')
+        for shape, count in self.repeated_shapes(threshold):
+            found.append(f'possible N+1: {count} x {shape}')
+        return found
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+        if mode == 'off':
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(len(recorder))
+        problems = recorder.problems(getattr(request, '_query_budget', None))
+        if problems:
+            if mode == 'raise':
+                raise QueryBudgetExceeded(f'{request.method} {request.path}: ' + '; '.join(problems))
+            log.warning('query_budget_exceeded', method=request.method, path=request.path,
+                        queries=len(recorder), problems=problems)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = getattr(view_func, 'query_budget', None)
+
+
+@contextmanager
+def assert_max_queries(limit, threshold=N_PLUS_ONE_THRESHOLD):
+    """
+    Fail if the block runs more than `limit` queries or repeats a query
+    shape `threshold` times.
+
+        with assert_max_queries(3):
+            client.get(url)
+    """
+    with QueryRecorder() as recorder:
+        yield recorder
+    problems = recorder.problems(limit, threshold)
+    if problems:
+        raise QueryBudgetExceeded('; '.join(problems) + '\n' + '\n'.join(sql for sql, _ in recorder.queries))
+
+
+class QueryBudgetTestMixin:
+    """
+    Mixin for test cases: requests made with the test client fail with
+    QueryBudgetExceeded when their view goes over its declared budget or
+    shows an N+1 pattern.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._query_budget_override = override_settings(QUERY_BUDGET_MODE='raise')
+        cls._query_budget_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._query_budget_override.disable()
+        super().tearDownClass()
+
+    def assertMaxQueries(self, limit, threshold=N_PLUS_ONE_THRESHOLD):
+        return assert_max_queries(limit, threshold)
@@ -1,6 +1,20 @@
+from django.conf import settings
 from django.urls import re_path
 from . import consumers
  
 websocket_urlpatterns = [
     re_path(r'ws/game/(?P<game_code>\w+)/$', consumers.GameConsumer.as_asgi()),
-] 
\ No newline at end of file
+] 
+# Plain HTTP endpoints served by consumers instead of Django views
+http_urlpatterns = [
+    re_path(r'^api/game/(?P<game_code>\w+)/poll/$', consumers.GameStatusPollConsumer.as_asgi()),
+    re_path(r'^api/game/(?P<game_code>\w+)/events/$', consumers.GameEventsConsumer.as_asgi()),
+    re_path(r'^api/generate-quiz/stream/$', consumers.QuizStreamConsumer.as_asgi()),
+]
+# Calls to the model wait on the event loop instead of in a sync view; the
+# views in base.views still serve these paths under WSGI
+if settings.ASYNC_QUIZ_ENDPOINTS:
+    http_urlpatterns += [
+        re_path(r'^api/generate-quiz/$', consumers.QuizGenerateConsumer.as_asgi()),
+        re_path(r'^api/groq-chat/$', consumers.GroqChatConsumer.as_asgi()),
+    ]
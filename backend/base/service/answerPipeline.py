@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import deque
+
+from channels.db import database_sync_to_async
+
+from ..logs import get_logger
+from .questionTimer import scheduler
+from .roomState import rooms
+
+# Upper bound on answers scored and written in one transaction.
+MAX_BATCH = 500
+
+log = get_logger('answers')
+
+
+class AnswerPipeline:
+    """
+    Funnels every answer for a room through one writer coroutine.
+
+    Submitters append to the room's queue and wait on a future. The writer
+    takes everything queued so far, scores it with one ScoringEngine call,
+    persists the batch in a single transaction and then resolves the futures.
+    Because only the writer touches a room's scores, concurrent answers
+    can no longer overwrite each other's updates. A batch whose write fails
+    is still resolved: the room has counted it and keeps it dirty until a
+    later flush stores it.
+
+    Queues are per event loop as well as per room: under ASGI there is one
+    loop, while sync callers using async_to_sync may each bring their own.
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self._writers = {}
+
+    def queued(self):
+        return sum(len(queue) for queue in list(self._queues.values()))
+
+    async def submit(self, room, username, answer, answer_time=None):
+        """
+        Queue an answer and wait until it has been scored and stored.
+        Returns the room's AnswerResult.
+        """
+        loop = asyncio.get_running_loop()
+        key = (room.code, loop)
+        result = loop.create_future()
+        self._queues.setdefault(key, deque()).append((username, answer, answer_time, result))
+
+        writer = self._writers.get(key)
+        if writer is None or writer.done():
+            self._writers[key] = loop.create_task(self._write(key, room))
+        return await result
+
+    async def _write(self, key, room):
+        queue = self._queues[key]
+        try:
+            while queue:
+                batch = [queue.popleft() for _ in range(min(len(queue), MAX_BATCH))]
+                start = time.perf_counter()
+                try:
+                    # One scoring call for the whole batch
+                    results = room.submit_answers([item[:3] for item in batch])
+                except Exception as e:
+                    log.exception('answer_batch_failed', game=room.code, size=len(batch))
+                    for *_, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                try:
+                    await database_sync_to_async(room.flush, thread_sensitive=False)()
+                except Exception:
+                    # The answers are counted and stay dirty in the room, so
+                    # they are reported as accepted and stored by a later
+                    # flush: a retry on the loop of a connected room, else
+                    # the next REST request that flushes it
+                    log.exception('answer_batch_flush_failed', game=room.code, size=len(batch))
+                    if room.connections:
+                        rooms.schedule_flush(room)
+
+                log.debug('answer_batch_written', game=room.code, size=len(batch),
+                          ms=round((time.perf_counter() - start) * 1000, 2))
+                for (*_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+                await rooms.broadcast(room)
+                # REST-only rooms close early too once everyone has answered
+                scheduler.answer_recorded(room)
+        finally:
+            if not queue:
+                self._queues.pop(key, None)
+            self._writers.pop(key, None)
+
+
+answers = AnswerPipeline()
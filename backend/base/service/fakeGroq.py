@@ -0,0 +1,232 @@
+"""
+Offline stand-in for the Groq client.
+
+Implements the part of `groq.Groq` the views use,
+`client.chat.completions.create(...)` with and without `stream=True`, and
+answers quiz prompts with a deterministic, well-formed quiz. Enable it with
+QUIZ_GENERATOR=stub so load tests and local runs never reach the real API.
+AsyncFakeGroq does the same for `groq.AsyncGroq`, and `completion_payload`
+and `chunk_payload` render replies in the wire format of the HTTP API for
+`manage.py runfakegroq`.
+
+Like the real API, a completion takes `latency` seconds plus one second per
+`tokens_per_second` tokens written, and stops at max_completion_tokens.
+For quizzes requested in parts, `overlap` makes each part repeat that many
+questions of the part before it, the way a model asked the same thing
+several times does.
+"""
+import asyncio
+import json
+import re
+import time
+import uuid
+from types import SimpleNamespace
+
+QUIZ_PROMPT = re.compile(r'quiz of (\d+) multiple-choice questions on the topic "(.*?)" with difficulty level (\w+)')
+QUIZ_PART = re.compile(r'write its questions (\d+)-(\d+)')
+
+# Characters per token, for usage and completion limits
+CHARS_PER_TOKEN = 4
+
+# Size of the pieces a streamed completion is cut into
+STREAM_CHUNK = 24
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'tu', 'pe', 'zo', 'ni']
+
+
+def fake_word(n):
+    """
+    A made-up word that is the same for the same n, so each fake question
+    has words of its own and near-duplicate detection tells them apart.
+    """
+    n = (n * 2654435761) % 8 ** 4
+    return ''.join(SYLLABLES[(n >> shift) & 7] for shift in (9, 6, 3, 0))
+
+
+def fake_quiz(topic, count, difficulty='medium', first=1):
+    """
+    Quiz in the format the generate-quiz prompt asks for, its questions
+    numbered from `first`.
+    """
+    return {
+        'title': f'{topic.title()} Quiz',
+        'questions': [
+            {
+                'question': f'{topic} question {i + 1} ({difficulty}): {fake_word(i)} {fake_word(4095 - i)}?',
+                'options': [f'{topic} answer {i + 1}{letter}' for letter in 'ABCD'],
+                'correctAnswer': 'ABCD'[i % 4],
+                'explanation': f'Answer {"ABCD"[i % 4]} is correct.',
+            }
+            for i in range(first - 1, first - 1 + count)
+        ],
+        'recommendedTimeInMinutes': max(1, count // 2),
+    }
+
+
+def fake_reply(messages, overlap=0):
+    prompt = messages[-1]['content'] if messages else ''
+    match = QUIZ_PROMPT.search(prompt)
+    if match:
+        count, topic, difficulty = int(match.group(1)), match.group(2), match.group(3)
+        first = 1
+        part = QUIZ_PART.search(prompt)
+        if part:
+            first = int(part.group(1))
+            if first > 1 and 'Do not repeat' not in prompt:
+                first = max(1, first - overlap)
+        return '```json\n' + json.dumps(fake_quiz(topic, count, difficulty, first), indent=2) + '\n```'
+    return f'This is a canned reply to: {prompt[:200]}'
+
+
+def fake_completion(messages, max_tokens=None, overlap=0):
+    """
+    (content, finish_reason) of the reply, cut off at max_tokens.
+    """
+    content = fake_reply(messages, overlap)
+    if max_tokens and len(content) > max_tokens * CHARS_PER_TOKEN:
+        return content[:max_tokens * CHARS_PER_TOKEN], 'length'
+    return content, 'stop'
+
+
+def completion_seconds(content, latency=0.0, tokens_per_second=0.0):
+    """
+    How long writing `content` takes.
+    """
+    seconds = latency
+    if tokens_per_second:
+        seconds += len(content) / CHARS_PER_TOKEN / tokens_per_second
+    return seconds
+
+
+def chunks(content):
+    return [content[start:start + STREAM_CHUNK] for start in range(0, len(content), STREAM_CHUNK)]
+
+
+def usage(messages, content):
+    prompt_tokens = sum(len(m.get('content') or '') for m in messages) // CHARS_PER_TOKEN
+    completion_tokens = len(content) // CHARS_PER_TOKEN
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+    }
+
+
+def completion_payload(model, messages, content, finish_reason='stop'):
+    """
+    Body of a non-streamed /chat/completions response.
+    """
+    return {
+        'id': f'chatcmpl-{uuid.uuid4().hex}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': finish_reason,
+        }],
+        'usage': usage(messages, content),
+    }
+
+
+def chunk_payload(completion_id, model, content, finish_reason=None):
+    """
+    One event of a streamed /chat/completions response.
+    """
+    return {
+        'id': completion_id,
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'delta': {'content': content} if content is not None else {},
+            'finish_reason': finish_reason,
+        }],
+    }
+
+
+def _completion(messages, content, finish_reason):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(
+            message=SimpleNamespace(role='assistant', content=content),
+            finish_reason=finish_reason,
+        )],
+        usage=SimpleNamespace(**usage(messages, content)),
+    )
+
+
+def _chunk(content, finish_reason=None):
+    return SimpleNamespace(choices=[SimpleNamespace(
+        delta=SimpleNamespace(content=content),
+        finish_reason=finish_reason,
+    )])
+
+
+class _Completions:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model=None, messages=(), stream=False, max_completion_tokens=None, **kwargs):
+        self.client.calls += 1
+        messages = list(messages)
+        content, finish_reason = fake_completion(messages, max_completion_tokens, self.client.overlap)
+        seconds = completion_seconds(content, self.client.latency, self.client.tokens_per_second)
+        if seconds:
+            time.sleep(seconds)
+        if stream:
+            return self._stream(content, finish_reason)
+        return _completion(messages, content, finish_reason)
+
+    def _stream(self, content, finish_reason):
+        for piece in chunks(content):
+            yield _chunk(piece)
+        yield _chunk(None, finish_reason)
+
+
+class _AsyncCompletions:
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, model=None, messages=(), stream=False, max_completion_tokens=None, **kwargs):
+        self.client.calls += 1
+        messages = list(messages)
+        content, finish_reason = fake_completion(messages, max_completion_tokens, self.client.overlap)
+        if stream:
+            return self._stream(content, finish_reason)
+        seconds = completion_seconds(content, self.client.latency, self.client.tokens_per_second)
+        if seconds:
+            await asyncio.sleep(seconds)
+        return _completion(messages, content, finish_reason)
+
+    async def _stream(self, content, finish_reason):
+        # The time is spread over the chunks, like tokens arriving
+        pieces = chunks(content)
+        delay = completion_seconds(content, self.client.latency, self.client.tokens_per_second) / max(len(pieces), 1)
+        for piece in pieces:
+            if delay:
+                await asyncio.sleep(delay)
+            yield _chunk(piece)
+        yield _chunk(None, finish_reason)
+
+
+class FakeGroq:
+    def __init__(self, latency=0.0, tokens_per_second=0.0, overlap=0):
+        # Seconds before the first token and tokens written per second
+        # after it (0 for instant), to imitate the real API
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.overlap = overlap
+        # Number of completions requested, so callers can check caching
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+
+class AsyncFakeGroq:
+    def __init__(self, latency=0.0, tokens_per_second=0.0, overlap=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.overlap = overlap
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(self))
@@ -2,11 +2,22 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
+from django.http import HttpResponse, HttpResponseNotModified
+from asgiref.sync import async_to_sync
 from ..models import GameRoom, Player, Quiz, Question
+from .roomState import rooms
+from .answerPipeline import answers
+from .questionBank import add_quiz_safely
+from .quizCompiler import compile_quiz, normalize_topic, time_limit_error
+from .roomAffinity import is_local_room
+from ..logs import get_logger
+from ..querybudget import query_budget
 import uuid
 import random
 import json
 
+log = get_logger('game')
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_game(request):
@@ -18,11 +29,21 @@ def create_game(request):
         quiz_data = request.data.get('quiz_data')
         if not quiz_data:
             return Response({'error': 'Quiz data is required'}, status=400)
+        if not isinstance(quiz_data, dict):
+            return Response({'error': 'Quiz data must be an object'}, status=400)
+        error = time_limit_error(quiz_data)
+        if error:
+            return Response({'error': error}, status=400)
+        
+        # Normalize the quiz once so answering never has to re-parse it
+        compiled = compile_quiz(quiz_data)
         
         # Create a new game
         game = GameRoom.objects.create(
             host=request.user,
-            quiz_data=quiz_data
+            quiz_data=quiz_data,
+            compiled_quiz=compiled.to_dict(),
+            topic=normalize_topic(request.data.get('topic') or quiz_data.get('topic'))
         )
         
         # Add the host as a player
@@ -31,6 +52,11 @@ def create_game(request):
             game=game,
             is_ready=True  # Host is automatically ready
         )
+
+        # Hosts' own questions go into the bank too; ones it already has
+        # (e.g. a generated quiz) are skipped
+        add_quiz_safely(quiz_data, game.topic,
+                        request.data.get('difficulty') or quiz_data.get('difficulty'), source='imported')
         
         return Response({
             'success': True,
@@ -43,6 +69,34 @@ def create_game(request):
             'error': str(e)
         }, status=500)
 
+def create_generating_game(user, topic, time_per_question=None):
+    """
+    Create a game whose quiz is still being generated and return its live
+    room, marked as generating. The code is picked so this worker owns the
+    room and streamed questions can go straight into its state.
+    """
+    code = GameRoom.generate_unique_code()
+    # About one code in len(ROOM_WORKERS) is ours; the bound only matters
+    # if this worker is missing from ROOM_WORKERS
+    for _ in range(100):
+        if is_local_room(code):
+            break
+        code = GameRoom.generate_unique_code()
+    quiz_data = {'title': f'{topic} Quiz', 'questions': [], 'topic': topic}
+    if time_per_question:
+        quiz_data['timePerQuestion'] = time_per_question
+    game = GameRoom.objects.create(
+        host=user,
+        code=code,
+        quiz_data=quiz_data,
+        compiled_quiz=compile_quiz(quiz_data).to_dict(),
+        topic=normalize_topic(topic)
+    )
+    Player.objects.create(user=user, game=game, is_ready=True)
+    room = rooms.get(code)
+    room.generating = True
+    return room
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def join_game(request):
@@ -77,6 +131,9 @@ def join_game(request):
             user=request.user,
             game=game
         )
+        # Store the live room's unsaved changes before re-reading it
+        rooms.flush(game.code)
+        rooms.refresh(game.code)
         
         return Response({
             'success': True,
@@ -89,63 +146,33 @@ def join_game(request):
             'error': str(e)
         }, status=500)
 
+@query_budget(4)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_game_status(request, game_code):
     """
     Get the current status of a game room, including player stats.
-    """
-    try:
-        game = GameRoom.objects.get(code=game_code)
-        players = Player.objects.filter(game=game).select_related('user')
-
-        # Format player data with full stats
-        player_data = []
-        for player in players:
-            player_data.append({
-                'username': player.user.username,
-                'score': player.score,
-                'is_ready': player.is_ready,
-                'has_answered': player.current_answer is not None,
-                'is_host': player.user == game.host,
-                'correct_answers': player.correct_answers,
-                'current_streak': player.current_streak,
-                'best_streak': player.best_streak,
-                'average_time': round(player.average_time, 2),
-                'total_questions': player.total_questions,
-            })
-
-        # Extract current question if valid
-        current_question_data = None
-        questions = game.quiz_data.get("questions", [])
-        if game.status == 'in_progress' and game.current_question < len(questions):
-            q = questions[game.current_question]
-            current_question_data = {
-                'question': q.get('question'),
-                'options': q.get('options')
-            }
 
-        return Response({
-            'success': True,
-            'game': {
-                'code': game.code,
-                'status': game.status,
-                'host': game.host.username,
-                'current_question': game.current_question,
-                'current_question_data': current_question_data,
-                'players': player_data,
-                'created_at': game.created_at,
-                'started_at': game.started_at,
-                'ended_at': game.ended_at
-            }
-        })
-
-    except GameRoom.DoesNotExist:
+    Served from the live room: the JSON body is rendered once per room
+    version and tagged with an ETag, so a poll with a matching
+    If-None-Match gets an empty 304 and no database work.
+    """
+    room = rooms.get(game_code)
+    if room is None:
         return Response({
             'success': False,
             'error': 'Game not found'
         }, status=404)
 
+    etag, body = room.rendered_status()
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # Let browsers keep the body but revalidate on every poll
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -155,6 +182,7 @@ def start_game(request, game_code):
     """
     try:
         # Find the game
+        rooms.flush(game_code)
         try:
             game = GameRoom.objects.get(code=game_code)
         except GameRoom.DoesNotExist:
@@ -167,11 +195,19 @@ def start_game(request, game_code):
         # Check if game can be started
         if game.status != 'waiting':
             return Response({'error': 'Game has already started or ended'}, status=400)
+        if not game.quiz_data.get('questions'):
+            return Response({'error': 'The quiz has no questions yet'}, status=409)
         
         # Start the game
         game.status = 'in_progress'
         game.started_at = timezone.now()
-        game.save()
+        # Only the fields changed here: a room being generated into may
+        # store new questions meanwhile
+        game.save(update_fields=['status', 'started_at'])
+        rooms.refresh(game_code)
+        # Answer times are measured from here and the question closes at its
+        # deadline, whether or not anyone is on the game socket
+        async_to_sync(rooms.question_opened)(rooms.get(game_code))
         
         return Response({
             'success': True,
@@ -190,44 +226,57 @@ def submit_answer(request, game_code):
     Submit an answer for the current question
     """
     try:
-        # Get parameters
+        # Get parameters. A client-reported answer_time is ignored: the
+        # room measures it from when the question opened
         answer = request.data.get('answer')
-        answer_time = request.data.get('answer_time')
         
-        print(f"[BACKEND] Received answer submission: answer={answer}, answer_time={answer_time}")
+        log.debug('answer_received', game=game_code, answer=answer)
         
-        if answer is None or answer_time is None:
-            error_msg = 'Answer and answer time are required'
-            print(f"[BACKEND] {error_msg}")
+        if answer is None:
+            error_msg = 'Answer is required'
+            log.info('answer_rejected', game=game_code, reason=error_msg)
             return Response({'error': error_msg}, status=400)
         
-        # Find the game
-        try:
-            game = GameRoom.objects.get(code=game_code)
-            print(f"[BACKEND] Found game: {game_code}, status={game.status}, current_question={game.current_question}")
-        except GameRoom.DoesNotExist:
+        # Find the live room, loading it if needed
+        room = rooms.get(game_code)
+        if room is None:
             error_msg = f'Game not found: {game_code}'
-            print(f"[BACKEND] {error_msg}")
+            log.info('answer_rejected', game=game_code, reason=error_msg)
             return Response({'error': error_msg}, status=404)
         
         # Check if the game is in progress
-        if game.status != 'in_progress':
-            error_msg = f'Game is not in progress. Current status: {game.status}'
-            print(f"[BACKEND] {error_msg}")
+        if room.status != 'in_progress':
+            error_msg = f'Game is not in progress. Current status: {room.status}'
+            log.info('answer_rejected', game=game_code, reason=error_msg)
             return Response({'error': error_msg}, status=400)
         
-        # Get or create player
-        player, created = Player.objects.get_or_create(
-            user=request.user,
-            game=game,
-            defaults={'score': 0}
-        )
+        if not room.questions or room.current_question >= len(room.questions):
+            return Response({
+                'success': False,
+                'error': 'Error processing question data',
+                'details': 'Current question index out of range'
+            }, status=500)
         
-        print(f"[BACKEND] Player {request.user.username} (existing: {not created}) - current score: {player.score}")
+        # Get or create player
+        username = request.user.username
+        if room.get_player(username=username) is None:
+            player, created = Player.objects.get_or_create(
+                user=request.user,
+                game_id=room.game_id,
+                defaults={'score': 0}
+            )
+            room.add_player(player)
+        
+        # Scored and stored by the room's single answer writer, batched with
+        # whatever else arrived at the same time
+        result = async_to_sync(answers.submit)(room, username, answer)
+        player = result.player
         
         # Check if player has already answered
-        if player.current_answer is not None:
-            print(f"[BACKEND] Player {request.user.username} has already answered: {player.current_answer}")
+        if not result.accepted:
+            if not room.answering_open and player.current_answer is None:
+                return Response({'error': 'Answering is closed for this question'}, status=400)
+            log.debug('answer_duplicate', game=game_code, player=username, answer=player.current_answer)
             return Response({
                 'success': True,
                 'message': 'You have already submitted an answer',
@@ -235,68 +284,10 @@ def submit_answer(request, game_code):
                 'correct': player.current_answer == answer
             })
         
-        # Record the answer
-        player.current_answer = answer
-        
-        try:
-            # Get current question data with error handling
-            questions = game.quiz_data.get('questions', [])
-            if not questions:
-                raise IndexError("No questions in quiz data")
-            
-            if game.current_question >= len(questions):
-                raise IndexError("Current question index out of range")
-                
-            current_question = questions[game.current_question]
-            
-            # Check for both 'correct_answer' and 'correctAnswer' (case-sensitive)
-            if 'correct_answer' not in current_question:
-                # Check for 'correctAnswer' (capital A) which comes from the AI generator
-                if 'correctAnswer' in current_question:
-                    # Convert letter answer (A, B, C, D) to index (0, 1, 2, 3)
-                    correct_letter = current_question['correctAnswer'].upper()
-                    if correct_letter in ['A', 'B', 'C', 'D']:
-                        current_question['correct_answer'] = ord(correct_letter) - ord('A')
-                # Check for 'correct' (alternative format)
-                elif 'correct' in current_question:
-                    current_question['correct_answer'] = current_question['correct']
-                # Try to find correct answer in options if not directly available
-                elif 'options' in current_question and isinstance(current_question['options'], list):
-                    for i, option in enumerate(current_question['options']):
-                        if isinstance(option, dict) and option.get('isCorrect', False):
-                            current_question['correct_answer'] = i
-                            break
-            
-            # If still no correct_answer, default to 0 (first option)
-            if 'correct_answer' not in current_question:
-                current_question['correct_answer'] = 0
-            
-            correct_answer = current_question['correct_answer']
-            is_correct = answer == correct_answer
-            
-            # Update score if correct
-            if is_correct:
-                max_time = game.quiz_data.get('timePerQuestion', 30)
-                time_factor = max(0, 1 - (float(answer_time) / max_time))
-                points = int(1000 * time_factor)
-                player.score += points
-        
-        except (IndexError, KeyError) as e:
-            return Response({
-                'success': False,
-                'error': 'Error processing question data',
-                'details': str(e)
-            }, status=500)
-        print(f"[BACKEND] Stats updated: correct={player.correct_answers}, streak={player.current_streak}")
-
-        player.update_stats(is_correct, float(answer_time))
-        print(f"[BACKEND] Stats updated: correct={player.correct_answers}, streak={player.current_streak}")
-
-            
-        # Save player and game states
-        player.save()
-        game.save()
-        print(player)
+        is_correct = result.is_correct
+        correct_answer = result.correct_answer
+        log.debug('answer_scored', game=game_code, player=username, correct=is_correct,
+                  score=player.score, streak=player.current_streak)
         
         return Response({
             'success': True,
@@ -307,10 +298,7 @@ def submit_answer(request, game_code):
         }, status=200)
             
     except Exception as e:
-        error_msg = f'Error in submit_answer: {str(e)}'
-        print(f"[BACKEND] {error_msg}")
-        import traceback
-        traceback.print_exc()
+        log.exception('submit_answer_failed', game=game_code)
         return Response({
             'error': str(e)
         }, status=500)
@@ -322,39 +310,43 @@ def next_question(request, game_code):
     Move to the next question (host only)
     """
     try:
-        # Find the game
-        try:
-            game = GameRoom.objects.get(code=game_code)
-        except GameRoom.DoesNotExist:
+        # Find the live room, loading it if needed
+        room = rooms.get(game_code)
+        if room is None:
             return Response({'error': 'Game not found'}, status=404)
         
         # Check if user is the host
-        if game.host != request.user:
+        if room.host != request.user.username:
             return Response({'error': 'Only the host can move to the next question'}, status=403)
         
         # Check if game is in progress
-        if game.status != 'in_progress':
+        if room.status != 'in_progress':
             return Response({'error': 'Game is not in progress'}, status=400)
         
-        # Reset all player answers for the next question
-        Player.objects.filter(game=game).update(current_answer=None, answer_time=None)
-        
-        # Move to the next question
-        total_questions = len(game.quiz_data.get('questions', []))
-        game.current_question += 1
-        
-        # Check if the game is complete
-        if game.current_question >= total_questions:
-            game.status = 'completed'
-            game.ended_at = timezone.now()
-        
-        game.save()
+        # The question the host is leaving, if the client says; without it
+        # the room moves on from wherever it is
+        expected = request.data.get('current_question')
+        if expected is not None and (isinstance(expected, bool) or not isinstance(expected, int)):
+            return Response({'error': 'current_question must be a question index'}, status=400)
+        
+        # The next question may still be streaming in; refuse before the
+        # answers are reset
+        if room.generating and room.current_question + 1 >= len(room.quiz):
+            return Response({'error': 'The next question is still being generated'}, status=409)
+        
+        # Same path as the socket and the reveal timer, under the room's
+        # lock: the question's counts are kept and the answers reset, and
+        # of two requests to leave the same question only one moves on
+        if not room.next_question(expected=expected):
+            return Response({'error': 'The game has already moved past this question'}, status=409)
+        rooms.flush(game_code)
+        async_to_sync(rooms.question_advanced)(room)
         
         return Response({
             'success': True,
             'message': 'Moved to next question',
-            'current_question': game.current_question,
-            'game_status': game.status
+            'current_question': room.current_question,
+            'game_status': room.status
         }, status=200)
         
     except Exception as e:
@@ -362,6 +354,7 @@ def next_question(request, game_code):
             'error': str(e)
         }, status=500)
 
+@query_budget(6)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_leaderboard(request, game_code):
@@ -376,6 +369,7 @@ def get_leaderboard(request, game_code):
             return Response({'error': 'Game not found'}, status=404)
         
         # Get players sorted by score
+        rooms.flush(game_code)
         players = Player.objects.filter(game=game).select_related('user').order_by('-score')
         
         # Format player data
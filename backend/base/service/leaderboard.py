@@ -0,0 +1,451 @@
+"""
+Global leaderboards: all-time, weekly and per topic.
+
+Each board keeps its users ordered by score in an indexable skip list, so
+the top K, a page further down and any user's rank are O(log n) reads.
+Boards are fed from completed games: sync() pulls the games completed
+since the last one applied, which runs when a game completes in this
+process (game_completed) and at most every SYNC_INTERVAL seconds on reads
+so games finished by other workers show up too. The whole state is
+snapshotted to LEADERBOARD_SNAPSHOT_PATH every SNAPSHOT_INTERVAL seconds;
+a restart loads the snapshot and catches up from there instead of
+re-reading every Player row.
+"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..logs import get_logger
+from ..models import GameRoom, Player
+
+# Seconds between catch-up reads of games completed elsewhere
+SYNC_INTERVAL = 5
+
+# Seconds between snapshots to disk
+SNAPSHOT_INTERVAL = 60
+
+# Games are applied by (ended_at, id); ones stored up to this many seconds
+# out of order (write-behind flushes, several workers) are still picked up
+SYNC_LAG = 120
+
+# Weekly boards kept, the current week included
+WEEKS_KEPT = 2
+
+SNAPSHOT_VERSION = 1
+
+log = get_logger('leaderboard')
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'span')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        # Number of positions moved when following next[i]
+        self.span = [0] * level
+
+
+class SkipList:
+    """
+    Sorted set of unique, comparable keys with positional access.
+
+    Every forward link records how many positions it skips, which is what
+    makes rank() and the positional reads logarithmic. Ranks are 1-based.
+    """
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self, seed=None):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        self._random = random.Random(seed)
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and self._random.random() < self.P:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [None] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            rank[i] = 0 if i == self._level - 1 else rank[i + 1]
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.span[i]
+                node = node.next[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                self._head.span[i] = self._size
+            self._level = level
+
+        new = _Node(key, level)
+        for i in range(level):
+            new.next[i] = update[i].next[i]
+            update[i].next[i] = new
+            new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].span[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update = [None] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].next[i] is target:
+                update[i].span[i] += target.span[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].span[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def rank(self, key):
+        """
+        1-based position of `key`, or None if it is not in the list.
+        """
+        position = 0
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and node.next[i].key <= key:
+                position += node.span[i]
+                node = node.next[i]
+            if node.key == key:
+                return position
+        return None
+
+    def _node_at(self, position):
+        traversed = 0
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.next[i] is not None and traversed + node.span[i] <= position:
+                traversed += node.span[i]
+                node = node.next[i]
+            if traversed == position:
+                return node
+        return None
+
+    def slice(self, start, count):
+        """
+        Up to `count` keys from 1-based position `start` on.
+        """
+        if start < 1 or count <= 0 or start > self._size:
+            return []
+        node = self._node_at(start)
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+
+class Leaderboard:
+    """
+    Users ranked by score, highest first; equal scores are ordered by user
+    id so ranks are stable.
+    """
+
+    def __init__(self):
+        self._scores = {}
+        self._index = SkipList()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def add(self, user_id, points):
+        old = self._scores.get(user_id)
+        if old is not None:
+            self._index.remove((-old, user_id))
+        score = (old or 0) + points
+        self._scores[user_id] = score
+        self._index.insert((-score, user_id))
+
+    def top(self, limit, offset=0):
+        """
+        [(rank, user_id, score)] for ranks offset+1 .. offset+limit.
+        """
+        keys = self._index.slice(offset + 1, limit)
+        return [(offset + i + 1, user_id, -score) for i, (score, user_id) in enumerate(keys)]
+
+    def rank(self, user_id):
+        """
+        (rank, score) of a user, or None if they are not on the board.
+        """
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return self._index.rank((-score, user_id)), score
+
+    def items(self):
+        return [(user_id, -score) for score, user_id in self._index]
+
+    @classmethod
+    def from_items(cls, items):
+        board = cls()
+        for user_id, score in items:
+            board.add(user_id, score)
+        return board
+
+
+def week_key(moment):
+    year, week, _ = moment.astimezone(dt_timezone.utc).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+class LeaderboardRegistry:
+    """
+    Process-wide set of boards, named 'all', 'week:<YYYY-Www>' and
+    'topic:<topic>'.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._boards = None
+        self._usernames = {}
+        # (ended_at, id) of the latest game applied, and the ids applied
+        # within SYNC_LAG of it, so late arrivals are added exactly once
+        self._watermark = None
+        self._recent = {}
+        self._last_sync = 0.0
+        self._snapshot_thread = None
+
+    # Reads
+
+    def standings(self, name, limit, offset=0, user_id=None):
+        """
+        One page of board `name` as (size, [(rank, user_id, username, score)],
+        (rank, score) of `user_id` or None). None if there is no such board.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            board = self._boards.get(name)
+            if board is None:
+                return None
+            entries = [(rank, uid, self._usernames.get(uid), score) for rank, uid, score in board.top(limit, offset)]
+            mine = board.rank(user_id) if user_id is not None else None
+            return len(board), entries, mine
+
+    def names(self):
+        self._ensure_fresh()
+        with self._lock:
+            return sorted(self._boards)
+
+    def _ensure_fresh(self):
+        if self._boards is None:
+            self.load()
+        elif time.monotonic() - self._last_sync > SYNC_INTERVAL:
+            self.sync(force=False)
+
+    # Feeding
+
+    def load(self):
+        """
+        Restore the snapshot if there is one, else build every board from
+        the database, then catch up.
+        """
+        with self._lock:
+            if self._boards is not None:
+                return
+            if not self._restore():
+                self._rebuild()
+            self._start_snapshots()
+        self.sync()
+
+    def game_completed(self):
+        # Boards nobody has read yet are built on first use instead
+        if self._boards is not None:
+            self.sync()
+
+    def sync(self, force=True):
+        """
+        Apply the games completed since the last sync. Without `force`, does
+        nothing if another thread synced within SYNC_INTERVAL.
+        """
+        with self._lock:
+            if self._boards is None:
+                self.load()
+                return
+            if not force and time.monotonic() - self._last_sync <= SYNC_INTERVAL:
+                return
+            self._last_sync = time.monotonic()
+            games = GameRoom.objects.filter(status='completed', ended_at__isnull=False)
+            if self._watermark is not None:
+                games = games.filter(ended_at__gte=self._watermark[0] - timedelta(seconds=SYNC_LAG))
+            games = [g for g in games.order_by('ended_at', 'id').values('id', 'ended_at', 'topic')
+                     if g['id'] not in self._recent]
+            if not games:
+                return
+            by_game = {g['id']: g for g in games}
+            rows = Player.objects.filter(game_id__in=list(by_game)).values_list(
+                'game_id', 'user_id', 'user__username', 'score')
+            for game_id, user_id, username, score in rows:
+                game = by_game[game_id]
+                self._apply(user_id, username, score or 0, game['ended_at'], game['topic'])
+            for game in games:
+                self._recent[game['id']] = game['ended_at']
+                if self._watermark is None or (game['ended_at'], game['id']) > self._watermark:
+                    self._watermark = (game['ended_at'], game['id'])
+            self._prune()
+            log.debug('leaderboards_synced', games=len(games))
+
+    def _apply(self, user_id, username, score, ended_at, topic):
+        self._usernames[user_id] = username
+        self._get_or_create('all').add(user_id, score)
+        week = week_key(ended_at)
+        if week >= self._oldest_week():
+            self._get_or_create(f'week:{week}').add(user_id, score)
+        if topic:
+            self._get_or_create(f'topic:{topic}').add(user_id, score)
+
+    def _get_or_create(self, name):
+        board = self._boards.get(name)
+        if board is None:
+            board = self._boards[name] = Leaderboard()
+        return board
+
+    def _oldest_week(self):
+        return week_key(timezone.now() - timedelta(weeks=WEEKS_KEPT - 1))
+
+    def _prune(self):
+        if self._watermark is not None:
+            cutoff = self._watermark[0] - timedelta(seconds=SYNC_LAG)
+            self._recent = {game_id: ended for game_id, ended in self._recent.items() if ended >= cutoff}
+        oldest = 'week:' + self._oldest_week()
+        for name in [n for n in self._boards if n.startswith('week:') and n < oldest]:
+            del self._boards[name]
+
+    def _rebuild(self):
+        """
+        Build every board from all completed games, one pass over Player.
+        """
+        self._boards = {}
+        self._usernames = {}
+        self._recent = {}
+        self._watermark = None
+        oldest = self._oldest_week()
+        totals = {}
+        rows = Player.objects.filter(game__status='completed', game__ended_at__isnull=False).values_list(
+            'user_id', 'user__username', 'score', 'game__ended_at', 'game__topic', 'game_id')
+        for user_id, username, score, ended_at, topic, game_id in rows.iterator(chunk_size=10000):
+            self._usernames[user_id] = username
+            names = ['all']
+            week = week_key(ended_at)
+            if week >= oldest:
+                names.append(f'week:{week}')
+            if topic:
+                names.append(f'topic:{topic}')
+            for name in names:
+                board = totals.setdefault(name, {})
+                board[user_id] = board.get(user_id, 0) + (score or 0)
+            if self._watermark is None or (ended_at, game_id) > self._watermark:
+                self._watermark = (ended_at, game_id)
+        # Insert each user once per board rather than once per game
+        self._boards = {name: Leaderboard.from_items(scores.items()) for name, scores in totals.items()}
+        if self._watermark is not None:
+            cutoff = self._watermark[0] - timedelta(seconds=SYNC_LAG)
+            self._recent = dict(GameRoom.objects.filter(status='completed', ended_at__gte=cutoff)
+                                .values_list('id', 'ended_at'))
+        log.info('leaderboards_rebuilt', boards=len(self._boards), users=len(self._usernames))
+
+    def rebuild(self):
+        with self._lock:
+            self._rebuild()
+            self._last_sync = time.monotonic()
+
+    # Snapshots
+
+    def snapshot_path(self):
+        return getattr(settings, 'LEADERBOARD_SNAPSHOT_PATH', None)
+
+    def snapshot(self):
+        """
+        Write the boards to LEADERBOARD_SNAPSHOT_PATH, atomically.
+        """
+        path = self.snapshot_path()
+        if not path or self._boards is None:
+            return False
+        with self._lock:
+            data = {
+                'version': SNAPSHOT_VERSION,
+                'watermark': [self._watermark[0].isoformat(), self._watermark[1]] if self._watermark else None,
+                'recent': {str(game_id): ended.isoformat() for game_id, ended in self._recent.items()},
+                'usernames': {str(user_id): name for user_id, name in self._usernames.items()},
+                'boards': {name: board.items() for name, board in self._boards.items()},
+            }
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, path)
+        return True
+
+    def _restore(self):
+        path = self.snapshot_path()
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('version') != SNAPSHOT_VERSION:
+                return False
+            watermark = data['watermark']
+            self._watermark = (datetime.fromisoformat(watermark[0]), watermark[1]) if watermark else None
+            self._recent = {int(game_id): datetime.fromisoformat(ended) for game_id, ended in data['recent'].items()}
+            self._usernames = {int(user_id): name for user_id, name in data['usernames'].items()}
+            self._boards = {name: Leaderboard.from_items(items) for name, items in data['boards'].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            log.exception('leaderboard_snapshot_unreadable', path=str(path))
+            self._boards = None
+            return False
+        log.info('leaderboards_restored', boards=len(self._boards), users=len(self._usernames))
+        return True
+
+    def _start_snapshots(self):
+        if self._snapshot_thread is not None or not self.snapshot_path():
+            return
+        self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name='leaderboard-snapshots', daemon=True)
+        self._snapshot_thread.start()
+
+    def _snapshot_loop(self):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self.snapshot()
+            except Exception:
+                log.exception('leaderboard_snapshot_failed')
+
+
+leaderboards = LeaderboardRegistry()
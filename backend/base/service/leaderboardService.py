@@ -0,0 +1,76 @@
+from django.utils import timezone
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from ..querybudget import query_budget
+from .leaderboard import leaderboards, week_key
+from .quizCompiler import normalize_topic
+
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_PAGE_MAX = 100
+
+
+def _int_param(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _standings(request, name):
+    limit = max(1, min(_int_param(request, 'limit', LEADERBOARD_PAGE_SIZE), LEADERBOARD_PAGE_MAX))
+    offset = max(0, _int_param(request, 'offset', 0))
+    result = leaderboards.standings(name, limit, offset, user_id=request.user.id)
+    if result is None:
+        # Nobody has finished a game on this board yet
+        size, entries, mine = 0, [], None
+    else:
+        size, entries, mine = result
+    return Response({
+        'success': True,
+        'board': name,
+        'total': size,
+        'entries': [
+            {'rank': rank, 'user_id': user_id, 'username': username, 'score': score}
+            for rank, user_id, username, score in entries
+        ],
+        'me': {'rank': mine[0], 'score': mine[1]} if mine else None
+    })
+
+
+# The first request after a start loads or rebuilds the boards
+@query_budget(5)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def all_time_leaderboard(request):
+    """
+    All-time ranking by total score. ?limit= and ?offset= page through it;
+    `me` is the caller's own rank.
+    """
+    return _standings(request, 'all')
+
+
+@query_budget(5)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def weekly_leaderboard(request):
+    """
+    Ranking by score in games completed during an ISO week, this week
+    unless ?week=YYYY-Www is given.
+    """
+    week = request.query_params.get('week') or week_key(timezone.now())
+    return _standings(request, f'week:{week}')
+
+
+@query_budget(5)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def topic_leaderboard(request, topic):
+    """
+    Ranking by score in games played on one quiz topic.
+    """
+    topic = normalize_topic(topic)
+    if not topic:
+        return Response({'error': 'Topic is required'}, status=400)
+    return _standings(request, f'topic:{topic}')
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.http import HttpResponse
+from channels.layers import get_channel_layer
+
+from .. import metrics
+from .answerPipeline import answers
+from .quizGenerator import pool_stats
+from .roomState import rooms
+
+
+def _broadcast_queue_depth():
+    # Messages waiting in this process's channel layer for local sockets
+    layer = get_channel_layer()
+    channels = getattr(layer, 'channels', {})
+    return sum(getattr(queue, 'qsize', lambda: len(queue))() for queue in list(channels.values()))
+
+
+metrics.Gauge('mindclash_rooms_live', 'Rooms held in memory by this worker',
+              lambda: len(rooms.live()))
+metrics.Gauge('mindclash_sockets_open', 'Open game WebSockets',
+              lambda: sum(max(room.connections, 0) for room in rooms.live()))
+metrics.Gauge('mindclash_parked_requests', 'Long-poll and SSE requests waiting for a change',
+              lambda: sum(room.watchers for room in rooms.live()))
+metrics.Gauge('mindclash_broadcast_queue_depth', 'Messages queued in the channel layer for local sockets',
+              _broadcast_queue_depth)
+metrics.Gauge('mindclash_answer_queue_depth', 'Answers waiting for their room writer',
+              lambda: answers.queued())
+metrics.Gauge('mindclash_groq_active', 'Groq completions running on the async client',
+              lambda: pool_stats()[0])
+metrics.Gauge('mindclash_groq_queued', 'Groq completions waiting for a free slot',
+              lambda: pool_stats()[1])
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. If METRICS_TOKEN is set, requests must send
+    it as a Bearer token.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,197 @@
+"""
+Near-duplicate detection for questions with MinHash and LSH.
+
+A question is reduced to the set of words of its normalized text and its
+correct answer, and that set to a MinHash signature: the minimum of each
+of NUM_HASHES hash functions over it. Two signatures agree at a position
+with probability equal to the Jaccard similarity of the two sets, so the
+share of equal positions estimates how alike two questions are; at
+SIMILARITY or above they are near-duplicates. "In which year did World
+War II end?" and "In what year did World War II end?" (both 1945) are
+0.8 alike; "What is the capital of France?" (Paris) and "What is the
+capital of Spain?" (Madrid) 0.56. Counting the answer keeps questions
+that differ in the one word that matters apart.
+
+To find candidates without comparing against every question, the first
+BANDS * ROWS values of the signature are cut into BANDS bands and each
+band hashed to a bucket key (LSH). Questions sharing a bucket are
+compared; pairs with similarity s share at least one bucket with
+probability 1 - (1 - s^ROWS)^BANDS, about 0.95 at s=0.6 and 0.28 at
+s=0.3. Bucket keys include the scope (topic and difficulty), so a lookup
+only finds questions in the same part of the bank.
+
+When a question is added, its candidates are checked with the exact
+similarity of the word sets, as the estimate is off by about 0.04 with
+NUM_HASHES values. The batch clean-up compares signatures only, all
+candidate pairs at once.
+
+The hash functions are seeded with a constant: stored signatures are only
+comparable with ones computed by the same functions.
+"""
+import hashlib
+import re
+import zlib
+
+import numpy as np
+
+from .quizCompiler import correct_answer_index
+
+NUM_HASHES = 128
+BANDS = 12
+ROWS = 3
+SIMILARITY = 0.6
+
+_rng = np.random.default_rng(0x6d696e64)
+# Multiply-shift hashing: ((a * x + b) mod 2^64) >> 32 with odd a
+_A = _rng.integers(1, 2 ** 63, NUM_HASHES, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64)
+_SHIFT = np.uint64(32)
+
+NON_WORD = re.compile(r'[^\w ]+')
+
+
+def question_key(question):
+    """
+    Normalized question text; questions with the same key are duplicates.
+    """
+    text = question.get('question') if isinstance(question, dict) else None
+    return NON_WORD.sub('', ' '.join(str(text or '').lower().split())).strip()
+
+
+def answer_text(question):
+    """
+    Text of the correct option of a quiz question, or ''.
+    """
+    options = question.get('options')
+    correct = correct_answer_index(question)
+    if not isinstance(options, list) or not isinstance(correct, int) or not 0 <= correct < len(options):
+        return ''
+    option = options[correct]
+    return str(option.get('text') or option.get('answer') or '') if isinstance(option, dict) else str(option)
+
+
+def shingles(question):
+    """
+    The distinct words of a quiz question and its answer; empty if the
+    question has no text.
+    """
+    if not isinstance(question, dict) or not question_key(question):
+        return frozenset()
+    return frozenset(question_key(question).split()) | frozenset(question_key({'question': answer_text(question)}).split())
+
+
+def signature(words):
+    """
+    MinHash signature of a set of shingles as NUM_HASHES uint32 values,
+    or None if it is empty.
+    """
+    if not words:
+        return None
+    hashes = np.fromiter((zlib.crc32(word.encode()) for word in words), dtype=np.uint64, count=len(words))
+    return ((hashes[:, None] * _A + _B) >> _SHIFT).min(axis=0).astype(np.uint32)
+
+
+def to_bytes(sig):
+    return sig.astype('<u4').tobytes()
+
+
+def jaccard(a, b):
+    """
+    Exact Jaccard similarity of two shingle sets.
+    """
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def band_keys(sig, scope):
+    """
+    The BANDS bucket keys of a signature within a scope, as signed 64-bit
+    integers so they fit a BigIntegerField.
+    """
+    prefix = scope.encode() + b'\0'
+    rows = sig[:BANDS * ROWS].astype('<u4').reshape(BANDS, ROWS)
+    return [
+        int.from_bytes(hashlib.blake2b(prefix + bytes([band]) + rows[band].tobytes(), digest_size=8).digest(),
+                       'little', signed=True)
+        for band in range(BANDS)
+    ]
+
+
+def scope_of(topic, difficulty):
+    return f'{topic}|{difficulty}'
+
+
+class NearDuplicateIndex:
+    """
+    In-memory LSH index of shingle sets, e.g. over the questions of one
+    quiz.
+    """
+
+    def __init__(self, scope=''):
+        self.scope = scope
+        self._buckets = {}
+
+    def find(self, words, sig):
+        """
+        The item of an indexed near-duplicate of `words` (with signature
+        `sig`), or None.
+        """
+        for key in band_keys(sig, self.scope):
+            for other, item in self._buckets.get(key, ()):
+                if jaccard(words, other) >= SIMILARITY:
+                    return item
+        return None
+
+    def add(self, words, sig, item):
+        for key in band_keys(sig, self.scope):
+            self._buckets.setdefault(key, []).append((words, item))
+
+
+def duplicate_clusters(ids, matrix):
+    """
+    Groups of near-duplicate questions among signatures `matrix` (one row
+    per id in `ids`), each as a sorted list of ids; ids without a
+    near-duplicate are left out.
+
+    Rows sharing a band are found by sorting each band's values; each row
+    is paired with the first row of its run of equal values, and all
+    candidate pairs are compared at once. Clusters are joined
+    transitively.
+    """
+    count = len(ids)
+    if count < 2:
+        return []
+    ids = np.asarray(ids)
+    firsts, seconds = [], []
+    for band in range(BANDS):
+        values = np.ascontiguousarray(matrix[:, band * ROWS:(band + 1) * ROWS]).view(np.dtype((np.void, 4 * ROWS)))[:, 0]
+        order = np.argsort(values, kind='stable')
+        ordered = values[order]
+        starts = np.r_[True, ordered[1:] != ordered[:-1]]
+        run_first = order[np.maximum.accumulate(np.where(starts, np.arange(count), 0))]
+        shared = ~starts
+        firsts.append(run_first[shared])
+        seconds.append(order[shared])
+    first = np.concatenate(firsts)
+    second = np.concatenate(seconds)
+    if not len(first):
+        return []
+    pairs = np.unique(np.stack([np.minimum(first, second), np.maximum(first, second)], axis=1), axis=0)
+    similar = np.count_nonzero(matrix[pairs[:, 0]] == matrix[pairs[:, 1]], axis=1) >= SIMILARITY * NUM_HASHES
+    pairs = pairs[similar]
+
+    parent = np.arange(count)
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    clusters = {}
+    for i in np.unique(pairs):
+        clusters.setdefault(root(i), []).append(int(ids[i]))
+    return [sorted(cluster) for cluster in clusters.values()]
@@ -0,0 +1,214 @@
+"""
+Pre-generation of questions for popular topics.
+
+Every generate-quiz request is counted in TopicDemand under its
+normalized topic and difficulty. The score decays by half every
+PREGEN_HALF_LIFE seconds, so it tracks recent demand. The pre-generation
+worker (`manage.py runpregen`, one per deployment) keeps the question
+bank stocked for the PREGEN_TOPICS highest scores. A pair is stocked
+once the bank holds PREGEN_STOCK_QUIZZES quizzes' worth of its typical
+request size. Requests for those pairs are then assembled from the bank
+(questionBank.assemble) without waiting for the model.
+
+Banked questions stay in the bank when served, but each one served is
+counted against its pair (record_served), and the worker writes that many
+new ones on top of the stock, so players of a hot topic keep getting
+questions they haven't seen rather than the same stock over and over.
+
+The worker asks the model for PREGEN_BATCH questions at a time. It
+lists the newest banked questions for the model to avoid, and
+add_quiz() drops whatever still repeats. At most PREGEN_RATE
+generations start per minute, so the worker doesn't compete with hosts
+for the Groq rate limit.
+"""
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from ..logs import get_logger
+from ..models import Question, TopicDemand
+from . import quizPlanner
+from .questionBank import add_quiz, normalize_difficulty
+from .quizCompiler import normalize_topic
+from .quizGenerator import DEFAULT_MODEL, GeneratorBusy
+from .quizPlanner import AVOID_MAX
+
+log = get_logger('quiz')
+
+# Scores below this after decaying are dropped
+FORGET_SCORE = 0.05
+
+# Largest request size the stock is sized for
+TYPICAL_COUNT_MAX = 50
+
+
+def record_demand(topic, difficulty, count):
+    """
+    Count a request for a quiz of `count` questions. Never raises: a
+    request must not fail because its demand couldn't be recorded.
+    """
+    topic = normalize_topic(topic)
+    difficulty = normalize_difficulty(difficulty)
+    if not topic:
+        return
+    count = max(0, min(int(count), TYPICAL_COUNT_MAX))
+    try:
+        demand = TopicDemand.objects.filter(topic=topic, difficulty=difficulty)
+        changes = dict(score=F('score') + 1, requests=F('requests') + 1, questions=F('questions') + count,
+                       last_requested=timezone.now())
+        if demand.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                TopicDemand.objects.create(topic=topic, difficulty=difficulty, score=1, requests=1, questions=count)
+        except IntegrityError:
+            # Created by a concurrent request
+            demand.update(**changes)
+    except Exception:
+        log.exception('topic_demand_failed', topic=topic)
+
+
+def record_served(topic, difficulty, count):
+    """
+    Count `count` bank questions served for a pair, for the worker to
+    replace. Never raises, as record_demand().
+    """
+    topic = normalize_topic(topic)
+    difficulty = normalize_difficulty(difficulty)
+    try:
+        TopicDemand.objects.filter(topic=topic, difficulty=difficulty).update(served=F('served') + count)
+    except Exception:
+        log.exception('topic_served_failed', topic=topic)
+
+
+def replaced(demand, count):
+    """
+    Take `count` newly banked questions off a pair's served count.
+    """
+    TopicDemand.objects.filter(id=demand.id).update(served=Greatest(F('served') - count, 0))
+
+
+def decay(seconds):
+    """
+    Age every score by `seconds` and forget the pairs nobody asks for
+    anymore.
+    """
+    factor = 0.5 ** (seconds / settings.PREGEN_HALF_LIFE)
+    TopicDemand.objects.update(score=F('score') * factor)
+    TopicDemand.objects.filter(score__lt=FORGET_SCORE).delete()
+
+
+def hot_topics():
+    return list(TopicDemand.objects.filter(score__gte=settings.PREGEN_MIN_SCORE)
+                .order_by('-score')[:settings.PREGEN_TOPICS])
+
+
+def stock_target(demand):
+    """
+    Questions to keep in the bank for a pair: enough for
+    PREGEN_STOCK_QUIZZES of its typical request.
+    """
+    typical = round(demand.questions / demand.requests) if demand.requests else 0
+    typical = max(1, min(typical or settings.QUIZ_CHUNK_SIZE, TYPICAL_COUNT_MAX))
+    return settings.PREGEN_STOCK_QUIZZES * typical
+
+
+def bank_stock(topic, difficulty):
+    """
+    (questions in the bank, texts of the newest ones) for a pair.
+    """
+    questions = Question.objects.filter(topic=topic, difficulty=difficulty)
+    newest = list(questions.order_by('-id').values_list('question_text', flat=True)[:AVOID_MAX])
+    return questions.count(), newest[::-1]
+
+
+class RateLimiter:
+    """
+    Spaces calls to wait() at least 60 / per_minute seconds apart.
+    """
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+        self._next = max(now, self._next) + self.interval
+
+
+class Pregenerator:
+    def __init__(self, model=DEFAULT_MODEL):
+        self.model = model
+        self.limiter = RateLimiter(settings.PREGEN_RATE)
+        self._decayed_at = time.monotonic()
+        # Pairs the model couldn't write new questions for, until when
+        self._exhausted = {}
+
+    async def run(self, once=False):
+        """
+        Refill until every hot pair is stocked, then check again every
+        PREGEN_INTERVAL seconds.
+        """
+        while True:
+            try:
+                added = await self.refill()
+            except Exception:
+                log.exception('pregeneration_failed')
+                added = 0
+            if once:
+                return
+            if not added:
+                await asyncio.sleep(settings.PREGEN_INTERVAL)
+
+    async def refill(self):
+        """
+        One pass: a batch for each hot pair below its stock, hottest
+        first. Return how many questions were added.
+        """
+        now = time.monotonic()
+        await database_sync_to_async(decay)(now - self._decayed_at)
+        self._decayed_at = now
+
+        added = 0
+        for demand in await database_sync_to_async(hot_topics)():
+            pair = (demand.topic, demand.difficulty)
+            if self._exhausted.get(pair, 0) > now:
+                continue
+            stock, newest = await database_sync_to_async(bank_stock)(*pair)
+            # Fill up to the target, plus what was served since, but at most
+            # one stock's worth of replacements however much that was
+            target = stock_target(demand)
+            wanted = max(target - stock, 0) + min(demand.served, target)
+            if wanted <= 0:
+                continue
+            count = min(wanted, settings.PREGEN_BATCH)
+            await self.limiter.wait()
+            started = time.perf_counter()
+            try:
+                quiz = await quizPlanner.agenerate(demand.topic, demand.difficulty, count, self.model,
+                                                   avoid=newest, first=stock + 1)
+            except GeneratorBusy:
+                break
+            except Exception as error:
+                log.warning('pregeneration_batch_failed', topic=demand.topic, difficulty=demand.difficulty,
+                            error=repr(error))
+                continue
+            new = await database_sync_to_async(add_quiz)(quiz, demand.topic, demand.difficulty, 'pregenerated')
+            if not new:
+                # The model only repeats what the bank has; try again later
+                self._exhausted[pair] = now + settings.PREGEN_HALF_LIFE
+            elif demand.served and new > target - stock:
+                await database_sync_to_async(replaced)(demand, new - max(target - stock, 0))
+            added += new
+            log.info('pregenerated', topic=demand.topic, difficulty=demand.difficulty, score=round(demand.score, 2),
+                     stock=stock + new, target=target, served=demand.served, added=new,
+                     seconds=round(time.perf_counter() - started, 3))
+        return added
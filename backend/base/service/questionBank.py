@@ -0,0 +1,292 @@
+"""
+The question bank: every generated or imported question, kept as a
+Question row under its normalized topic and difficulty.
+
+Quizzes can be assembled from the bank instead of asking the model. Each
+question has a random key in [0, 1); a quiz of N questions is the N rows
+following a random point in the (topic, difficulty, random_key) index,
+wrapping around to the start when the point is near the end. That reads
+N index entries rather than every question on the topic, as ORDER BY
+RANDOM() would. The questions of one sample are neighbours in key order,
+so they are shuffled before being served.
+
+Questions are only added if the bank has nothing like them: exact copies
+are found by the hash of their normalized text, rewordings by their
+MinHash signature through the LSH buckets in QuestionBucket (see
+nearDuplicates.py), each with one indexed query per added quiz.
+remove_near_duplicates() cleans up a bank filled before that.
+"""
+import hashlib
+import random
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+
+from ..logs import get_logger
+from ..models import Question, QuestionBucket, Quiz
+from .nearDuplicates import (SIMILARITY, NearDuplicateIndex, band_keys, duplicate_clusters, jaccard, question_key,
+                             scope_of, shingles, signature, to_bytes)
+from .quizCompiler import ANSWER_LETTERS, correct_answer_index, normalize_topic
+
+log = get_logger('quiz')
+
+
+def normalize_difficulty(difficulty):
+    return str(difficulty or 'medium').strip().lower()[:20]
+
+
+def text_hash(question):
+    return hashlib.sha1(question_key(question).encode()).hexdigest()
+
+
+def option_text(option):
+    if isinstance(option, dict):
+        return str(option.get('text') or option.get('answer') or '')
+    return str(option)
+
+
+def bank_fields(question):
+    """
+    Question row fields for a quiz question in any format the games
+    accept, or None if it isn't a usable multiple-choice question.
+    """
+    if not isinstance(question, dict):
+        return None
+    text = str(question.get('question') or '').strip()
+    options = question.get('options')
+    # Served back with a correctAnswer letter, so only as many options as
+    # there are letters it can name
+    if not text or not isinstance(options, list) or len(options) < 2 or len(options) > len(ANSWER_LETTERS):
+        return None
+    correct = correct_answer_index(question)
+    if not isinstance(correct, int) or not 0 <= correct < len(options):
+        return None
+    return {
+        'question_text': text,
+        'options': [option_text(option) for option in options],
+        'correct_answer': ANSWER_LETTERS[correct],
+        'explanation': str(question.get('explanation') or ''),
+        'text_hash': text_hash(question),
+    }
+
+
+def add_quiz(quiz_data, topic, difficulty, source='generated'):
+    """
+    Add the questions of a quiz to the bank, skipping ones it already has
+    for the topic and difficulty, or something very like them, and
+    near-duplicates within the quiz. Return how many were added.
+    """
+    topic = normalize_topic(topic)
+    difficulty = normalize_difficulty(difficulty)
+    if not topic or not isinstance(quiz_data, dict):
+        return 0
+
+    rows = {}
+    words = {}
+    for question in quiz_data.get('questions') or []:
+        fields = bank_fields(question)
+        if fields is not None and fields['text_hash'] not in rows:
+            rows[fields['text_hash']] = fields
+            words[fields['text_hash']] = shingles(question)
+    if rows:
+        known = Question.objects.filter(
+            topic=topic, difficulty=difficulty, text_hash__in=list(rows)
+        ).values_list('text_hash', flat=True)
+        for digest in known:
+            del rows[digest]
+    scope = scope_of(topic, difficulty)
+    signatures = {digest: signature(words[digest]) for digest in rows}
+    near = _near_duplicates(words, signatures, scope)
+    for digest in near:
+        del rows[digest]
+    if not rows:
+        return 0
+
+    with transaction.atomic():
+        quiz = Quiz.objects.create(
+            topic=topic[:255],
+            num_questions=len(rows),
+            difficulty_level=difficulty[:10],
+            title=str(quiz_data.get('title') or '')[:255],
+            source=source,
+        )
+        # A concurrent add may have stored some of them since the check
+        Question.objects.bulk_create(
+            [Question(quiz=quiz, topic=topic, difficulty=difficulty, minhash=to_bytes(signatures[digest]), **fields)
+             for digest, fields in rows.items()],
+            ignore_conflicts=True,
+        )
+        # ignore_conflicts leaves the ids unset, and doesn't say which rows it skipped
+        added = list(Question.objects.filter(quiz=quiz).values_list('id', 'text_hash'))
+        if not added:
+            quiz.delete()
+            return 0
+        if len(added) != len(rows):
+            Quiz.objects.filter(id=quiz.id).update(num_questions=len(added))
+        QuestionBucket.objects.bulk_create([
+            QuestionBucket(question_id=question_id, key=key)
+            for question_id, digest in added
+            for key in band_keys(signatures[digest], scope)
+        ])
+    log.info('question_bank_added', topic=topic, difficulty=difficulty, questions=len(added),
+             near_duplicates=len(near), source=source)
+    return len(added)
+
+
+def _near_duplicates(words, signatures, scope):
+    """
+    Text hashes of the questions in `signatures` that are near-duplicates
+    of a banked question or of one before them. `words` holds their
+    shingle sets.
+    """
+    if not signatures:
+        return set()
+    keys = {digest: band_keys(sig, scope) for digest, sig in signatures.items()}
+    banked = {}
+    candidates = QuestionBucket.objects.filter(
+        key__in={key for digest_keys in keys.values() for key in digest_keys}
+    ).values_list('key', 'question__question_text', 'question__options', 'question__correct_answer')
+    for key, text, options, correct in candidates:
+        banked.setdefault(key, []).append(shingles({'question': text, 'options': options, 'correctAnswer': correct}))
+
+    index = NearDuplicateIndex(scope)
+    near = set()
+    for digest, sig in signatures.items():
+        if index.find(words[digest], sig) is not None or any(
+            jaccard(words[digest], other) >= SIMILARITY for key in keys[digest] for other in banked.get(key, ())
+        ):
+            near.add(digest)
+        else:
+            index.add(words[digest], sig, digest)
+    return near
+
+
+def add_quiz_safely(quiz_data, topic, difficulty, source='generated'):
+    """
+    add_quiz() for callers that must not fail because the bank couldn't
+    be written.
+    """
+    try:
+        return add_quiz(quiz_data, topic, difficulty, source)
+    except Exception:
+        log.exception('question_bank_add_failed', topic=topic)
+        return 0
+
+
+def sample(topic, difficulty, count):
+    """
+    Up to `count` random Question rows on the topic and difficulty; fewer
+    only if the bank doesn't hold that many.
+    """
+    if count <= 0:
+        return []
+    bank = Question.objects.filter(topic=normalize_topic(topic), difficulty=normalize_difficulty(difficulty))
+    point = random.random()
+    rows = list(bank.filter(random_key__gte=point).order_by('random_key')[:count])
+    if len(rows) < count:
+        rows += bank.filter(random_key__lt=point).order_by('random_key')[:count - len(rows)]
+    random.shuffle(rows)
+    return rows
+
+
+def assemble(topic, difficulty, count):
+    """
+    A quiz of `count` questions from the bank, in the generated-quiz
+    format, or None when the bank has too few questions or is disabled.
+    """
+    if not settings.QUESTION_BANK or count <= 0:
+        return None
+    rows = sample(topic, difficulty, count)
+    if len(rows) < count:
+        return None
+    return {
+        'title': f'{topic} Quiz',
+        'questions': [
+            {
+                'question': row.question_text,
+                'options': list(row.options),
+                'correctAnswer': row.correct_answer,
+                'explanation': row.explanation,
+            }
+            for row in rows
+        ],
+        'recommendedTimeInMinutes': max(1, count // 2),
+    }
+
+
+def backfill_signatures(batch_size=1000):
+    """
+    Compute the signatures and buckets of questions that have none, e.g.
+    ones banked before near-duplicate detection. Return how many.
+    """
+    done = 0
+    last_id = 0
+    while True:
+        batch = list(Question.objects.filter(id__gt=last_id, minhash__isnull=True).order_by('id')
+                     .only('id', 'question_text', 'options', 'correct_answer', 'topic', 'difficulty')[:batch_size])
+        if not batch:
+            return done
+        buckets = []
+        for question in batch:
+            sig = signature(shingles({'question': question.question_text, 'options': question.options,
+                                      'correctAnswer': question.correct_answer}))
+            if sig is None:
+                continue
+            question.minhash = to_bytes(sig)
+            buckets += [QuestionBucket(question_id=question.id, key=key)
+                        for key in band_keys(sig, scope_of(question.topic, question.difficulty))]
+        with transaction.atomic():
+            Question.objects.bulk_update([q for q in batch if q.minhash is not None], ['minhash'])
+            QuestionBucket.objects.bulk_create(buckets)
+        done += len(batch)
+        last_id = batch[-1].id
+
+
+def remove_near_duplicates(dry_run=False):
+    """
+    Find groups of near-duplicates in each topic and difficulty of the
+    bank and keep only the oldest question of each. Return
+    (groups, questions removed). Questions without a signature are
+    skipped; run backfill_signatures() first.
+    """
+    groups = removed = 0
+    quiz_ids = set()
+    scopes = list(Question.objects.order_by().values_list('topic', 'difficulty').distinct())
+    for topic, difficulty in scopes:
+        rows = list(Question.objects.filter(topic=topic, difficulty=difficulty, minhash__isnull=False)
+                    .order_by('id').values_list('id', 'minhash'))
+        if len(rows) < 2:
+            continue
+        ids = [question_id for question_id, _ in rows]
+        matrix = np.frombuffer(b''.join(bytes(minhash) for _, minhash in rows), dtype='<u4').reshape(len(rows), -1)
+        clusters = duplicate_clusters(ids, matrix.astype(np.uint32))
+        extra = [question_id for cluster in clusters for question_id in cluster[1:]]
+        groups += len(clusters)
+        removed += len(extra)
+        if extra and not dry_run:
+            for start in range(0, len(extra), 500):
+                batch = Question.objects.filter(id__in=extra[start:start + 500])
+                quiz_ids.update(batch.values_list('quiz_id', flat=True))
+                batch.delete()
+        if clusters:
+            log.info('question_bank_near_duplicates', topic=topic, difficulty=difficulty,
+                     groups=len(clusters), removed=len(extra), dry_run=dry_run)
+    if quiz_ids:
+        recount_quizzes(quiz_ids)
+    return groups, removed
+
+
+def recount_quizzes(quiz_ids):
+    """
+    Bring num_questions of the given quizzes up to date after questions
+    were removed, deleting the quizzes left with none.
+    """
+    quiz_ids = list(quiz_ids)
+    remaining = (Question.objects.filter(quiz=OuterRef('pk')).order_by().values('quiz')
+                 .annotate(count=Count('id')).values('count'))
+    for start in range(0, len(quiz_ids), 500):
+        quizzes = Quiz.objects.filter(id__in=quiz_ids[start:start + 500])
+        quizzes.filter(question__isnull=True).delete()
+        quizzes.update(num_questions=Subquery(remaining))
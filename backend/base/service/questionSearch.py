@@ -0,0 +1,113 @@
+"""
+Keyword search over the question bank.
+
+Questions are indexed in base_question_fts, an SQLite FTS5 table kept up
+to date by triggers (migration 0016). A search matches every word of the
+query as a prefix, in the question, its options, its explanation or its
+topic, and ranks matches by BM25 with the question text weighted
+highest. Pages are read with LIMIT/OFFSET, up to SEARCH_OFFSET_MAX deep:
+a ranked result has no stable key to page on, and nobody reads past the
+first few pages of a search.
+
+Topic facets count the matches per topic, ignoring any topic filter so
+the client can offer the other topics.
+"""
+import re
+
+from django.db import connection
+
+from ..models import Question
+from .questionBank import normalize_difficulty
+from .quizCompiler import normalize_topic
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_OFFSET_MAX = 1000
+SEARCH_TERMS_MAX = 8
+FACETS_MAX = 10
+
+# Column weights for bm25(): question_text, options, explanation, topic
+RANK = 'bm25(base_question_fts, 10.0, 2.0, 1.0, 5.0)'
+
+TERM = re.compile(r'\w+')
+
+
+def match_query(text):
+    """
+    FTS5 query matching every word of `text` as a prefix, or None if it
+    has no words. Words are quoted, so nothing typed is read as FTS5
+    syntax.
+    """
+    terms = TERM.findall(str(text or '').lower())[:SEARCH_TERMS_MAX]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _filters(topic, difficulty):
+    sql, params = '', []
+    if topic:
+        sql += ' AND q.topic = %s'
+        params.append(normalize_topic(topic))
+    if difficulty:
+        sql += ' AND q.difficulty = %s'
+        params.append(normalize_difficulty(difficulty))
+    return sql, params
+
+
+def search(text, topic=None, difficulty=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    (questions, has_more) for one page of the questions matching `text`,
+    best first. Without search words, the newest questions on the topic.
+    """
+    match = match_query(text)
+    if match is None:
+        questions = Question.objects.order_by('-id')
+        if topic:
+            questions = questions.filter(topic=normalize_topic(topic))
+        if difficulty:
+            questions = questions.filter(difficulty=normalize_difficulty(difficulty))
+        rows = list(questions[offset:offset + limit + 1])
+    else:
+        filters, params = _filters(topic, difficulty)
+        rows = list(Question.objects.raw(
+            f'SELECT q.* FROM base_question_fts f JOIN base_question q ON q.id = f.rowid '
+            f'WHERE base_question_fts MATCH %s{filters} '
+            f'ORDER BY {RANK}, q.id LIMIT %s OFFSET %s',
+            [match, *params, limit + 1, offset]
+        ))
+    return rows[:limit], len(rows) > limit
+
+
+def topic_facets(text, difficulty=None, limit=FACETS_MAX):
+    """
+    [(topic, matches)] for the topics with the most questions matching
+    `text`.
+    """
+    match = match_query(text)
+    if match is None:
+        return []
+    filters, params = _filters(None, difficulty)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT q.topic, COUNT(*) AS matches FROM base_question_fts f JOIN base_question q ON q.id = f.rowid '
+            f'WHERE base_question_fts MATCH %s{filters} '
+            f'GROUP BY q.topic ORDER BY matches DESC, q.topic LIMIT %s',
+            [match, *params, limit]
+        )
+        return cursor.fetchall()
+
+
+def rebuild_index():
+    """
+    Re-index every question from base_question, then merge the index into
+    as few segments as possible. For after the index is lost or changed.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO base_question_fts(base_question_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO base_question_fts(base_question_fts) VALUES ('optimize')")
+
+
+def optimize_index():
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO base_question_fts(base_question_fts) VALUES ('optimize')")
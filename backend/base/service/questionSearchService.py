@@ -0,0 +1,58 @@
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from ..querybudget import query_budget
+from .questionSearch import SEARCH_OFFSET_MAX, SEARCH_PAGE_MAX, SEARCH_PAGE_SIZE, search, topic_facets
+
+
+def _int_param(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Authentication, the page of matches and the topic facets
+@query_budget(3)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_questions(request):
+    """
+    Search the question bank, e.g. to build a custom quiz. ?q= holds the
+    words to look for, each matched as a prefix; ?topic= and ?difficulty=
+    narrow the results; ?limit= and ?offset= page through them. `facets`
+    counts the matches per topic.
+    """
+    text = request.query_params.get('q', '')
+    topic = request.query_params.get('topic')
+    difficulty = request.query_params.get('difficulty')
+    if not text.strip() and not topic:
+        return Response({'error': 'A search query or topic is required'}, status=400)
+    limit = max(1, min(_int_param(request, 'limit', SEARCH_PAGE_SIZE), SEARCH_PAGE_MAX))
+    offset = max(0, _int_param(request, 'offset', 0))
+    if offset > SEARCH_OFFSET_MAX:
+        return Response({'error': f'Results can be paged up to offset {SEARCH_OFFSET_MAX}'}, status=400)
+
+    questions, has_more = search(text, topic, difficulty, limit, offset)
+    return Response({
+        'success': True,
+        'results': [
+            {
+                'id': question.id,
+                'question': question.question_text,
+                'options': question.options,
+                'correctAnswer': question.correct_answer,
+                'explanation': question.explanation,
+                'topic': question.topic,
+                'difficulty': question.difficulty,
+            }
+            for question in questions
+        ],
+        'offset': offset,
+        'limit': limit,
+        'has_more': has_more,
+        'facets': {
+            'topics': [{'topic': name, 'count': count} for name, count in topic_facets(text, difficulty)]
+        }
+    })
@@ -0,0 +1,82 @@
+import asyncio
+
+from ..logs import get_logger
+from .roomState import rooms
+
+# Seconds the correct answer stays on screen before the room moves on.
+REVEAL_DELAY = 5
+
+log = get_logger('game')
+
+
+class QuestionScheduler:
+    """
+    Server-side pacing for live rooms.
+
+    Each room with an open question owns one timer handle on the event
+    loop: first the answering deadline, then the reveal pause before the
+    next question. Handles are plain loop.call_at() entries, so a single
+    loop can drive thousands of rooms without a thread or task per room.
+    """
+
+    def __init__(self):
+        self._timers = {}
+        self._tasks = set()
+
+    def question_opened(self, room):
+        """
+        Arm the answering deadline for the room's current question.
+        """
+        self.cancel(room)
+        if not room.answering_open:
+            return
+        loop = asyncio.get_running_loop()
+        self._timers[room.code] = loop.call_at(
+            loop.time() + room.time_per_question, self._close, room
+        )
+
+    def answer_recorded(self, room):
+        """
+        Close the question early once every player has answered.
+        """
+        if room.answering_open and room.all_answered:
+            self._close(room)
+
+    def pending(self, room):
+        """
+        Whether the room has a deadline or reveal pause running, so it
+        must stay loaded even with nobody connected.
+        """
+        return room.code in self._timers
+
+    def cancel(self, room):
+        handle = self._timers.pop(room.code, None)
+        if handle is not None:
+            handle.cancel()
+
+    def _close(self, room):
+        self.cancel(room)
+        if not room.close_question():
+            return
+        log.debug('question_closed', game=room.code, question=room.current_question)
+        self._spawn(rooms.broadcast(room))
+        loop = asyncio.get_running_loop()
+        self._timers[room.code] = loop.call_later(REVEAL_DELAY, self._advance, room, room.current_question)
+
+    def _advance(self, room, index):
+        self._timers.pop(room.code, None)
+        # The host may have moved on during the reveal pause already
+        if not room.next_question(expected=index):
+            return
+        rooms.schedule_flush(room)
+        self.question_opened(room)
+        self._spawn(rooms.broadcast(room))
+
+    def _spawn(self, coro):
+        # Keep a reference so the task is not garbage collected mid-flight
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+scheduler = QuestionScheduler()
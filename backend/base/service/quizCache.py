@@ -0,0 +1,299 @@
+"""
+Cache of generated quizzes, keyed on (topic, difficulty, count, model).
+
+Three layers, checked in order:
+
+- an in-process LRU of QUIZ_CACHE_SIZE entries, so popular topics are
+  answered from memory;
+- the GeneratedQuiz table, which survives restarts and is shared by all
+  workers;
+- the model itself. Concurrent requests for the same key in a process are
+  collapsed into one upstream call (single flight); the others wait for
+  its result. The async path (aget_or_generate) collapses concurrent
+  requests on the event loop the same way.
+
+Entries older than QUIZ_CACHE_TTL seconds are treated as missing in both
+layers. Failed generations are never cached.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .. import metrics
+from ..logs import get_logger
+from ..models import GeneratedQuiz
+from .questionBank import add_quiz_safely
+from .quizCompiler import normalize_topic
+
+log = get_logger('quiz')
+
+
+def cache_key(topic, difficulty, count, model):
+    """
+    (normalized key tuple, digest) for a generation request.
+    """
+    parts = (normalize_topic(topic), str(difficulty).strip().lower(), int(count), str(model).strip())
+    return parts, hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time; callers arriving while it runs get
+    its result (or exception) instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Return (result, shared), shared being True for callers that waited
+        on another caller's call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines running on one event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """
+        Await fn() and return (result, shared) like SingleFlight.do.
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            # Shielded so a waiter giving up doesn't cancel the leader's call
+            return await asyncio.shield(future), True
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except BaseException as error:
+            future.set_exception(error)
+            # Nobody may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+class QuizCache:
+    def __init__(self, ttl=None, max_entries=None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        # digest -> (expiry on the monotonic clock, quiz), least recent first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._async_flights = AsyncSingleFlight()
+
+    @property
+    def ttl(self):
+        return self._ttl if self._ttl is not None else settings.QUIZ_CACHE_TTL
+
+    @property
+    def max_entries(self):
+        return self._max_entries if self._max_entries is not None else settings.QUIZ_CACHE_SIZE
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_generate(self, topic, difficulty, count, model, generate):
+        """
+        Return (quiz, source) for the request, calling generate() on a miss.
+        source is 'memory', 'store', 'shared' (waited on an identical
+        request) or 'generated'. The quiz is a fresh copy the caller may
+        modify.
+        """
+        parts, digest = cache_key(topic, difficulty, count, model)
+        quiz = self._get(digest)
+        source = 'memory'
+        if quiz is None:
+            (quiz, source), shared = self._flights.do(digest, lambda: self._load_or_generate(parts, digest, generate))
+            if shared:
+                source = 'shared'
+        metrics.quiz_cache.inc(source)
+        return _copy(quiz), source
+
+    def _load_or_generate(self, parts, digest, generate):
+        stored = self._load(digest)
+        if stored is not None:
+            quiz, age = stored
+            self._put(digest, quiz, age)
+            return quiz, 'store'
+
+        started = time.perf_counter()
+        quiz = generate()
+        log.info('quiz_generated', topic=parts[0], difficulty=parts[1], count=parts[2], model=parts[3],
+                 seconds=round(time.perf_counter() - started, 3))
+        self._put(digest, quiz)
+        self._save(parts, digest, quiz)
+        return quiz, 'generated'
+
+    async def aget_or_generate(self, topic, difficulty, count, model, generate):
+        """
+        get_or_generate() for async callers; generate() returns an awaitable.
+        The store is read and written in a worker thread.
+        """
+        parts, digest = cache_key(topic, difficulty, count, model)
+        quiz = self._get(digest)
+        source = 'memory'
+        if quiz is None:
+            (quiz, source), shared = await self._async_flights.do(
+                digest, lambda: self._aload_or_generate(parts, digest, generate))
+            if shared:
+                source = 'shared'
+        metrics.quiz_cache.inc(source)
+        return _copy(quiz), source
+
+    async def _aload_or_generate(self, parts, digest, generate):
+        quiz = await self._alookup(digest)
+        if quiz is not None:
+            return quiz, 'store'
+
+        started = time.perf_counter()
+        quiz = await generate()
+        log.info('quiz_generated', topic=parts[0], difficulty=parts[1], count=parts[2], model=parts[3],
+                 seconds=round(time.perf_counter() - started, 3))
+        await self._astore(parts, digest, quiz)
+        return quiz, 'generated'
+
+    async def aget(self, topic, difficulty, count, model):
+        """
+        (quiz, source) from memory or the store, or (None, None) on a miss.
+        For callers that generate the quiz themselves, e.g. streaming, and
+        add it with aput().
+        """
+        parts, digest = cache_key(topic, difficulty, count, model)
+        quiz = self._get(digest)
+        source = 'memory'
+        if quiz is None:
+            quiz = await self._alookup(digest)
+            source = 'store'
+        if quiz is None:
+            return None, None
+        metrics.quiz_cache.inc(source)
+        return _copy(quiz), source
+
+    async def aput(self, topic, difficulty, count, model, quiz):
+        metrics.quiz_cache.inc('generated')
+        parts, digest = cache_key(topic, difficulty, count, model)
+        await self._astore(parts, digest, quiz)
+
+    async def _alookup(self, digest):
+        stored = await database_sync_to_async(self._load)(digest)
+        if stored is None:
+            return None
+        quiz, age = stored
+        self._put(digest, quiz, age)
+        return quiz
+
+    async def _astore(self, parts, digest, quiz):
+        self._put(digest, quiz)
+        await database_sync_to_async(self._save)(parts, digest, quiz)
+
+    # Memory
+
+    def _get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            expires, quiz = entry
+            if expires < time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return quiz
+
+    def _put(self, digest, quiz, age=0.0):
+        with self._lock:
+            self._entries[digest] = (time.monotonic() + self.ttl - age, quiz)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Store
+
+    def _load(self, digest):
+        """
+        (quiz, age in seconds) from the store, or None.
+        """
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=self.ttl)
+        row = GeneratedQuiz.objects.filter(cache_key=digest).values('quiz_data', 'created_at').first()
+        if row is None:
+            return None
+        if row['created_at'] < cutoff:
+            GeneratedQuiz.objects.filter(cache_key=digest, created_at__lt=cutoff).delete()
+            return None
+        return row['quiz_data'], (now - row['created_at']).total_seconds()
+
+    def _save(self, parts, digest, quiz):
+        topic, difficulty, count, model = parts
+        try:
+            GeneratedQuiz.objects.update_or_create(
+                cache_key=digest,
+                defaults={
+                    'topic': topic[:100],
+                    'difficulty': difficulty[:20],
+                    'count': count,
+                    'model': model[:100],
+                    'quiz_data': quiz,
+                    'created_at': timezone.now(),
+                }
+            )
+        except Exception:
+            # The quiz is still served and cached in memory
+            log.exception('quiz_cache_store_failed', topic=topic)
+        add_quiz_safely(quiz, topic, difficulty)
+
+
+def _copy(quiz):
+    return {**quiz, 'questions': [dict(q) for q in quiz.get('questions', [])]}
+
+
+quiz_cache = QuizCache()
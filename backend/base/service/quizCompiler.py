@@ -0,0 +1,153 @@
+import math
+import re
+
+import numpy as np
+
+DEFAULT_TIME_PER_QUESTION = 30
+
+# Letters a 'correctAnswer' can name, one per option
+ANSWER_LETTERS = 'ABCD'
+
+LETTER_ANSWER = re.compile(rf'^\s*([{ANSWER_LETTERS}{ANSWER_LETTERS.lower()}])(?![A-Za-z])')
+
+
+def positive_seconds(value):
+    """
+    `value` as a positive, finite number of seconds, or None. Accepts
+    numeric strings, as quizzes come from client JSON.
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(seconds) or seconds <= 0:
+        return None
+    return int(seconds) if seconds.is_integer() else seconds
+
+
+def time_per_question(data):
+    """
+    (seconds, None) from a request's optional timePerQuestion, or (None,
+    error message) if it isn't a positive number.
+    """
+    value = data.get('timePerQuestion')
+    if value is None:
+        return DEFAULT_TIME_PER_QUESTION, None
+    seconds = positive_seconds(value)
+    if seconds is None:
+        return None, 'timePerQuestion must be a positive number of seconds'
+    return seconds, None
+
+
+def time_limit_error(quiz_data):
+    """
+    Error message if the quiz's timePerQuestion or a question's timeLimit
+    isn't a positive number of seconds, else None.
+    """
+    _, error = time_per_question(quiz_data)
+    if error:
+        return error
+    for i, question in enumerate(quiz_data.get('questions') or []):
+        if isinstance(question, dict) and question.get('timeLimit') is not None \
+                and positive_seconds(question['timeLimit']) is None:
+            return f'timeLimit of question {i + 1} must be a positive number of seconds'
+    return None
+
+
+def normalize_topic(topic):
+    """
+    Canonical form of a quiz topic, so "Harry  Potter" and "harry potter"
+    are grouped together.
+    """
+    return ' '.join(str(topic or '').lower().split())[:100]
+
+
+def correct_answer_index(question):
+    """
+    Index of the correct option, whichever format the quiz was written in:
+    'correct_answer', a 'correctAnswer' letter from the AI generator
+    (e.g. "B" or "B) Paris"), 'correct', or an option flagged 'isCorrect'.
+    Defaults to 0.
+    """
+    if 'correct_answer' in question:
+        return question['correct_answer']
+    if 'correctAnswer' in question:
+        match = LETTER_ANSWER.match(str(question['correctAnswer']))
+        if match:
+            return ord(match.group(1).upper()) - ord('A')
+    elif 'correct' in question:
+        return question['correct']
+    elif isinstance(question.get('options'), list):
+        for i, option in enumerate(question['options']):
+            if isinstance(option, dict) and option.get('isCorrect', False):
+                return i
+    return 0
+
+
+class CompiledQuiz:
+    """
+    Compact, precomputed view of a quiz's questions.
+
+    Built once when the game is created, so answering only needs index
+    lookups: the answer key, option counts, per-question time limits and
+    the scoring credit table of every question.
+    """
+
+    def __init__(self, answer_key, option_counts, time_limits, partial_credit=None):
+        self.answer_key = answer_key
+        self.option_counts = option_counts
+        # Stored quizzes may predate validation; a bad limit would break deadlines
+        self.time_limits = [positive_seconds(limit) or DEFAULT_TIME_PER_QUESTION for limit in time_limits]
+        self.partial_credit = partial_credit or {}
+        self.credit_tables = [self._credit_table(i) for i in range(len(answer_key))]
+
+    def __len__(self):
+        return len(self.answer_key)
+
+    def _credit_table(self, index):
+        partial = self.partial_credit.get(str(index))
+        if partial:
+            return np.clip(np.asarray(partial, dtype=float), 0.0, 1.0)
+        table = np.zeros(max(self.option_counts[index], 1), dtype=float)
+        correct = self.answer_key[index]
+        if isinstance(correct, int) and 0 <= correct < len(table):
+            table[correct] = 1.0
+        return table
+
+    @classmethod
+    def from_quiz(cls, quiz_data):
+        quiz_data = quiz_data or {}
+        default_time = positive_seconds(quiz_data.get('timePerQuestion')) or DEFAULT_TIME_PER_QUESTION
+        answer_key, option_counts, time_limits, partial_credit = [], [], [], {}
+        for i, question in enumerate(quiz_data.get('questions', [])):
+            answer_key.append(correct_answer_index(question))
+            option_counts.append(len(question.get('options') or []))
+            time_limits.append(positive_seconds(question.get('timeLimit')) or default_time)
+            if isinstance(question.get('partial_credit'), list) and question['partial_credit']:
+                partial_credit[str(i)] = question['partial_credit']
+        return cls(answer_key, option_counts, time_limits, partial_credit)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['answer_key'], data['option_counts'], data['time_limits'], data.get('partial_credit'))
+
+    def to_dict(self):
+        return {
+            'answer_key': self.answer_key,
+            'option_counts': self.option_counts,
+            'time_limits': self.time_limits,
+            'partial_credit': self.partial_credit,
+        }
+
+
+def compile_quiz(quiz_data):
+    """
+    Normalize a quiz in place (every question gets an integer
+    'correct_answer') and return its compiled form.
+    """
+    compiled = CompiledQuiz.from_quiz(quiz_data)
+    for question, correct in zip(quiz_data.get('questions', []), compiled.answer_key):
+        question['correct_answer'] = correct
+    return compiled
@@ -0,0 +1,285 @@
+"""
+Quiz generation with the Groq chat API: the prompt, the call and parsing
+the quiz out of the model's reply.
+
+The async functions (agenerate, achat, astream) are used by the HTTP
+consumers. They share one pooled AsyncGroq client per event loop, bound
+every call by GROQ_TIMEOUT and let at most GROQ_CONCURRENCY calls run at
+once, so slow completions wait on sockets instead of holding threads.
+"""
+import asyncio
+import json
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+from django.conf import settings
+from groq import APITimeoutError, AsyncGroq
+
+from .. import metrics
+from .fakeGroq import AsyncFakeGroq
+
+DEFAULT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+
+
+class QuizParseError(ValueError):
+    """
+    The model's reply did not contain a usable quiz.
+    """
+
+    def __init__(self, message, raw_response):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+class GeneratorBusy(Exception):
+    """
+    No generation slot freed up within GROQ_QUEUE_TIMEOUT seconds.
+    """
+
+
+class GeneratorTimeout(Exception):
+    """
+    The model did not finish within GROQ_TIMEOUT seconds.
+    """
+
+
+def quiz_prompt(topic, count, difficulty, part=None):
+    return f"""Generate a timed quiz of {count} multiple-choice questions on the topic "{topic}" with difficulty level {difficulty}.
+
+        Format the response as a JSON object with the following structure:
+        {{
+          "title": "Quiz title",
+          "questions": [
+            {{
+              "question": "Question text",
+              "options": ["Option A", "Option B", "Option C", "Option D"],
+              "correctAnswer": "Correct option letter (A, B, C, or D)",
+              "explanation": "Brief explanation of the answer"
+            }},
+            ... more questions
+          ],
+          "recommendedTimeInMinutes": recommended time to complete this quiz
+        }}
+
+        Make sure all questions are factually accurate and each has exactly 4 answer options.
+        """ + (part_instructions(part) if part is not None else "")
+
+
+def part_instructions(part):
+    """
+    Extra prompt text for one part of a quiz generated in parts
+    (quizPlanner.Part), so the parts don't all write the same questions.
+    """
+    text = f"""
+        This is part {part.number} of {part.parts} of a {part.total}-question quiz: write its questions {part.start}-{part.start + part.count - 1}.
+        Cover aspects of the topic that the other parts are unlikely to cover.
+        """
+    if part.avoid:
+        text += "Do not repeat any of these questions:\n" + "".join(f"        - {q}\n" for q in part.avoid)
+    return text
+
+
+def completion_args(topic, count, difficulty, model, part=None):
+    return dict(
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": quiz_prompt(topic, count, difficulty, part)
+            }
+        ],
+        temperature=0.7,
+        max_completion_tokens=2048,
+        top_p=1,
+        stop=None,
+    )
+
+
+def parse_quiz(response_content):
+    """
+    Quiz dict from the model's reply, which may wrap the JSON in a code
+    block. Raises QuizParseError.
+    """
+    try:
+        # Look for JSON in code blocks or in the entire response
+        json_match = response_content.strip()
+        if "```json" in json_match:
+            json_match = json_match.split("```json")[1].split("```")[0].strip()
+        elif "```" in json_match:
+            json_match = json_match.split("```")[1].split("```")[0].strip()
+
+        quiz_data = json.loads(json_match)
+    except Exception as error:
+        raise QuizParseError(str(error), response_content)
+
+    # Validate the quiz data structure
+    if not isinstance(quiz_data, dict) or "title" not in quiz_data or "questions" not in quiz_data:
+        raise QuizParseError("Invalid quiz data structure", response_content)
+    return quiz_data
+
+
+def generate(client, topic, difficulty, count, model=DEFAULT_MODEL, part=None):
+    """
+    Ask the model for a quiz and return it parsed. Quizzes too large for
+    one completion are split up by quizPlanner, which calls this per part.
+    """
+    completion = client.chat.completions.create(
+        stream=False,
+        **completion_args(topic, count, difficulty, model, part)
+    )
+    return parse_quiz(completion.choices[0].message.content)
+
+
+# Async client
+
+class _Pool:
+    """
+    AsyncGroq client and concurrency limit of one event loop.
+    """
+
+    def __init__(self):
+        if settings.QUIZ_GENERATOR == 'stub':
+            self.client = AsyncFakeGroq(latency=settings.FAKE_GROQ_LATENCY,
+                                        tokens_per_second=settings.FAKE_GROQ_TOKENS_PER_SECOND)
+        else:
+            self.client = AsyncGroq(
+                api_key=settings.GROQ_API_KEY,
+                base_url=settings.GROQ_BASE_URL,
+                timeout=settings.GROQ_TIMEOUT,
+                max_retries=1,
+                http_client=httpx.AsyncClient(
+                    timeout=settings.GROQ_TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=settings.GROQ_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.GROQ_MAX_CONNECTIONS,
+                    ),
+                ),
+            )
+        self.slots = asyncio.Semaphore(settings.GROQ_CONCURRENCY)
+        self.active = 0
+        self.queued = 0
+
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def _pool():
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = _Pool()
+    return pool
+
+
+def pool_stats():
+    """
+    (calls running, calls waiting for a slot) over all event loops.
+    """
+    pools = list(_pools.values())
+    return sum(p.active for p in pools), sum(p.queued for p in pools)
+
+
+@asynccontextmanager
+async def slot():
+    """
+    Hold one of the GROQ_CONCURRENCY generation slots and yield the client.
+    Raises GeneratorBusy if none frees up within GROQ_QUEUE_TIMEOUT.
+    """
+    pool = _pool()
+    pool.queued += 1
+    try:
+        await asyncio.wait_for(pool.slots.acquire(), settings.GROQ_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise GeneratorBusy('Quiz generator is busy') from None
+    finally:
+        pool.queued -= 1
+    pool.active += 1
+    try:
+        yield pool.client
+    finally:
+        pool.active -= 1
+        pool.slots.release()
+
+
+async def _complete(kind, **kwargs):
+    started = time.perf_counter()
+    async with slot() as client:
+        try:
+            completion = await asyncio.wait_for(
+                client.chat.completions.create(stream=False, **kwargs), settings.GROQ_TIMEOUT)
+        except (asyncio.TimeoutError, APITimeoutError):
+            metrics.groq_errors.inc(kind, 'timeout')
+            raise GeneratorTimeout(f'No reply from the model within {settings.GROQ_TIMEOUT:g}s') from None
+        except Exception:
+            metrics.groq_errors.inc(kind, 'error')
+            raise
+    metrics.groq_latency.observe(time.perf_counter() - started, kind)
+    return completion
+
+
+async def agenerate(topic, difficulty, count, model=DEFAULT_MODEL, part=None):
+    """
+    Async generate() on the pooled client.
+    """
+    completion = await _complete('quiz', **completion_args(topic, count, difficulty, model, part))
+    return parse_quiz(completion.choices[0].message.content)
+
+
+async def achat(prompt, model=DEFAULT_MODEL, max_tokens=1024, temperature=1.0):
+    """
+    Completion of a single user prompt on the pooled client.
+    """
+    return await _complete(
+        'chat',
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        temperature=temperature,
+        max_completion_tokens=max_tokens,
+        top_p=1,
+        stop=None,
+    )
+
+
+async def astream(topic, difficulty, count, model=DEFAULT_MODEL, part=None):
+    """
+    Yield the model's reply to the quiz prompt piece by piece as it is
+    generated. The whole stream, not each piece, must finish within
+    GROQ_TIMEOUT.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + settings.GROQ_TIMEOUT
+    stream = None
+    async with slot() as client:
+        try:
+            stream = await asyncio.wait_for(
+                client.chat.completions.create(stream=True, **completion_args(topic, count, difficulty, model, part)),
+                settings.GROQ_TIMEOUT)
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    break
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except (asyncio.TimeoutError, APITimeoutError):
+            metrics.groq_errors.inc('stream', 'timeout')
+            raise GeneratorTimeout(f'The model did not finish within {settings.GROQ_TIMEOUT:g}s') from None
+        except GeneratorExit:
+            # The reader stopped early; drop the connection to the model
+            close = getattr(stream, 'close', None) or getattr(stream, 'aclose', None)
+            if close is not None:
+                await close()
+            raise
+        except Exception:
+            metrics.groq_errors.inc('stream', 'error')
+            raise
+    metrics.groq_latency.observe(loop.time() - started, 'stream')
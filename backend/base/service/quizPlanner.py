@@ -0,0 +1,242 @@
+"""
+Generation of large quizzes as several smaller completions run in parallel.
+
+A completion is capped at max_completion_tokens and writes its questions
+one after another, so one call for a big quiz is slow and likely to be cut
+off. A QuizPlan splits a request into parts of at most QUIZ_CHUNK_SIZE
+questions, which are generated concurrently and merged. Parts may write
+the same question, and some may fail; duplicates, exact or reworded (see
+nearDuplicates.py), are dropped and whatever is missing is asked for in
+one more round, told which questions to avoid.
+"""
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from ..logs import get_logger
+from . import quizGenerator
+from .nearDuplicates import NearDuplicateIndex, question_key, shingles, signature
+from .quizGenerator import DEFAULT_MODEL
+from .quizStream import QuestionStreamParser
+
+log = get_logger('quiz')
+
+# Rounds after the first that make up for duplicates and failed parts
+TOP_UP_ROUNDS = 1
+
+# Questions quoted back to the model in a top-up round, most recent first
+AVOID_MAX = 60
+
+Part = namedtuple('Part', ['number', 'parts', 'total', 'start', 'count', 'avoid'])
+
+class QuizPlan:
+    """
+    Parts to request and the merged result of the ones done so far.
+    """
+
+    def __init__(self, count, chunk_size=None, avoid=(), first=1):
+        self.count = count
+        # Questions written earlier that no part should repeat; `first`
+        # numbers the new ones after them
+        self.avoid = tuple(avoid)[-AVOID_MAX:]
+        self.chunk_size = max(1, chunk_size or settings.QUIZ_CHUNK_SIZE)
+        self.questions = []
+        self.title = None
+        self.minutes = 0
+        self.duplicates = 0
+        self.errors = []
+        self.rounds = 0
+        self._seen = set()
+        self._similar = NearDuplicateIndex()
+        # Number of the first question of the next part; never reused so
+        # top-up parts are asked for new questions
+        self._next_start = first
+
+    @property
+    def shortfall(self):
+        return self.count - len(self.questions)
+
+    @property
+    def complete(self):
+        return self.shortfall <= 0
+
+    def next_parts(self):
+        """
+        Parts for the next round: the whole quiz first, then whatever is
+        still missing. Empty when done.
+        """
+        if self.complete or self.rounds > TOP_UP_ROUNDS:
+            return []
+        self.rounds += 1
+        wanted = self.shortfall
+        parts = -(-wanted // self.chunk_size)
+        size, extra = divmod(wanted, parts)
+        avoid = self.avoid
+        if self.rounds > 1:
+            avoid = (avoid + tuple(q.get('question') for q in self.questions))[-AVOID_MAX:]
+        total = self._next_start - 1 + wanted
+        plan = []
+        for i in range(parts):
+            count = size + (1 if i < extra else 0)
+            plan.append(Part(i + 1, parts, total, self._next_start, count, avoid))
+            self._next_start += count
+        return plan
+
+    def prompt_part(self, part):
+        """
+        What to tell the model about the part; None for a quiz asked for in
+        one go, which gets the plain prompt.
+        """
+        if part.parts == 1 and part.start == 1 and not part.avoid:
+            return None
+        return part
+
+    def add_question(self, question):
+        """
+        Add one question unless it is a duplicate or the quiz is full.
+        """
+        if self.complete or not isinstance(question, dict):
+            return False
+        key = question_key(question)
+        if not key or key in self._seen:
+            self.duplicates += 1
+            return False
+        words = shingles(question)
+        sig = signature(words)
+        if self._similar.find(words, sig) is not None:
+            self.duplicates += 1
+            return False
+        self._seen.add(key)
+        self._similar.add(words, sig, key)
+        self.questions.append(question)
+        return True
+
+    def add(self, quiz, skip=0):
+        """
+        Merge a generated part, whose first `skip` questions were already
+        offered through add_question(); return the questions it added.
+        """
+        self.title = self.title or quiz.get('title')
+        minutes = quiz.get('recommendedTimeInMinutes')
+        if isinstance(minutes, (int, float)):
+            self.minutes += minutes
+        return [q for q in quiz.get('questions', [])[skip:] if self.add_question(q)]
+
+    def failed(self, part, error):
+        self.errors.append(error)
+        log.warning('quiz_part_failed', part=part.number, parts=part.parts, count=part.count, error=repr(error))
+
+    def quiz(self):
+        """
+        The merged quiz. Raises the first part's error if nothing was
+        generated.
+        """
+        if not self.questions:
+            raise self.errors[0] if self.errors else quizGenerator.QuizParseError('No questions generated', '')
+        if not self.complete:
+            log.warning('quiz_short', wanted=self.count, got=len(self.questions), duplicates=self.duplicates)
+        return {
+            'title': self.title or 'Quiz',
+            'questions': list(self.questions),
+            'recommendedTimeInMinutes': self.minutes or max(1, len(self.questions) // 2),
+        }
+
+
+def generate(client, topic, difficulty, count, model=DEFAULT_MODEL):
+    """
+    quizGenerator.generate() for any size of quiz, parts run on threads.
+    """
+    quiz_plan = QuizPlan(count)
+    workers = max(1, min(settings.QUIZ_MAX_PARALLEL_PARTS, -(-count // quiz_plan.chunk_size)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            parts = quiz_plan.next_parts()
+            if not parts:
+                break
+            futures = [
+                (part, pool.submit(quizGenerator.generate, client, topic, difficulty, part.count, model,
+                                   quiz_plan.prompt_part(part)))
+                for part in parts
+            ]
+            for part, future in futures:
+                try:
+                    quiz_plan.add(future.result())
+                except Exception as error:
+                    quiz_plan.failed(part, error)
+    return quiz_plan.quiz()
+
+
+async def agenerate(topic, difficulty, count, model=DEFAULT_MODEL, avoid=(), first=1):
+    """
+    quizGenerator.agenerate() for any size of quiz, parts run concurrently.
+    For more questions on a topic, `avoid` lists the ones to not repeat
+    and `first` is the number of the first new one.
+    """
+    quiz_plan = QuizPlan(count, avoid=avoid, first=first)
+    limit = asyncio.Semaphore(settings.QUIZ_MAX_PARALLEL_PARTS)
+
+    async def run(part):
+        async with limit:
+            return await quizGenerator.agenerate(topic, difficulty, part.count, model, quiz_plan.prompt_part(part))
+
+    while True:
+        parts = quiz_plan.next_parts()
+        if not parts:
+            break
+        results = await asyncio.gather(*(run(part) for part in parts), return_exceptions=True)
+        for part, result in zip(parts, results):
+            if isinstance(result, Exception):
+                quiz_plan.failed(part, result)
+            else:
+                quiz_plan.add(result)
+    return quiz_plan.quiz()
+
+
+async def astream(quiz_plan, topic, difficulty, model=DEFAULT_MODEL):
+    """
+    Stream all parts of `quiz_plan` at once and yield each new question as
+    soon as any part has written it. Afterwards quiz_plan.quiz() is the
+    merged quiz.
+    """
+    limit = asyncio.Semaphore(settings.QUIZ_MAX_PARALLEL_PARTS)
+
+    async def run(part, queue):
+        parser = QuestionStreamParser()
+        try:
+            async with limit:
+                async for text in quizGenerator.astream(topic, difficulty, part.count, model,
+                                                        quiz_plan.prompt_part(part)):
+                    for question in parser.feed(text):
+                        await queue.put((part, 'question', question))
+                quiz = parser.finish()
+        except Exception as error:
+            await queue.put((part, 'error', error))
+        else:
+            await queue.put((part, 'done', (quiz, len(parser.questions))))
+
+    while True:
+        parts = quiz_plan.next_parts()
+        if not parts:
+            break
+        queue = asyncio.Queue()
+        tasks = [asyncio.ensure_future(run(part, queue)) for part in parts]
+        running = len(tasks)
+        try:
+            while running:
+                part, kind, value = await queue.get()
+                if kind == 'question':
+                    if quiz_plan.add_question(value):
+                        yield value
+                elif kind == 'done':
+                    running -= 1
+                    # Questions the incremental parser missed, and the title
+                    for question in quiz_plan.add(*value):
+                        yield question
+                else:
+                    running -= 1
+                    quiz_plan.failed(part, value)
+        finally:
+            for task in tasks:
+                task.cancel()
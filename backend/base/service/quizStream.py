@@ -0,0 +1,121 @@
+"""
+Incremental parsing of a quiz while the model is still writing it.
+
+The reply to the quiz prompt is one JSON object (possibly inside a code
+block) whose "questions" array holds one object per question. The parser
+scans the text as it arrives, tracking strings and nesting, and decodes
+each question object as soon as its closing brace is seen, so a question
+is available long before the whole reply is.
+"""
+import json
+
+from ..logs import get_logger
+from .quizGenerator import QuizParseError, parse_quiz
+
+log = get_logger('quiz')
+
+
+class QuestionStreamParser:
+    def __init__(self):
+        self.text = ''
+        self.title = None
+        self.questions = []
+        # True when finish() had to fall back to the streamed questions
+        self.truncated = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        # Last key seen in the top-level object, and whether its value is next
+        self._key = None
+        self._after_colon = False
+        self._in_questions = False
+        self._question_start = None
+        self._done = False
+
+    def feed(self, text):
+        """
+        Add the next piece of the reply; return the questions it completed.
+        """
+        self.text += text
+        completed = []
+        buffer = self.text
+        i = self._pos
+        end = len(buffer)
+        while i < end and not self._done:
+            char = buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._top_level_string(buffer[self._string_start:i + 1])
+            elif self._depth == 0:
+                # Skip anything before the object, e.g. a ```json fence
+                if char == '{':
+                    self._depth = 1
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in '{[':
+                if self._depth == 1 and char == '[' and self._key == 'questions' and self._after_colon:
+                    self._in_questions = True
+                elif self._depth == 2 and char == '{' and self._in_questions:
+                    self._question_start = i
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 2 and char == '}' and self._question_start is not None:
+                    question = self._decode(buffer[self._question_start:i + 1])
+                    self._question_start = None
+                    if isinstance(question, dict):
+                        self.questions.append(question)
+                        completed.append(question)
+                elif self._depth == 1:
+                    self._in_questions = False
+                    self._after_colon = False
+                elif self._depth == 0:
+                    self._done = True
+            elif self._depth == 1:
+                if char == ':':
+                    self._after_colon = True
+                elif char == ',':
+                    self._after_colon = False
+            i += 1
+        self._pos = i
+        return completed
+
+    def _top_level_string(self, literal):
+        if not self._after_colon:
+            self._key = self._decode(literal)
+        else:
+            if self._key == 'title':
+                self.title = self._decode(literal)
+            self._after_colon = False
+
+    @staticmethod
+    def _decode(literal):
+        try:
+            return json.loads(literal)
+        except ValueError:
+            return None
+
+    def finish(self):
+        """
+        The complete quiz, parsed from the whole reply. If the reply is not
+        valid JSON (e.g. it was cut off) but some questions came through,
+        they are returned as the quiz and `truncated` is set. Raises
+        QuizParseError if there is nothing usable.
+        """
+        try:
+            return parse_quiz(self.text)
+        except QuizParseError:
+            if not self.questions:
+                raise
+        log.warning('quiz_stream_truncated', questions=len(self.questions), length=len(self.text))
+        self.truncated = True
+        return {'title': self.title or 'Quiz', 'questions': list(self.questions)}
@@ -0,0 +1,26 @@
+import hashlib
+
+from django.conf import settings
+
+
+def owner_for_room(code, workers=None):
+    """
+    Return the worker URL that owns a game room, or None when the app runs
+    as a single worker.
+
+    Uses rendezvous hashing: every worker scores (worker, code) and the
+    highest score wins, so adding or removing a worker only moves the rooms
+    that worker owned.
+    """
+    if workers is None:
+        workers = settings.ROOM_WORKERS
+    if not workers:
+        return None
+    return max(workers, key=lambda worker: hashlib.blake2b(
+        f'{worker}:{code}'.encode(), digest_size=8
+    ).digest())
+
+
+def is_local_room(code):
+    owner = owner_for_room(code)
+    return owner is None or owner == settings.ROOM_WORKER_URL
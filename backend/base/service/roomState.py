@@ -0,0 +1,1044 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .. import metrics
+from ..logs import get_logger
+from ..models import ChatMessage, GameRoom, Player
+from ..signals import game_completed
+from .quizCompiler import DEFAULT_TIME_PER_QUESTION, CompiledQuiz, compile_quiz, positive_seconds
+from .scoringEngine import ScoringEngine, option_index
+
+# Seconds to wait before writing dirty room state back to the database.
+# Mutations arriving inside this window are coalesced into a single flush.
+FLUSH_DELAY = 0.5
+
+# Number of state ops kept per room so clients that missed a few can catch
+# up without a full snapshot.
+OP_LOG_SIZE = 256
+
+log = get_logger('game')
+
+# Rooms nobody is connected to are dropped after this many idle seconds.
+ROOM_IDLE_TTL = 120
+
+# Chat messages kept in memory per room and sent to players as they join.
+CHAT_HISTORY = 50
+CHAT_MAX_LENGTH = 500
+
+PLAYER_FIELDS = [
+    'score', 'is_ready', 'current_answer', 'answer_time', 'best_streak',
+    'current_streak', 'total_questions', 'correct_answers', 'average_time',
+]
+
+AnswerResult = namedtuple('AnswerResult', ['player', 'accepted', 'is_correct', 'correct_answer'])
+
+
+def group_name(code):
+    return f'game_{code}'
+
+
+def chat_dict(sender, message, timestamp):
+    # Same shape as GET /api/chat/<pin>/, timestamps rendered the way DRF does
+    timestamp = timestamp.isoformat()
+    if timestamp.endswith('+00:00'):
+        timestamp = timestamp[:-6] + 'Z'
+    return {'sender': sender, 'message': message, 'timestamp': timestamp}
+
+
+class PlayerState:
+    """
+    In-memory copy of a Player row.
+    """
+    __slots__ = ['player_id', 'user_id', 'username'] + PLAYER_FIELDS
+
+    def __init__(self, player):
+        self.player_id = player.id
+        self.user_id = player.user_id
+        self.username = player.user.username
+        for field in PLAYER_FIELDS:
+            setattr(self, field, getattr(player, field))
+
+    @property
+    def has_answered(self):
+        return self.current_answer is not None
+
+    def update_stats(self, is_correct, answer_time):
+        """
+        Same bookkeeping as Player.update_stats, without the save.
+        """
+        self.total_questions += 1
+        if is_correct:
+            self.correct_answers += 1
+            self.current_streak += 1
+            self.best_streak = max(self.best_streak, self.current_streak)
+        else:
+            self.current_streak = 0
+        self.average_time = ((self.average_time * (self.total_questions - 1)) + answer_time) / self.total_questions
+
+    def row(self):
+        return [getattr(self, field) for field in PLAYER_FIELDS] + [self.player_id]
+
+    def as_dict(self):
+        return {
+            'username': self.username,
+            'score': self.score,
+            'is_ready': self.is_ready,
+            'has_answered': self.has_answered
+        }
+
+    def stats_dict(self, host):
+        return {
+            'username': self.username,
+            'score': self.score,
+            'is_ready': self.is_ready,
+            'has_answered': self.has_answered,
+            'is_host': self.username == host,
+            'correct_answers': self.correct_answers,
+            'current_streak': self.current_streak,
+            'best_streak': self.best_streak,
+            'average_time': round(self.average_time, 2),
+            'total_questions': self.total_questions,
+        }
+
+
+class RoomState:
+    """
+    Authoritative state of a live game room.
+
+    Loaded from the database once, mutated in memory and written back
+    lazily through flush(). All mutations happen under `lock` so the room
+    can be shared between the event loop and sync request threads.
+
+    Every mutation is also recorded as a small op tagged with a
+    monotonically increasing `seq`, so clients can apply deltas instead
+    of receiving the whole state on every change. `version` combines it
+    with an id of this load, so it never repeats across reloads.
+    """
+
+    def __init__(self, game, players):
+        self.lock = threading.RLock()
+        self.game_id = game.id
+        self.code = game.code
+        self.host = game.host.username
+        self.status = game.status
+        self.current_question = game.current_question
+        self.quiz_data = game.quiz_data or {}
+        self.quiz = self._compiled(game)
+        self.scoring = ScoringEngine.for_quiz(self.quiz_data)
+        self.created_at = game.created_at
+        self.started_at = game.started_at
+        self.ended_at = game.ended_at
+        self.players = {}
+        for player in players:
+            self.players[player.user.username] = PlayerState(player)
+
+        # Option counts of the current question, kept up to date as answers
+        # arrive; closed questions are kept in answer_histograms
+        self.answer_histograms = dict(game.answer_histograms or {})
+        self._reset_histogram()
+
+        # Answering window of the current question. The deadline is wall
+        # clock time for clients; the open time is monotonic and is what
+        # answer times are measured against.
+        self.answering_open = False
+        self.question_deadline = None
+        self._question_opened_at = None
+        if self.status == 'in_progress':
+            self._open_question()
+
+        # Set while questions are still being generated into the room
+        # (streamed quiz generation); see add_questions()
+        self.generating = False
+        self._awaiting_questions = False
+
+        self.connections = 0
+        self._game_dirty = False
+        self._quiz_dirty = False
+        self._dirty_players = set()
+        # Set when the game completes here; game_completed is sent once the
+        # flush has stored it
+        self._completed = False
+
+        self.seq = 0
+        self._op_log = deque(maxlen=OP_LOG_SIZE)
+        self._outbox = []
+
+        # Ring buffer of recent chat, filled by load_chat() on first use, and
+        # the messages not written to the database yet as
+        # (user_id, message, timestamp). Chat stays out of the op log so it
+        # doesn't bump the version polled by status clients.
+        self.chat = None
+        self._chat_outbox = []
+        self._chat_time = None
+        # Held for a whole flush, so batches commit in the order they were
+        # taken. Otherwise a later chat batch could commit first and an
+        # ?after= poll would page past the earlier one before it lands.
+        self._flush_lock = threading.Lock()
+
+        self.load_id = uuid.uuid4().hex[:8]
+        self.last_access = time.monotonic()
+        self._status_cache = None
+        # Long-poll/SSE requests parked until the next change, as
+        # (loop, future) pairs
+        self._waiters = []
+
+    @classmethod
+    def load(cls, code):
+        try:
+            game = GameRoom.objects.select_related('host').get(code=code)
+        except GameRoom.DoesNotExist:
+            return None
+        players = Player.objects.filter(game=game).select_related('user')
+        return cls(game, players)
+
+    @staticmethod
+    def _compiled(game):
+        if game.compiled_quiz:
+            return CompiledQuiz.from_dict(game.compiled_quiz)
+        # Rooms created before quizzes were compiled at creation time
+        return CompiledQuiz.from_quiz(game.quiz_data)
+
+    @property
+    def questions(self):
+        return self.quiz_data.get('questions', [])
+
+    @property
+    def time_per_question(self):
+        if self.current_question < len(self.quiz):
+            return self.quiz.time_limits[self.current_question]
+        return positive_seconds(self.quiz_data.get('timePerQuestion')) or DEFAULT_TIME_PER_QUESTION
+
+    @property
+    def all_answered(self):
+        return bool(self.players) and all(p.has_answered for p in self.players.values())
+
+    @property
+    def is_dirty(self):
+        return self._game_dirty or bool(self._dirty_players) or bool(self._chat_outbox)
+
+    @property
+    def version(self):
+        return f'{self.load_id}-{self.seq}'
+
+    @property
+    def etag(self):
+        return f'"{self.code}-{self.version}"'
+
+    @property
+    def watchers(self):
+        return len(self._waiters)
+
+    def get_player(self, username=None, user_id=None):
+        if username is not None:
+            return self.players.get(username)
+        if user_id is not None:
+            user_id = int(user_id)
+            for player in self.players.values():
+                if player.user_id == user_id:
+                    return player
+        return None
+
+    def add_player(self, player):
+        with self.lock:
+            state = PlayerState(player)
+            self.players[state.username] = state
+            self._emit('player_joined', player=state.as_dict())
+            return state
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'seq': self.seq,
+                'code': self.code,
+                'status': self.status,
+                'host': self.host,
+                'current_question': self.current_question,
+                'answering_open': self.answering_open,
+                'question_deadline': self.question_deadline,
+                'players': [p.as_dict() for p in self.players.values()],
+                'quiz_data': self.quiz_data,
+                'generating': self.generating,
+                'chat': list(self.chat or ())
+            }
+
+    def status_payload(self):
+        """
+        Body of GET /api/game/<code>/status/.
+        """
+        with self.lock:
+            current_question_data = None
+            if self.status == 'in_progress' and self.current_question < len(self.questions):
+                q = self.questions[self.current_question]
+                current_question_data = {
+                    'question': q.get('question'),
+                    'options': q.get('options')
+                }
+            return {
+                'success': True,
+                'version': self.version,
+                'game': {
+                    'code': self.code,
+                    'status': self.status,
+                    'host': self.host,
+                    'current_question': self.current_question,
+                    'current_question_data': current_question_data,
+                    'generating': self.generating,
+                    'players': [p.stats_dict(self.host) for p in self.players.values()],
+                    'created_at': self.created_at,
+                    'started_at': self.started_at,
+                    'ended_at': self.ended_at
+                }
+            }
+
+    def rendered_status(self):
+        """
+        Return (etag, json_bytes) for the status endpoint. The body is
+        rendered once per version and reused until the room changes.
+        """
+        with self.lock:
+            cached = self._status_cache
+            if cached is None or cached[0] != self.version:
+                cached = (self.version, self.etag, JSONRenderer().render(self.status_payload()))
+                self._status_cache = cached
+            return cached[1], cached[2]
+
+    async def wait_for_change(self, etag, timeout):
+        """
+        Park until the room's ETag differs from `etag`, or `timeout` seconds
+        pass. Returns True if it changed.
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.etag != etag:
+                return True
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        timer = loop.call_later(timeout, _expire, waiter[1])
+        try:
+            return await waiter[1]
+        finally:
+            timer.cancel()
+            with self.lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _wake_waiters(self):
+        # Mutations can happen on any thread; hand the wake-up to each
+        # waiter's own loop
+        by_loop = {}
+        for loop, future in self._waiters:
+            by_loop.setdefault(loop, []).append(future)
+        self._waiters = []
+        for loop, futures in by_loop.items():
+            loop.call_soon_threadsafe(_resolve, futures)
+
+    # Chat
+
+    def load_chat(self):
+        """
+        Fill the chat ring buffer with the room's last CHAT_HISTORY messages.
+        Only queries the database the first time.
+        """
+        if self.chat is not None:
+            return
+        recent = list(
+            ChatMessage.objects.filter(game_room_id=self.game_id)
+            .select_related('sender')
+            .order_by('-timestamp', '-id')[:CHAT_HISTORY]
+        )
+        with self.lock:
+            if self.chat is None:
+                self.chat = deque(
+                    (chat_dict(m.sender.username, m.message, m.timestamp) for m in reversed(recent)),
+                    maxlen=CHAT_HISTORY
+                )
+
+    def add_chat(self, user_id, username, text):
+        """
+        Record a chat message and return it as sent to clients, or None if
+        it is empty. Messages are written to the database by the next flush.
+        """
+        text = (text or '').strip()[:CHAT_MAX_LENGTH]
+        if not text:
+            return None
+        with self.lock:
+            if self.chat is None:
+                self.chat = deque(maxlen=CHAT_HISTORY)
+            # Never behind the previous message, even if the clock steps
+            # back, so history pages in the order messages were sent
+            timestamp = timezone.now()
+            if self._chat_time is not None and timestamp < self._chat_time:
+                timestamp = self._chat_time
+            self._chat_time = timestamp
+            message = chat_dict(username, text, timestamp)
+            self.chat.append(message)
+            self._chat_outbox.append((user_id, text, timestamp))
+            return message
+
+    # State ops
+
+    def _emit(self, op, **data):
+        self.seq += 1
+        data['op'] = op
+        data['seq'] = self.seq
+        self._op_log.append(data)
+        self._outbox.append(data)
+        if self._waiters:
+            self._wake_waiters()
+
+    def drain_ops(self):
+        """
+        Return the ops recorded since the last drain, for broadcasting.
+        """
+        with self.lock:
+            ops, self._outbox = self._outbox, []
+            return ops
+
+    def ops_since(self, seq):
+        """
+        Return the ops after `seq`, or None if they are no longer in the log
+        and the client needs a full snapshot instead.
+        """
+        with self.lock:
+            if seq > self.seq:
+                # Client is ahead of us, e.g. the room was reloaded
+                return None
+            if seq == self.seq:
+                return []
+            if not self._op_log or self._op_log[0]['seq'] > seq + 1:
+                return None
+            return [op for op in self._op_log if op['seq'] > seq]
+
+    # Mutations
+
+    def set_ready(self, player, is_ready):
+        with self.lock:
+            player.is_ready = is_ready
+            self._dirty_players.add(player.username)
+            self._emit('player_ready', username=player.username, is_ready=is_ready)
+            return player
+
+    def start(self):
+        with self.lock:
+            if self.status != 'waiting' or not len(self.quiz):
+                return False
+            self.status = 'in_progress'
+            self.started_at = timezone.now()
+            self.current_question = 0
+            self._game_dirty = True
+            self._open_question()
+            self._emit('game_started', status=self.status, current_question=self.current_question,
+                       question_deadline=self.question_deadline)
+            return True
+
+    def next_question(self, expected=None):
+        """
+        Move on to the next question. With expected, only if the room is
+        still at that question: the host's /next/ and the reveal timer may
+        both try to leave the same question, and only one of them may.
+        """
+        with self.lock:
+            if self.status != 'in_progress':
+                return False
+            if expected is not None and expected != self.current_question:
+                return False
+            if self.generating and self.current_question + 1 >= len(self.quiz):
+                # The next question is still being written; add_questions()
+                # moves on once it arrives
+                self._awaiting_questions = True
+                return False
+
+            # The host moved on before the deadline: keep this question's counts
+            self.close_question()
+
+            # Reset all player answers for the next question
+            for player in self.players.values():
+                if player.current_answer is not None or player.answer_time is not None:
+                    player.current_answer = None
+                    player.answer_time = None
+                    self._dirty_players.add(player.username)
+
+            self.current_question += 1
+            self._reset_histogram()
+            if self.current_question >= len(self.quiz):
+                self.status = 'completed'
+                self.ended_at = timezone.now()
+                self._completed = True
+                self.answering_open = False
+                self.question_deadline = None
+            else:
+                self._open_question()
+            self._game_dirty = True
+            self._emit('question_advanced', status=self.status, current_question=self.current_question,
+                       question_deadline=self.question_deadline)
+            return True
+
+    def add_questions(self, questions):
+        """
+        Append questions to a room whose quiz is still being generated.
+        Returns True if the room was held at its last question and moved on.
+        """
+        questions = [dict(q) for q in questions]
+        with self.lock:
+            self._set_quiz(dict(self.quiz_data, questions=self.questions + questions))
+            self._emit('questions_added', questions=questions, total=len(self.questions))
+            return self._resume()
+
+    def finish_generation(self, quiz=None):
+        """
+        Mark generation as over. `quiz` is the complete quiz: its title and
+        other fields replace the placeholders, and any questions the room
+        doesn't have yet are added. A room held at its last question moves
+        on, which completes the game if no questions were added. Returns
+        True if the room moved on.
+        """
+        with self.lock:
+            self.generating = False
+            if quiz is not None:
+                extra = [dict(q) for q in quiz.get('questions', [])[len(self.questions):]]
+                self._set_quiz(dict(self.quiz_data, **{k: v for k, v in quiz.items() if k != 'questions'},
+                                    questions=self.questions + extra))
+            self._emit('generation_finished', title=self.quiz_data.get('title'), total=len(self.questions))
+            return self._resume()
+
+    def _set_quiz(self, quiz_data):
+        self.quiz_data = quiz_data
+        self.quiz = compile_quiz(quiz_data)
+        self.scoring = ScoringEngine.for_quiz(quiz_data)
+        self._quiz_dirty = True
+        self._game_dirty = True
+
+    def _resume(self):
+        if not self._awaiting_questions:
+            return False
+        self._awaiting_questions = False
+        return self.next_question()
+
+    def _reset_histogram(self):
+        index = self.current_question
+        size = self.quiz.option_counts[index] if index < len(self.quiz) else 0
+        self.histogram = [0] * size
+        self.answered_count = 0
+        for player in self.players.values():
+            if player.current_answer is not None:
+                self._count_answer(player.current_answer)
+
+    def _count_answer(self, answer):
+        self.answered_count += 1
+        index = option_index(answer)
+        if 0 <= index < len(self.histogram):
+            self.histogram[index] += 1
+
+    def distribution(self):
+        """
+        Answer distribution of the current question, read from the live
+        counters. The correct answer is included once everyone has answered
+        or answering has closed. None if there is no current question.
+        """
+        with self.lock:
+            index = self.current_question
+            if index >= len(self.questions):
+                return None
+            options = self.questions[index].get('options', [])
+            all_answered = self.answered_count >= len(self.players)
+            correct = self.quiz.answer_key[index] if index < len(self.quiz) else None
+            correct_answer = None
+            if (all_answered or not self.answering_open) and isinstance(correct, int) and 0 <= correct < len(options):
+                correct_answer = options[correct]
+            return {
+                'distribution': [
+                    {'answer': option, 'count': self.histogram[i] if i < len(self.histogram) else 0}
+                    for i, option in enumerate(options)
+                ],
+                'correct_answer': correct_answer,
+                'all_answered': all_answered
+            }
+
+    def _open_question(self):
+        self.answering_open = True
+        self._question_opened_at = time.monotonic()
+        self.question_deadline = time.time() + self.time_per_question
+
+    def close_question(self):
+        """
+        Stop accepting answers for the current question.
+        """
+        with self.lock:
+            if not self.answering_open:
+                return False
+            self.answering_open = False
+            correct_answer = None
+            if self.current_question < len(self.quiz):
+                correct_answer = self.quiz.answer_key[self.current_question]
+            # Persisted with the next flush
+            self.answer_histograms[str(self.current_question)] = {
+                'counts': list(self.histogram),
+                'answered': self.answered_count,
+            }
+            self._game_dirty = True
+            self._emit('question_closed', current_question=self.current_question,
+                       correct_answer=correct_answer, counts=list(self.histogram))
+            return True
+
+    def submit_answer(self, username, answer, answer_time=None):
+        return self.submit_answers([(username, answer, answer_time)])[0]
+
+    def submit_answers(self, answers):
+        """
+        Record a batch of (username, answer, answer_time) answers to the
+        current question, score them in one ScoringEngine call and update
+        the players' stats. Returns an AnswerResult per answer.
+
+        Answers from players not in the room, after answering closed or
+        from players who already answered are not accepted. When an
+        answer_time is None it is measured on the server from the moment
+        the question opened; client supplied times are clamped to the
+        question's time limit.
+        """
+        with self.lock:
+            results = [None] * len(answers)
+            accepted = []
+            seen = set()
+            max_time = self.time_per_question
+            now = time.monotonic()
+            for i, (username, answer, answer_time) in enumerate(answers):
+                player = self.players.get(username)
+                if (player is None or not self.answering_open or player.current_answer is not None
+                        or username in seen):
+                    results[i] = AnswerResult(player, False, False, None)
+                    continue
+                seen.add(username)
+                if answer_time is None:
+                    answer_time = now - self._question_opened_at
+                answer_time = round(min(max(float(answer_time), 0.0), max_time), 3)
+                accepted.append((i, player, answer, answer_time))
+
+            if not accepted:
+                return results
+
+            # O(1) lookups into the quiz compiled at creation time
+            index = self.current_question
+            if index < len(self.quiz):
+                correct_answer = self.quiz.answer_key[index]
+                credit_table = self.quiz.credit_tables[index]
+            else:
+                correct_answer = None
+                credit_table = self.scoring.NO_CREDIT
+            is_correct, points, streaks = self.scoring.score(
+                credit_table,
+                [option_index(answer) for _, _, answer, _ in accepted],
+                [answer_time for _, _, _, answer_time in accepted],
+                [player.current_streak for _, player, _, _ in accepted],
+                max_time,
+            )
+
+            for (i, player, answer, answer_time), correct, earned in zip(accepted, is_correct.tolist(), points.tolist()):
+                player.current_answer = answer
+                player.answer_time = answer_time
+                player.score = (player.score or 0) + earned
+                player.update_stats(correct, answer_time)
+                self._count_answer(answer)
+
+                self._dirty_players.add(player.username)
+                self._emit('player_answered', username=player.username, answer=answer, is_correct=correct)
+                if earned:
+                    self._emit('score_changed', username=player.username, score=player.score)
+                results[i] = AnswerResult(player, True, correct, correct_answer)
+            # One distribution update per batch rather than per answer
+            self._emit('answer_distribution', current_question=index, counts=list(self.histogram),
+                       answered=self.answered_count, players=len(self.players))
+            return results
+
+    # Persistence
+
+    def flush(self):
+        """
+        Write dirty game and player fields back to the database. If the
+        write fails, what it held is marked dirty again for the next flush
+        and the error is raised.
+        """
+        with self._flush_lock:
+            with self.lock:
+                game_fields = None
+                game_dirty, quiz_dirty = self._game_dirty, self._quiz_dirty
+                dirty_players = set(self._dirty_players)
+                if self._game_dirty:
+                    game_fields = {
+                        'status': self.status,
+                        'current_question': self.current_question,
+                        'started_at': self.started_at,
+                        'ended_at': self.ended_at,
+                        'answer_histograms': dict(self.answer_histograms),
+                    }
+                    if self._quiz_dirty:
+                        game_fields['quiz_data'] = self.quiz_data
+                        game_fields['compiled_quiz'] = self.quiz.to_dict()
+                players = [self.players[name].row() for name in self._dirty_players if name in self.players]
+                chat, self._chat_outbox = self._chat_outbox, []
+                completed, self._completed = self._completed, False
+                self._game_dirty = False
+                self._quiz_dirty = False
+                self._dirty_players.clear()
+
+            if game_fields is None and not players and not chat:
+                return
+
+            try:
+                with transaction.atomic():
+                    if game_fields is not None:
+                        GameRoom.objects.filter(id=self.game_id).update(**game_fields)
+                    if players:
+                        write_players(players)
+                    if chat:
+                        ChatMessage.objects.bulk_create([
+                            ChatMessage(game_room_id=self.game_id, sender_id=user_id, message=text, timestamp=timestamp)
+                            for user_id, text, timestamp in chat
+                        ])
+            except Exception:
+                # Nothing was stored; the rows are re-read from the live state
+                # on the next flush, so only the flags and chat need restoring
+                with self.lock:
+                    self._game_dirty = self._game_dirty or game_dirty
+                    self._quiz_dirty = self._quiz_dirty or quiz_dirty
+                    self._dirty_players |= dirty_players
+                    self._chat_outbox[:0] = chat
+                    self._completed = self._completed or completed
+                raise
+
+        if completed:
+            send_game_completed(self.game_id, self.code)
+
+
+def send_game_completed(game_id, code):
+    """
+    Send game_completed for a game already stored as completed. A failing
+    receiver is logged rather than raised: the game is over either way.
+    """
+    for receiver, result in game_completed.send_robust(sender=GameRoom, game_id=game_id):
+        if isinstance(result, Exception):
+            log.error('game_completed_failed', game=code, receiver=getattr(receiver, '__name__', None),
+                      error=repr(result))
+
+
+def _resolve(futures):
+    for future in futures:
+        if not future.done():
+            future.set_result(True)
+
+
+def _expire(future):
+    if not future.done():
+        future.set_result(False)
+
+
+def write_players(rows):
+    """
+    Batch update of Player rows as one prepared statement run with
+    executemany(). Equivalent to bulk_update() on PLAYER_FIELDS, without
+    building a CASE expression per row and field.
+    """
+    qn = connection.ops.quote_name
+    columns = [Player._meta.get_field(field).column for field in PLAYER_FIELDS]
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (
+        qn(Player._meta.db_table),
+        ', '.join('%s = %%s' % qn(column) for column in columns),
+        qn(Player._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+class RoomRegistry:
+    """
+    Process-wide table of live rooms, keyed by game code.
+    """
+
+    def __init__(self):
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._pending_flushes = {}
+        self._last_sweep = time.monotonic()
+        # Event loop the live rooms are driven from, so sync code can hand
+        # work back to it
+        self._loop = None
+
+    def get(self, code):
+        """
+        Return the live room for `code`, loading it from the database on a miss.
+        """
+        now = time.monotonic()
+        if now - self._last_sweep > ROOM_IDLE_TTL:
+            self._last_sweep = now
+            self.sweep()
+        room = self._rooms.get(code)
+        if room is not None:
+            room.last_access = now
+            return room
+        room = RoomState.load(code)
+        if room is None:
+            return None
+        with self._lock:
+            return self._rooms.setdefault(code, room)
+
+    def peek(self, code):
+        return self._rooms.get(code)
+
+    def live(self):
+        return list(self._rooms.values())
+
+    def evict_if_idle(self, code):
+        """
+        Drop a room nobody is connected to once its writes are stored.
+        """
+        from .questionTimer import scheduler
+        with self._lock:
+            room = self._rooms.get(code)
+            if (room is not None and room.connections <= 0 and not room.watchers and not room.is_dirty
+                    and not room.generating and not scheduler.pending(room)):
+                del self._rooms[code]
+
+    def sweep(self):
+        """
+        Drop rooms that were only loaded for REST requests and have not been
+        used for ROOM_IDLE_TTL seconds.
+        """
+        from .questionTimer import scheduler
+        cutoff = time.monotonic() - ROOM_IDLE_TTL
+        with self._lock:
+            for code, room in list(self._rooms.items()):
+                if (room.connections <= 0 and not room.watchers and not room.is_dirty
+                        and not room.generating and not scheduler.pending(room) and room.last_access < cutoff):
+                    del self._rooms[code]
+
+    async def acquire(self, code):
+        """
+        Attach a connection to the room, loading it on first connect.
+        """
+        self._loop = asyncio.get_running_loop()
+        room = self._rooms.get(code)
+        if room is None:
+            room = await database_sync_to_async(self.get)(code)
+        if room is not None:
+            if room.chat is None:
+                await database_sync_to_async(room.load_chat)()
+            room.connections += 1
+            if room.connections == 1 and room.answering_open:
+                from .questionTimer import scheduler
+                scheduler.question_opened(room)
+        return room
+
+    async def release(self, code):
+        """
+        Detach a connection. The last one out flushes and evicts the room.
+        """
+        room = self._rooms.get(code)
+        if room is None:
+            return
+        room.connections -= 1
+        if room.connections > 0:
+            return
+        from .questionTimer import scheduler
+        scheduler.cancel(room)
+        handle = self._pending_flushes.pop(code, None)
+        if handle is not None:
+            handle.cancel()
+        try:
+            await database_sync_to_async(room.flush)()
+        except Exception:
+            # Kept loaded while dirty; the retry stores it
+            log.exception('room_flush_failed', game=code)
+            self.schedule_flush(room)
+            return
+        with self._lock:
+            if (room.connections <= 0 and not room.watchers and not room.generating
+                    and self._rooms.get(code) is room):
+                del self._rooms[code]
+
+    async def wait(self, code, etag, timeout):
+        """
+        Park until room `code` moves past `etag` or `timeout` elapses, for
+        long-poll and SSE clients. Returns the room, or None if there is no
+        such game.
+        """
+        self._loop = asyncio.get_running_loop()
+        room = self._rooms.get(code)
+        if room is None:
+            room = await database_sync_to_async(self.get)(code)
+            if room is None:
+                return None
+        await room.wait_for_change(etag, timeout)
+        room.last_access = time.monotonic()
+        return room
+
+    async def broadcast(self, room):
+        """
+        Send the ops recorded since the last broadcast to everyone in the
+        room. The frame is serialized once here rather than once per socket.
+        """
+        ops = room.drain_ops()
+        if ops:
+            log.debug('ops_broadcast', game=room.code, ops=len(ops), seq=room.seq)
+            with metrics.group_send_latency.time():
+                await get_channel_layer().group_send(
+                    group_name(room.code),
+                    {
+                        'type': 'state_delta',
+                        'text': json.dumps({
+                            'type': 'state_delta',
+                            'ops': ops
+                        })
+                    }
+                )
+
+    async def send_chat(self, room, message):
+        """
+        Send a chat message to everyone in the room right away; it reaches
+        the database with the room's next write-behind flush.
+        """
+        self.schedule_flush(room)
+        with metrics.group_send_latency.time():
+            await get_channel_layer().group_send(
+                group_name(room.code),
+                {
+                    'type': 'chat_message',
+                    'text': json.dumps({
+                        'type': 'chat_message',
+                        'message': message
+                    })
+                }
+            )
+
+    async def questions_generated(self, room, questions):
+        """
+        Add streamed questions to a live room and send them to its players.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._generation_progress(room, room.add_questions(questions))
+        await self.broadcast(room)
+
+    async def question_opened(self, room):
+        """
+        Arm the answering deadline of a question opened from sync code (the
+        REST start and next endpoints), so rooms nobody drives over the
+        game socket are paced by the server too. Under ASGI, async_to_sync
+        runs this on the server's loop.
+        """
+        from .questionTimer import scheduler
+        scheduler.question_opened(room)
+
+    async def question_advanced(self, room):
+        """
+        Arm the deadline of a question the REST next endpoint moved to and
+        send the ops to the room's sockets, on the server's loop as above.
+        """
+        await self.question_opened(room)
+        await self.broadcast(room)
+
+    async def generation_finished(self, room, quiz=None):
+        self._loop = asyncio.get_running_loop()
+        self._generation_progress(room, room.finish_generation(quiz))
+        await self.broadcast(room)
+
+    def _generation_progress(self, room, advanced):
+        self.schedule_flush(room)
+        if advanced:
+            from .questionTimer import scheduler
+            scheduler.question_opened(room)
+
+    def chat_posted(self, room, message):
+        """
+        Hand a chat message added from sync code (the REST endpoint) to the
+        event loop driving the room, or store it now if nobody is connected.
+        """
+        if self._loop is not None and room.connections > 0:
+            self._loop.call_soon_threadsafe(self._loop.create_task, self.send_chat(room, message))
+        else:
+            room.flush()
+
+    def schedule_flush(self, room):
+        """
+        Write-behind: flush the room shortly, coalescing repeated calls.
+        """
+        if room.code in self._pending_flushes:
+            return
+        loop = asyncio.get_running_loop()
+        self._pending_flushes[room.code] = loop.call_later(
+            FLUSH_DELAY, lambda: loop.create_task(self._flush(room))
+        )
+
+    async def _flush(self, room):
+        self._pending_flushes.pop(room.code, None)
+        try:
+            await database_sync_to_async(room.flush)()
+        except Exception:
+            log.exception('room_flush_failed', game=room.code)
+            # The room kept its dirty state; try again
+            self.schedule_flush(room)
+
+    def flush(self, code):
+        """
+        Write a live room back to the database right away. Called before code
+        that reads the room's rows directly, e.g. a REST endpoint.
+        """
+        room = self._rooms.get(code)
+        if room is not None:
+            room.flush()
+
+    def refresh(self, code):
+        """
+        Re-read a live room after it was changed outside of the room state,
+        e.g. by a REST endpoint. Rooms not loaded in this process are ignored.
+        """
+        room = self._rooms.get(code)
+        if room is None:
+            return
+        fresh = RoomState.load(code)
+        if fresh is None:
+            with self._lock:
+                self._rooms.pop(code, None)
+            return
+        with room.lock:
+            previous = (room.status, room.current_question)
+            room.status = fresh.status
+            room.current_question = fresh.current_question
+            if not room.generating:
+                # A generating room's quiz is ahead of the database
+                room.quiz_data = fresh.quiz_data
+                room.quiz = fresh.quiz
+                room.scoring = fresh.scoring
+            room.started_at = fresh.started_at
+            room.ended_at = fresh.ended_at
+            room.players = fresh.players
+            room.answer_histograms = fresh.answer_histograms
+            room.histogram = fresh.histogram
+            room.answered_count = fresh.answered_count
+            question_changed = (room.status, room.current_question) != previous
+            if question_changed:
+                room.answering_open = False
+                room.question_deadline = None
+                if room.status == 'in_progress':
+                    room._open_question()
+            # The change happened outside the op stream; tell clients to resync
+            room._emit('state_reset')
+
+        # Hand the room back to the event loop driving it
+        if self._loop is not None:
+            from .questionTimer import scheduler
+            if question_changed:
+                self._loop.call_soon_threadsafe(scheduler.question_opened, room)
+            else:
+                self._loop.call_soon_threadsafe(scheduler.answer_recorded, room)
+            self._loop.call_soon_threadsafe(self._loop.create_task, self.broadcast(room))
+
+
+rooms = RoomRegistry()
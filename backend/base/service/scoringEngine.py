@@ -0,0 +1,114 @@
+"""
+Scoring for quiz answers.
+
+Every answer in the game is scored here. The engine works on NumPy arrays
+so a whole batch of answers (or a whole question's worth) is scored in one
+call; scoring a single answer is just a batch of one, which keeps results
+identical whichever path an answer took.
+"""
+import numpy as np
+
+BASE_POINTS = 1000
+
+
+class ScoringStrategy:
+    """
+    Turns per-answer credit, answer time and streak into points.
+
+    `credit` is the fraction of the question earned (1.0 for the correct
+    option, 0.0 for a wrong one, anything in between for partial credit),
+    `answer_times` are seconds, `streaks` the player's streak including
+    this answer. All three are arrays of the same length.
+    """
+    name = None
+
+    def points(self, credit, answer_times, time_limit, streaks):
+        raise NotImplementedError
+
+
+class TimeDecayScoring(ScoringStrategy):
+    """
+    Faster answers earn more: full points for an instant answer, decaying
+    linearly to `floor` of the points at the time limit.
+    """
+    name = 'time_decay'
+
+    def __init__(self, base_points=BASE_POINTS, floor=0.1):
+        self.base_points = base_points
+        self.floor = floor
+
+    def time_factor(self, answer_times, time_limit):
+        return np.maximum(self.floor, 1.0 - (answer_times / time_limit) * (1.0 - self.floor))
+
+    def points(self, credit, answer_times, time_limit, streaks):
+        return self.base_points * credit * self.time_factor(answer_times, time_limit)
+
+
+class StreakScoring(TimeDecayScoring):
+    """
+    Time-decay points multiplied by a bonus that grows with the streak:
+    +`step` per consecutive correct answer after the first, up to `max_bonus`.
+    """
+    name = 'streak'
+
+    def __init__(self, base_points=BASE_POINTS, floor=0.1, step=0.1, max_bonus=0.5):
+        super().__init__(base_points, floor)
+        self.step = step
+        self.max_bonus = max_bonus
+
+    def points(self, credit, answer_times, time_limit, streaks):
+        bonus = np.minimum(np.maximum(streaks - 1, 0) * self.step, self.max_bonus)
+        return super().points(credit, answer_times, time_limit, streaks) * (1.0 + bonus)
+
+
+STRATEGIES = {
+    TimeDecayScoring.name: TimeDecayScoring,
+    StreakScoring.name: StreakScoring,
+}
+
+
+class ScoringEngine:
+    # Credit table for a question nobody can score on
+    NO_CREDIT = np.zeros(1)
+
+    def __init__(self, strategy=None):
+        self.strategy = strategy or TimeDecayScoring()
+
+    @classmethod
+    def for_quiz(cls, quiz_data):
+        """
+        Engine configured by the quiz's optional 'scoring' block, e.g.
+        {"strategy": "streak", "step": 0.2}. Defaults to time decay.
+        """
+        config = dict((quiz_data or {}).get('scoring') or {})
+        strategy_class = STRATEGIES.get(config.pop('strategy', None), TimeDecayScoring)
+        try:
+            return cls(strategy_class(**config))
+        except TypeError:
+            return cls(strategy_class())
+
+    def score(self, credit_table, answers, answer_times, streaks, time_limit):
+        """
+        Score a batch of answers to one question.
+
+        `credit_table` holds the credit of each option (see CompiledQuiz),
+        `answers` are option indexes (anything that isn't a valid index earns
+        nothing), `streaks` the players' streaks before answering. Returns
+        (is_correct, points, new_streaks) as arrays.
+        """
+        answers = np.asarray(answers, dtype=np.int64)
+        valid = (answers >= 0) & (answers < len(credit_table))
+        credit = np.where(valid, credit_table[np.where(valid, answers, 0)], 0.0)
+        is_correct = credit >= 1.0
+        new_streaks = np.where(is_correct, np.asarray(streaks, dtype=np.int64) + 1, 0)
+        points = self.strategy.points(credit, np.asarray(answer_times, dtype=float), float(time_limit), new_streaks)
+        return is_correct, points.astype(np.int64), new_streaks
+
+
+def option_index(answer):
+    """
+    Answers are option indexes; anything else can never be right.
+    """
+    if isinstance(answer, bool) or not isinstance(answer, int):
+        return -1
+    return answer
@@ -0,0 +1,67 @@
+"""
+Incremental maintenance of UserStats.
+
+When a game completes, its players' results are added to their UserStats
+rows with one grouped query over the game's Player rows and one UPDATE per
+player. GameRoom.stats_recorded makes this idempotent: a game is claimed
+in the same transaction that adds it, so repeated completions or a backfill
+running alongside never count it twice.
+"""
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Max, Sum, Value
+from django.db.models.functions import Greatest
+
+from ..logs import get_logger
+from ..models import GameRoom, Player, UserStats
+
+log = get_logger('stats')
+
+
+def record_games(game_ids):
+    """
+    Add the results of the given completed games to their players'
+    UserStats. Games already recorded or not completed are skipped.
+    Returns the number of games recorded.
+    """
+    with transaction.atomic():
+        ids = list(
+            GameRoom.objects.select_for_update()
+            .filter(id__in=game_ids, status='completed', stats_recorded=False)
+            .values_list('id', flat=True)
+        )
+        if not ids:
+            return 0
+        GameRoom.objects.filter(id__in=ids).update(stats_recorded=True)
+
+        totals = list(
+            Player.objects.filter(game_id__in=ids)
+            .values('user_id')
+            .annotate(
+                games=Count('id'),
+                score=Sum('score'),
+                correct=Sum('correct_answers'),
+                questions=Sum('total_questions'),
+                streak=Max('best_streak'),
+                answer_time=Sum(F('average_time') * F('total_questions'), output_field=FloatField()),
+            )
+        )
+        UserStats.objects.bulk_create([UserStats(user_id=row['user_id']) for row in totals],
+                                      ignore_conflicts=True)
+        for row in totals:
+            UserStats.objects.filter(user_id=row['user_id']).update(
+                games_played=F('games_played') + row['games'],
+                total_score=F('total_score') + (row['score'] or 0),
+                correct_answers=F('correct_answers') + (row['correct'] or 0),
+                total_questions=F('total_questions') + (row['questions'] or 0),
+                best_streak=Greatest('best_streak', Value(row['streak'] or 0)),
+                total_answer_time=F('total_answer_time') + (row['answer_time'] or 0.0),
+            )
+    log.info('user_stats_recorded', games=len(ids), players=len(totals))
+    return len(ids)
+
+
+def pending_games():
+    """
+    Completed games whose results are not in UserStats yet.
+    """
+    return GameRoom.objects.filter(status='completed', stats_recorded=False)
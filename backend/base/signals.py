@@ -2,9 +2,12 @@
 
 from django.contrib.auth.models import User  
 from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 from rest_framework.authtoken.models import Token
-from .models import UserProfile
+from .models import GameRoom, UserProfile
+
+# Sent with game_id once a game's move to 'completed' is stored
+game_completed = Signal()
 
 @receiver(post_save, sender=User)  
 def create_auth_token(sender, instance=None, created=False, **kwargs):
@@ -14,4 +17,14 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance=None, created=False, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
\ No newline at end of file
+        UserProfile.objects.create(user=instance)
+
+@receiver(game_completed, sender=GameRoom)
+def record_user_stats(sender, game_id, **kwargs):
+    from .service.userStats import record_games
+    record_games([game_id])
+
+@receiver(game_completed, sender=GameRoom)
+def update_leaderboards(sender, game_id, **kwargs):
+    from .service.leaderboard import leaderboards
+    leaderboards.game_completed()
@@ -1,3 +1,1487 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.auth import AuthMiddlewareStack
+from channels.routing import URLRouter
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import logs, metrics
+from .broker import Broker, ProtocolError
+from .consumers import quiz_options
+from .layers import PubSubChannelLayer
+from .logs import JsonFormatter, QueueLogHandler, RateLimitFilter, StructuredLogger
+from .models import (ChatMessage, GameRoom, GeneratedQuiz, Player, Question, QuestionBucket, Quiz, TopicDemand,
+                     UserStats)
+from .querybudget import QueryBudgetExceeded, QueryBudgetTestMixin, assert_max_queries
+from .routing import http_urlpatterns, websocket_urlpatterns
+from .service import questionBank, quizPlanner, roomState
+from .service.answerPipeline import answers
+from .service.chatHistory import InvalidCursor, chat_page, decode_cursor, encode_cursor, page_size
+from .service.fakeGroq import AsyncFakeGroq, FakeGroq
+from .service.leaderboard import Leaderboard, LeaderboardRegistry, SkipList, week_key
+from .service.nearDuplicates import (NUM_HASHES, NearDuplicateIndex, band_keys, duplicate_clusters, jaccard, shingles,
+                                     signature)
+from .service.pregeneration import (TYPICAL_COUNT_MAX, Pregenerator, decay, hot_topics, record_demand,
+                                    stock_target)
+from .service.questionBank import add_quiz, bank_fields
+from .service.questionSearch import match_query, rebuild_index, search, topic_facets
+from .service.questionTimer import scheduler
+from .service.quizCache import QuizCache
+from .service.quizCompiler import CompiledQuiz, compile_quiz, time_per_question
+from .service.quizGenerator import QuizParseError, completion_args, parse_quiz
+from .service.quizPlanner import QuizPlan
+from .service.quizStream import QuestionStreamParser
+from .service.roomAffinity import is_local_room
+from .service.roomState import rooms, send_game_completed
+from .service.scoringEngine import ScoringEngine, StreakScoring, TimeDecayScoring, option_index
+from .service.userStats import record_games
+from .signals import game_completed
+
+
+def make_quiz(count=3):
+    return {
+        'title': 'Test Quiz',
+        'questions': [
+            {'question': f'Question number {i} about {word}?', 'options': ['A', 'B', 'C', 'D'], 'correctAnswer': 'A'}
+            for i, word in enumerate(['rivers', 'mountains', 'deserts', 'oceans', 'forests', 'islands'][:count])
+        ],
+    }
+
+
+def make_game(host, players=(), status='waiting', quiz_data=None):
+    quiz_data = quiz_data or make_quiz()
+    game = GameRoom.objects.create(host=host, quiz_data=quiz_data, compiled_quiz=compile_quiz(quiz_data).to_dict(),
+                                   status=status)
+    Player.objects.create(user=host, game=game, is_ready=True)
+    for user in players:
+        Player.objects.create(user=user, game=game)
+    return game
+
+
+class LiveRoomsTestMixin:
+    """
+    Starts every test with no live rooms, as the registry outlives the
+    test's database transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        rooms._rooms.clear()
+        self.addCleanup(rooms._rooms.clear)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, LiveRoomsTestMixin, TestCase):
+    """
+    Each endpoint with a declared budget, with enough players and messages
+    that an N+1 would show.
+    """
+    PLAYERS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create(username='host')
+        cls.others = [User.objects.create(username=f'player{i}') for i in range(cls.PLAYERS)]
+        cls.game = make_game(cls.host, cls.others)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(game_room=cls.game, sender=user, message=f'hello {i}')
+            for i, user in enumerate(cls.others)
+        ])
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        # A real token, so authentication is counted as it is in production
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {Token.objects.get(user=self.host).key}')
+
+    def test_game_status(self):
+        response = self.client.get(f'/api/game/{self.game.code}/status/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['game']['players']), self.PLAYERS + 1)
+
+    def test_chat_history(self):
+        response = self.client.get(f'/api/chat/{self.game.code}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), self.PLAYERS)
+
+    def test_leaderboard(self):
+        response = self.client.get(f'/api/game/{self.game.code}/leaderboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['leaderboard']), self.PLAYERS + 1)
+
+    def test_answer_distribution(self):
+        self.game.status = 'in_progress'
+        self.game.save()
+        response = self.client.get(f'/api/answer_distribution/{self.game.code}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['distribution']), 4)
+
+    def test_search(self):
+        add_quiz(make_quiz(6), 'Geography', 'medium')
+        add_quiz(make_quiz(6), 'Travel', 'medium')
+        response = self.client.get('/api/questions/search/', {'q': 'question'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 12)
+        self.assertEqual({facet['topic'] for facet in response.json()['facets']['topics']}, {'geography', 'travel'})
+
+    def test_budget_violation_fails(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_max_queries(1):
+                list(User.objects.all())
+                list(GameRoom.objects.all())
+
+    def test_n_plus_one_fails(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_max_queries(100):
+                for player in Player.objects.filter(game=self.game):
+                    player.user.username
+
+
+class RoomFlushTests(LiveRoomsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host, status='in_progress', quiz_data=make_quiz(1))
+        self.room = rooms.get(self.game.code)
+        self.completed = []
+        receiver = lambda sender, game_id, **kwargs: self.completed.append(game_id)
+        game_completed.connect(receiver, sender=GameRoom, weak=False)
+        self.addCleanup(game_completed.disconnect, receiver, sender=GameRoom)
+
+    def test_failed_flush_keeps_writes(self):
+        self.assertTrue(self.room.submit_answer('host', 0).accepted)
+        self.room.add_chat(self.host.id, 'host', 'gg')
+        self.assertTrue(self.room.next_question())
+
+        with mock.patch.object(roomState, 'write_players', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.room.flush()
+        self.assertTrue(self.room.is_dirty)
+        self.assertEqual(self.completed, [])
+        self.assertEqual(GameRoom.objects.get(id=self.game.id).status, 'in_progress')
+
+        self.room.flush()
+        self.assertFalse(self.room.is_dirty)
+        self.assertEqual(GameRoom.objects.get(id=self.game.id).status, 'completed')
+        self.assertGreater(Player.objects.get(game=self.game, user=self.host).score, 0)
+        self.assertEqual(list(ChatMessage.objects.filter(game_room=self.game).values_list('message', flat=True)),
+                         ['gg'])
+        self.assertEqual(self.completed, [self.game.id])
+
+    def test_chat_order_survives_failed_flush(self):
+        self.room.add_chat(self.host.id, 'host', 'first')
+        with mock.patch.object(roomState, 'write_players', side_effect=OperationalError('database is locked')):
+            self.room.set_ready(self.room.get_player('host'), False)
+            with self.assertRaises(OperationalError):
+                self.room.flush()
+        self.room.add_chat(self.host.id, 'host', 'second')
+        self.room.flush()
+        self.assertEqual(list(ChatMessage.objects.filter(game_room=self.game).order_by('id')
+                              .values_list('message', flat=True)), ['first', 'second'])
+
+    def test_answers_accepted_when_flush_fails(self):
+        with mock.patch.object(roomState, 'write_players', side_effect=OperationalError('database is locked')):
+            result = async_to_sync(answers.submit)(self.room, 'host', 0)
+        self.assertTrue(result.accepted)
+        self.assertTrue(result.is_correct)
+        self.assertTrue(self.room.is_dirty)
+        # Resubmitting is refused as a duplicate, not lost
+        self.assertFalse(self.room.submit_answer('host', 0).accepted)
+        self.room.flush()
+        self.assertEqual(Player.objects.get(game=self.game, user=self.host).score, result.player.score)
+
+
+class JoinGameTests(LiveRoomsTestMixin, TestCase):
+    def test_join_keeps_unsaved_room_changes(self):
+        host = User.objects.create(username='host')
+        guest = User.objects.create(username='guest')
+        game = make_game(host, players=(guest,))
+        room = rooms.get(game.code)
+        room.set_ready(room.get_player('guest'), True)
+        self.assertTrue(room.is_dirty)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='late'))
+        response = client.post('/api/game/join/', {'game_code': game.code}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(room.get_player('guest').is_ready)
+        self.assertIsNotNone(room.get_player('late'))
+        self.assertTrue(Player.objects.get(game=game, user=guest).is_ready)
+
+
+@override_settings(QUIZ_MAX_QUESTIONS=20)
+class QuizCountLimitTests(TestCase):
+    def test_quiz_options(self):
+        self.assertIsNone(quiz_options({'topic': 'Space', 'count': 20})[1])
+        for count in (0, -1, 21, 100000):
+            options, error = quiz_options({'topic': 'Space', 'count': count})
+            self.assertIsNone(options)
+            self.assertEqual(error, 'Count must be between 1 and 20')
+
+    def test_generate_quiz_rejects_large_count(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='host'))
+        response = client.post('/api/generate-quiz/', {'topic': 'Space', 'count': 100000}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Count must be between 1 and 20')
+
+
+class TimePerQuestionTests(TestCase):
+    def test_valid(self):
+        self.assertEqual(time_per_question({}), (30, None))
+        self.assertEqual(time_per_question({'timePerQuestion': 20}), (20, None))
+        self.assertEqual(time_per_question({'timePerQuestion': '12.5'}), (12.5, None))
+
+    def test_invalid(self):
+        for value in (0, -5, 'soon', '', True, float('nan'), float('inf'), [10]):
+            seconds, error = time_per_question({'timePerQuestion': value})
+            self.assertIsNone(seconds, value)
+            self.assertEqual(error, 'timePerQuestion must be a positive number of seconds')
+
+
+class CreateGameTimeLimitTests(LiveRoomsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def create(self, quiz_data):
+        return self.client.post('/api/game/create/', {'quiz_data': quiz_data}, format='json')
+
+    def test_numeric_strings_are_converted(self):
+        quiz = make_quiz(2)
+        quiz['timePerQuestion'] = '20'
+        quiz['questions'][1]['timeLimit'] = '12.5'
+        response = self.create(quiz)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(GameRoom.objects.get(code=response.json()['game_code']).compiled_quiz['time_limits'],
+                         [20, 12.5])
+        response = self.client.post(f"/api/game/{response.json()['game_code']}/start/")
+        self.assertEqual(response.status_code, 200)
+        self.addCleanup(scheduler.cancel, rooms.peek(GameRoom.objects.get().code))
+
+    def test_bad_values_are_refused(self):
+        for field, value in (('timePerQuestion', 'soon'), ('timePerQuestion', 0), ('timeLimit', -3),
+                             ('timeLimit', True)):
+            quiz = make_quiz()
+            (quiz['questions'][0] if field == 'timeLimit' else quiz)[field] = value
+            response = self.create(quiz)
+            self.assertEqual(response.status_code, 400, (field, value))
+        self.assertFalse(GameRoom.objects.exists())
+
+    def test_stored_bad_limits_fall_back(self):
+        compiled = CompiledQuiz.from_dict({'answer_key': [0, 0], 'option_counts': [4, 4],
+                                           'time_limits': ['20', 'soon']})
+        self.assertEqual(compiled.time_limits, [20, 30])
+
+
+class GeneratingGameTests(LiveRoomsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host, status='in_progress', quiz_data=make_quiz(1))
+        self.room = rooms.get(self.game.code)
+        self.room.generating = True
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def test_next_question_refused_keeps_answers(self):
+        self.room.submit_answer('host', 0)
+        self.room.flush()
+        response = self.client.post(f'/api/game/{self.game.code}/next/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Player.objects.get(game=self.game, user=self.host).current_answer, 0)
+        self.assertEqual(GameRoom.objects.get(id=self.game.id).current_question, 0)
+
+
+class RestAnswerTimeTests(LiveRoomsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host)
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+
+    def start(self):
+        response = self.client.post(f'/api/game/{self.game.code}/start/')
+        self.assertEqual(response.status_code, 200)
+        room = rooms.peek(self.game.code)
+        self.addCleanup(scheduler.cancel, room)
+        return room
+
+    def test_start_and_next_arm_the_deadline(self):
+        room = self.start()
+        self.assertTrue(room.answering_open)
+        self.assertTrue(scheduler.pending(room))
+        scheduler.cancel(room)
+        response = self.client.post(f'/api/game/{self.game.code}/next/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(scheduler.pending(room))
+
+    def test_early_advance_keeps_histogram(self):
+        guest = User.objects.create(username='guest')
+        self.game = make_game(self.host, players=(guest,))
+        room = self.start()
+        self.client.post(f'/api/game/{self.game.code}/answer/', {'answer': 1}, format='json')
+        response = self.client.post(f'/api/game/{self.game.code}/next/')
+        self.assertEqual(response.status_code, 200)
+        rooms.flush(self.game.code)
+        self.assertEqual(GameRoom.objects.get(id=self.game.id).answer_histograms,
+                         {'0': {'counts': [0, 1, 0, 0], 'answered': 1}})
+        self.assertEqual(room.histogram, [0, 0, 0, 0])
+
+    def test_question_closes_once_everyone_answered(self):
+        room = self.start()
+        self.client.post(f'/api/game/{self.game.code}/answer/', {'answer': 0}, format='json')
+        self.assertFalse(room.answering_open)
+        self.assertEqual(room.answer_histograms, {'0': {'counts': [1, 0, 0, 0], 'answered': 1}})
+
+    def test_next_refuses_a_question_already_left(self):
+        room = self.start()
+        url = f'/api/game/{self.game.code}/next/'
+        response = self.client.post(url, {'current_question': 0}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['current_question'], 1)
+        response = self.client.post(url, {'current_question': 0}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(room.current_question, 1)
+        self.assertEqual(GameRoom.objects.get(id=self.game.id).current_question, 1)
+
+    def test_reveal_timer_does_not_skip_after_manual_next(self):
+        room = self.start()
+        self.client.post(f'/api/game/{self.game.code}/next/', {'current_question': 0}, format='json')
+        # The reveal pause armed for question 0 fires late
+        scheduler._advance(room, 0)
+        self.assertEqual(room.current_question, 1)
+
+    def test_failing_completion_receiver_is_logged(self):
+        def fail(sender, game_id, **kwargs):
+            raise RuntimeError('stats are down')
+        game_completed.connect(fail, sender=GameRoom, weak=False)
+        self.addCleanup(game_completed.disconnect, fail, sender=GameRoom)
+        self.game = make_game(self.host, quiz_data=make_quiz(1))
+        self.start()
+        with self.assertLogs('mindclash.game', 'ERROR') as logs:
+            response = self.client.post(f'/api/game/{self.game.code}/next/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['game_status'], 'completed')
+        self.assertIn('game_completed_failed', logs.output[0])
+
+    def test_answer_time_is_measured_by_the_server(self):
+        room = self.start()
+        room._question_opened_at -= 12
+        response = self.client.post(f'/api/game/{self.game.code}/answer/', {'answer': 0, 'answer_time': 0},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(room.get_player('host').answer_time, 12)
+        # Less than an instant answer's 1000 points
+        self.assertLess(response.json()['score'], 700)
+
+
+class OpLogTests(LiveRoomsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host, players=(User.objects.create(username='guest'),))
+        self.room = rooms.get(self.game.code)
+
+    def toggle(self, times):
+        player = self.room.get_player('guest')
+        for i in range(times):
+            self.room.set_ready(player, i % 2 == 0)
+
+    def test_ops_since(self):
+        seen = self.room.seq
+        self.toggle(3)
+        ops = self.room.ops_since(seen)
+        self.assertEqual([op['seq'] for op in ops], [seen + 1, seen + 2, seen + 3])
+        self.assertEqual([(op['op'], op['is_ready']) for op in ops],
+                         [('player_ready', True), ('player_ready', False), ('player_ready', True)])
+        self.assertEqual(self.room.ops_since(self.room.seq), [])
+        # A client ahead of the room, e.g. after a reload, needs a snapshot
+        self.assertIsNone(self.room.ops_since(self.room.seq + 1))
+
+    def test_gap_needs_snapshot(self):
+        seen = self.room.seq
+        self.toggle(roomState.OP_LOG_SIZE + 1)
+        self.assertIsNone(self.room.ops_since(seen))
+        self.assertEqual(len(self.room.ops_since(self.room.seq - 10)), 10)
+
+
+class GameStatusETagTests(LiveRoomsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host)
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+        self.url = f'/api/game/{self.game.code}/status/'
+
+    def test_not_modified(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+
+        # Served from the live room without touching the database
+        with assert_max_queries(0):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], etag)
+
+        room = rooms.peek(self.game.code)
+        room.set_ready(room.get_player('host'), False)
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertFalse(changed.json()['game']['players'][0]['is_ready'])
+
+    def test_unknown_game(self):
+        self.assertEqual(self.client.get('/api/game/NOPE00/status/').status_code, 404)
+
+
+class LongPollTests(LiveRoomsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.application = URLRouter(http_urlpatterns)
+        self.auth = (b'authorization', f'Token {Token.objects.get(user=self.host).key}'.encode())
+
+    def request(self, path, *headers):
+        return HttpCommunicator(self.application, 'GET', path, headers=[self.auth, *headers])
+
+    def test_poll_wakes_on_change(self):
+        game = make_game(self.host)
+        room = rooms.get(game.code)
+        etag, _ = room.rendered_status()
+
+        async def poll():
+            response = asyncio.ensure_future(
+                self.request(f'/api/game/{game.code}/poll/?timeout=5', (b'if-none-match', etag.encode()))
+                .get_response(timeout=5))
+            await asyncio.sleep(0.1)
+            self.assertFalse(response.done())
+            room.set_ready(room.get_player('host'), False)
+            return await response
+        response = async_to_sync(poll)()
+        self.assertEqual(response['status'], 200)
+        headers = dict(response['headers'])
+        self.assertNotEqual(headers[b'ETag'].decode(), etag)
+        self.assertFalse(json.loads(response['body'])['game']['players'][0]['is_ready'])
+
+    def test_poll_times_out_with_304(self):
+        game = make_game(self.host)
+        etag, _ = rooms.get(game.code).rendered_status()
+        response = async_to_sync(self.request(f'/api/game/{game.code}/poll/?timeout=0.1',
+                                              (b'if-none-match', etag.encode())).get_response)(timeout=5)
+        self.assertEqual(response['status'], 304)
+        self.assertEqual(dict(response['headers'])[b'ETag'].decode(), etag)
+
+    def test_events_stream_ends_with_the_game(self):
+        game = make_game(self.host, status='completed')
+        response = async_to_sync(self.request(f'/api/game/{game.code}/events/').get_response)(timeout=5)
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(response['body'].count(b'event: status'), 1)
+
+    def test_needs_token(self):
+        game = make_game(self.host)
+        communicator = HttpCommunicator(self.application, 'GET', f'/api/game/{game.code}/poll/')
+        self.assertEqual(async_to_sync(communicator.get_response)(timeout=5)['status'], 401)
+
+
+class SocketResyncTests(LiveRoomsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host)
+        self.application = AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    async def resync(self, changes):
+        communicator = WebsocketCommunicator(self.application, f'/ws/game/{self.game.code}/?username=host')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        state = await communicator.receive_json_from()
+        self.assertEqual(state['type'], 'game_state')
+        seen = state['game']['seq']
+        # Changes this client missed, without a broadcast
+        room = rooms.peek(self.game.code)
+        for i in range(changes):
+            room.set_ready(room.get_player('host'), i % 2 == 0)
+        room.drain_ops()
+        await communicator.send_json_to({'type': 'resync', 'since': seen})
+        reply = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return seen, reply
+
+    def test_missed_ops_are_replayed(self):
+        seen, reply = async_to_sync(self.resync)(2)
+        self.assertEqual(reply['type'], 'state_delta')
+        self.assertEqual([op['seq'] for op in reply['ops']], [seen + 1, seen + 2])
+
+    def test_gap_past_the_log_gets_a_snapshot(self):
+        seen, reply = async_to_sync(self.resync)(roomState.OP_LOG_SIZE + 1)
+        self.assertEqual(reply['type'], 'game_state')
+        self.assertEqual(reply['game']['seq'], seen + roomState.OP_LOG_SIZE + 1)
+
+
+class SocketChatTests(LiveRoomsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host)
+        self.application = AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    async def chat(self, query):
+        communicator = WebsocketCommunicator(self.application, f'/ws/game/{self.game.code}/?{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'game_state')
+        await communicator.send_json_to({'type': 'chat_message', 'message': 'hello'})
+        reply = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return reply
+
+    def test_username_alone_cannot_chat(self):
+        reply = async_to_sync(self.chat)('username=host')
+        self.assertEqual(reply['type'], 'error')
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_token_user_chats_under_own_name(self):
+        token = Token.objects.get(user=self.host).key
+        reply = async_to_sync(self.chat)(f'token={token}&username=someone')
+        self.assertEqual(reply['type'], 'chat_message')
+        self.assertEqual(reply['message']['sender'], 'host')
+        self.assertEqual(list(ChatMessage.objects.values_list('sender__username', 'message')), [('host', 'hello')])
+
+
+class RestChatTests(LiveRoomsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host)
+        self.client = APIClient()
+
+    def test_only_players_can_post(self):
+        self.client.force_authenticate(User.objects.create(username='outsider'))
+        response = self.client.post('/api/chat/send/', {'pin': self.game.code, 'message': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ChatMessage.objects.exists())
+
+        self.client.force_authenticate(self.host)
+        response = self.client.post('/api/chat/send/', {'pin': self.game.code, 'message': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(ChatMessage.objects.values_list('sender__username', 'message')), [('host', 'hi')])
+
+
+class PubSubChannelLayerTests(TestCase):
+    async def serve(self):
+        self.broker = Broker()
+        server = await asyncio.start_server(self.broker.handle, '127.0.0.1', 0)
+        self.url = 'redis://127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+        return server
+
+    async def stop(self, server):
+        server.close()
+        await server.wait_closed()
+        # Let the broker's handlers see their clients go before the loop ends
+        await asyncio.sleep(0.05)
+
+    def test_error_reply_raises(self):
+        async def run():
+            server = await self.serve()
+            layer = PubSubChannelLayer(self.url)
+            try:
+                with self.assertRaises(ProtocolError):
+                    await layer._command('BOGUS')
+                # The connection is still usable afterwards
+                self.assertEqual(await layer._command('ECHO', 'hi'), b'hi')
+            finally:
+                await layer.close()
+                await self.stop(server)
+        async_to_sync(run)()
+
+    def test_reconnect_delivers_once(self):
+        async def run():
+            server = await self.serve()
+            receiver, sender = PubSubChannelLayer(self.url), PubSubChannelLayer(self.url)
+            try:
+                channel = await receiver.new_channel()
+                await receiver.group_add('room', channel)
+                old_subscriber = receiver._subscriber
+                receiver._publisher[1].close()
+                await asyncio.sleep(0.05)
+                self.assertIsNone(receiver._subscriber)
+                self.assertTrue(old_subscriber[1].is_closing())
+
+                await receiver._ensure_connected()
+                await sender.group_send('room', {'type': 'chat'})
+                self.assertEqual(await asyncio.wait_for(receiver.receive(channel), 1), {'type': 'chat'})
+                await asyncio.sleep(0.05)
+                self.assertTrue(receiver.channels[channel].empty())
+            finally:
+                await receiver.close()
+                await sender.close()
+                await self.stop(server)
+        async_to_sync(run)()
+
+
+def question(text, answer):
+    return {'question': text, 'options': [answer, 'None of these'], 'correctAnswer': 'A'}
+
+
+class NearDuplicateTests(SimpleTestCase):
+    WAR = question('In which year did World War II end?', '1945')
+    WAR_REWORDED = question('In what year did World War II end?', '1945')
+    FRANCE = question('What is the capital of France?', 'Paris')
+    SPAIN = question('What is the capital of Spain?', 'Madrid')
+
+    def test_shingles(self):
+        self.assertEqual(shingles(self.FRANCE), {'what', 'is', 'the', 'capital', 'of', 'france', 'paris'})
+        self.assertEqual(shingles({'question': '  ', 'options': ['a', 'b']}), frozenset())
+        self.assertIsNone(signature(frozenset()))
+
+    def test_signature_estimates_jaccard(self):
+        for a, b in ((self.WAR, self.WAR_REWORDED), (self.FRANCE, self.SPAIN), (self.WAR, self.FRANCE)):
+            words_a, words_b = shingles(a), shingles(b)
+            estimate = (signature(words_a) == signature(words_b)).sum() / NUM_HASHES
+            self.assertAlmostEqual(estimate, jaccard(words_a, words_b), delta=0.15)
+        self.assertEqual(jaccard(shingles(self.WAR), shingles(self.WAR_REWORDED)), 0.8)
+
+    def test_index(self):
+        index = NearDuplicateIndex('history|medium')
+        for item, q in enumerate((self.WAR, self.FRANCE)):
+            index.add(shingles(q), signature(shingles(q)), item)
+        self.assertEqual(index.find(shingles(self.WAR_REWORDED), signature(shingles(self.WAR_REWORDED))), 0)
+        # Same wording, different answer
+        self.assertIsNone(index.find(shingles(self.SPAIN), signature(shingles(self.SPAIN))))
+
+    def test_band_keys_depend_on_scope(self):
+        sig = signature(shingles(self.WAR))
+        self.assertEqual(band_keys(sig, 'history|medium'), band_keys(sig.copy(), 'history|medium'))
+        self.assertFalse(set(band_keys(sig, 'history|medium')) & set(band_keys(sig, 'history|hard')))
+
+    def test_duplicate_clusters(self):
+        questions = {
+            10: self.WAR,
+            11: self.FRANCE,
+            12: self.WAR_REWORDED,
+            13: question('In what year did World War 2 end?', '1945'),
+            14: self.SPAIN,
+        }
+        matrix = np.stack([signature(shingles(q)) for q in questions.values()])
+        self.assertEqual(duplicate_clusters(list(questions), matrix), [[10, 12, 13]])
+        self.assertEqual(duplicate_clusters([10], matrix[:1]), [])
+
+
+class DedupeQuestionsTests(TestCase):
+    """
+    A bank filled before near-duplicate detection: questions without
+    signatures, repeated across quizzes.
+    """
+
+    def bank(self, *questions):
+        quiz = Quiz.objects.create(topic='history', num_questions=len(questions), difficulty_level='medium')
+        for text, answer in questions:
+            Question.objects.create(quiz=quiz, topic='history', difficulty='medium',
+                                    **bank_fields(question(text, answer)))
+        return quiz
+
+    def setUp(self):
+        self.original = self.bank(('In which year did World War II end?', '1945'),
+                                  ('What is the capital of France?', 'Paris'))
+        self.partial = self.bank(('In what year did World War II end?', '1945'),
+                                 ('Who painted the Mona Lisa?', 'Leonardo da Vinci'))
+        self.repeat = self.bank(('In which year did World War 2 end?', '1945'))
+
+    def test_dry_run_writes_nothing(self):
+        call_command('dedupe_questions', '--dry-run', stdout=StringIO())
+        self.assertEqual(Question.objects.count(), 5)
+        self.assertFalse(Question.objects.filter(minhash__isnull=False).exists())
+        self.assertFalse(QuestionBucket.objects.exists())
+
+    def test_removal_updates_quizzes(self):
+        call_command('dedupe_questions', stdout=StringIO())
+        self.assertEqual(sorted(Question.objects.values_list('question_text', flat=True)),
+                         ['In which year did World War II end?', 'What is the capital of France?',
+                          'Who painted the Mona Lisa?'])
+        self.assertEqual(dict(Quiz.objects.values_list('id', 'num_questions')),
+                         {self.original.id: 2, self.partial.id: 1})
+
+
+class AddQuizTests(TestCase):
+    def race(self, *indexes):
+        """
+        Patch in a concurrent add of the given questions of make_quiz(),
+        landing after add_quiz() checked the bank.
+        """
+        check = questionBank._near_duplicates
+
+        def near_duplicates(*args):
+            other = Quiz.objects.create(topic='geography', num_questions=len(indexes), difficulty_level='medium')
+            for index in indexes:
+                Question.objects.create(quiz=other, topic='geography', difficulty='medium',
+                                        **bank_fields(make_quiz()['questions'][index]))
+            return check(*args)
+        return mock.patch.object(questionBank, '_near_duplicates', near_duplicates)
+
+    def test_counts_only_inserted_questions(self):
+        with self.race(1):
+            self.assertEqual(add_quiz(make_quiz(), 'Geography', 'medium'), 2)
+        quiz = Quiz.objects.latest('id')
+        self.assertEqual(quiz.num_questions, 2)
+        self.assertEqual(QuestionBucket.objects.filter(question__quiz=quiz).values('question').distinct().count(), 2)
+
+    def test_answer_letters_round_trip(self):
+        quiz = make_quiz(2)
+        quiz['questions'][0].update(options=['A', 'B', 'C', 'D', 'E'], correctAnswer='E')
+        quiz['questions'][1].update(correctAnswer='D')
+        self.assertEqual(add_quiz(quiz, 'Geography', 'medium'), 1)
+        assembled = questionBank.assemble('geography', 'medium', 1)
+        self.assertEqual(compile_quiz(assembled).answer_key, [3])
+
+    def test_nothing_inserted(self):
+        with self.race(0, 1, 2):
+            self.assertEqual(add_quiz(make_quiz(), 'Geography', 'medium'), 0)
+        self.assertEqual(Quiz.objects.count(), 1)
+
+
+class QuestionSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.quiz = Quiz.objects.create(topic='astronomy', num_questions=0, difficulty_level='medium')
+        cls.title = cls.bank('Which planet is known for its bright rings?', explanation='Saturn.')
+        cls.option = cls.bank('Which planet is the largest?', options=['Jupiter', 'Saturn with rings', 'Mars', 'Venus'])
+        cls.explained = cls.bank('Which planet is sixth from the Sun?', explanation='Saturn, the one with rings.')
+        cls.volcano = cls.bank('Which volcano erupted in 79 AD?', topic='history', difficulty='hard')
+
+    @classmethod
+    def bank(cls, text, options=('A', 'B', 'C', 'D'), explanation='', topic='astronomy', difficulty='medium'):
+        fields = bank_fields({'question': text, 'options': list(options), 'correctAnswer': 'A',
+                              'explanation': explanation})
+        return Question.objects.create(quiz=cls.quiz, topic=topic, difficulty=difficulty, **fields)
+
+    def found(self, text, **filters):
+        return [question.id for question in search(text, **filters)[0]]
+
+    def test_match_query(self):
+        self.assertEqual(match_query('Solar sys-tem "OR"'), '"solar"* "sys"* "tem"* "or"*')
+        self.assertIsNone(match_query('  !? '))
+
+    def test_ranked_by_where_words_match(self):
+        # The question text weighs most, then the options, then the explanation
+        self.assertEqual(self.found('rings'), [self.title.id, self.option.id, self.explained.id])
+
+    def test_prefixes(self):
+        self.assertEqual(self.found('volc'), [self.volcano.id])
+        self.assertEqual(self.found('volc erup'), [self.volcano.id])
+        self.assertEqual(self.found('volc rings'), [])
+        self.assertEqual(self.found('volcanoes'), [])
+
+    def test_filters_and_facets(self):
+        self.assertEqual(self.found('which', topic='History'), [self.volcano.id])
+        self.assertEqual(len(self.found('which', difficulty='medium')), 3)
+        self.assertEqual(topic_facets('which'), [('astronomy', 3), ('history', 1)])
+        questions, has_more = search('planet', limit=2)
+        self.assertEqual((len(questions), has_more), (2, True))
+
+    def test_index_follows_writes(self):
+        Question.objects.filter(id=self.volcano.id).update(question_text='Which city did Vesuvius bury?')
+        self.assertEqual(self.found('volc'), [])
+        self.assertEqual(self.found('vesuv'), [self.volcano.id])
+        Question.objects.filter(id=self.volcano.id).delete()
+        self.assertEqual(self.found('vesuv'), [])
+        rebuild_index()
+        self.assertEqual(self.found('rings'), [self.title.id, self.option.id, self.explained.id])
+
+
+class UserStatsTests(TestCase):
+    STAT_FIELDS = ('games_played', 'total_score', 'correct_answers', 'total_questions', 'best_streak',
+                   'total_answer_time')
+
+    def setUp(self):
+        self.host = User.objects.create(username='host')
+        self.guest = User.objects.create(username='guest')
+
+    def play(self, score, correct, streak, average_time):
+        game = make_game(self.host, players=(self.guest,), status='completed')
+        Player.objects.filter(game=game).update(score=score, correct_answers=correct, total_questions=3,
+                                                best_streak=streak, average_time=average_time)
+        return game
+
+    def stats(self):
+        return {row['user_id']: row for row in UserStats.objects.values('user_id', *self.STAT_FIELDS)}
+
+    def test_game_counted_once(self):
+        game = self.play(300, 2, 2, 4.0)
+        self.assertEqual(record_games([game.id]), 1)
+        self.assertEqual(record_games([game.id]), 0)
+        stats = UserStats.objects.get(user=self.guest)
+        self.assertEqual((stats.games_played, stats.total_score, stats.correct_answers, stats.total_questions),
+                         (1, 300, 2, 3))
+        self.assertAlmostEqual(stats.total_answer_time, 12.0)
+
+    def test_backfill_matches_live_signal(self):
+        for args in ((300, 2, 2, 4.0), (100, 1, 1, 6.5)):
+            send_game_completed(self.play(*args).id, 'test')
+        live = self.stats()
+        self.assertEqual(live[self.guest.id]['games_played'], 2)
+        self.assertEqual(live[self.guest.id]['best_streak'], 2)
+
+        call_command('backfill_user_stats', '--rebuild', stdout=StringIO())
+        self.assertEqual(self.stats(), live)
+        out = StringIO()
+        call_command('backfill_user_stats', stdout=out)
+        self.assertIn('Done: 0 games', out.getvalue())
+        self.assertEqual(self.stats(), live)
+
+    def test_profile(self):
+        record_games([self.play(300, 2, 2, 4.0).id])
+        client = APIClient()
+        client.force_authenticate(self.guest)
+        profile = client.get('/api/profile/').json()['profile']
+        self.assertEqual({key: profile[key] for key in ('username', 'games_played', 'correct_answers',
+                                                         'total_questions', 'best_streak', 'average_time')},
+                         {'username': 'guest', 'games_played': 1, 'correct_answers': 2, 'total_questions': 3,
+                          'best_streak': 2, 'average_time': 4.0})
+
+        # No games yet: zeros rather than an error
+        client.force_authenticate(User.objects.create(username='new'))
+        profile = client.get('/api/profile/').json()['profile']
+        self.assertEqual((profile['games_played'], profile['average_time']), (0, 0.0))
+
+
+@override_settings(QUESTION_BANK=True, PREGEN_RATE=0, PREGEN_MIN_SCORE=1, PREGEN_STOCK_QUIZZES=2, PREGEN_BATCH=20)
+class PregenerationTests(TransactionTestCase):
+    def demand(self):
+        return TopicDemand.objects.get(topic='space', difficulty='easy')
+
+    def test_record_demand(self):
+        record_demand('Space', 'Easy', 4)
+        record_demand(' space ', 'easy', 500)
+        record_demand('', 'easy', 4)
+        demand = self.demand()
+        self.assertEqual((demand.requests, demand.questions, demand.score), (2, 4 + TYPICAL_COUNT_MAX, 2))
+        self.assertEqual(TopicDemand.objects.count(), 1)
+
+    def test_decay_and_hot_topics(self):
+        TopicDemand.objects.create(topic='space', difficulty='easy', score=4, requests=4, questions=20)
+        TopicDemand.objects.create(topic='rivers', difficulty='easy', score=8, requests=8, questions=80)
+        TopicDemand.objects.create(topic='knots', difficulty='easy', score=0.08, requests=1, questions=5)
+        decay(settings.PREGEN_HALF_LIFE)
+        self.assertAlmostEqual(self.demand().score, 2)
+        self.assertFalse(TopicDemand.objects.filter(topic='knots').exists())
+        self.assertEqual([(d.topic, stock_target(d)) for d in hot_topics()], [('rivers', 20), ('space', 10)])
+
+    def test_refill_stocks_and_replaces_served(self):
+        for _ in range(2):
+            record_demand('Space', 'easy', 5)
+        pregenerator = Pregenerator()
+        self.assertEqual(async_to_sync(pregenerator.refill)(), 10)
+        self.assertEqual(Question.objects.filter(topic='space', difficulty='easy').count(), 10)
+        # Stocked: nothing to do until questions are served
+        self.assertEqual(async_to_sync(pregenerator.refill)(), 0)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='host'))
+        response = client.post('/api/generate-quiz/', {'topic': 'Space', 'difficulty': 'easy', 'count': 5},
+                               format='json')
+        self.assertEqual(response.json()['cache'], 'bank')
+        self.assertEqual(self.demand().served, 5)
+        self.assertEqual(async_to_sync(pregenerator.refill)(), 5)
+        self.assertEqual(self.demand().served, 0)
+
+    def test_runpregen_once(self):
+        for _ in range(2):
+            record_demand('Space', 'easy', 3)
+        out = StringIO()
+        call_command('runpregen', '--once', stdout=out)
+        self.assertIn('Pre-generating', out.getvalue())
+        self.assertEqual(Question.objects.filter(topic='space', difficulty='easy').count(), 6)
+
+
+class ScoringEngineTests(SimpleTestCase):
+    # Credit of each option: only A is right; partial credit for B
+    CORRECT_A = np.array([1.0, 0.0, 0.0, 0.0])
+    PARTIAL = np.array([1.0, 0.5, 0.0, 1.0])
+
+    def test_time_decay(self):
+        is_correct, points, streaks = ScoringEngine().score(self.CORRECT_A, [0, 0, 0, 1, 7, -1], [0, 15, 45, 0, 0, 0],
+                                                            [0, 2, 0, 3, 0, 0], 30)
+        self.assertEqual(is_correct.tolist(), [True, True, True, False, False, False])
+        # 1000 for an instant answer, down to the 10% floor at the limit
+        self.assertEqual(points.tolist(), [1000, 550, 100, 0, 0, 0])
+        self.assertEqual(streaks.tolist(), [1, 3, 1, 0, 0, 0])
+
+    def test_partial_credit(self):
+        is_correct, points, _ = ScoringEngine().score(self.PARTIAL, [0, 1, 2, 3], [0] * 4, [0] * 4, 30)
+        self.assertEqual(is_correct.tolist(), [True, False, False, True])
+        self.assertEqual(points.tolist(), [1000, 500, 0, 1000])
+
+    def test_streak_bonus(self):
+        engine = ScoringEngine(StreakScoring(step=0.2, max_bonus=0.5))
+        _, points, streaks = engine.score(self.CORRECT_A, [0, 0, 0, 1], [0] * 4, [0, 1, 9, 9], 30)
+        self.assertEqual(points.tolist(), [1000, 1200, 1500, 0])
+        self.assertEqual(streaks.tolist(), [1, 2, 10, 0])
+
+    def test_batch_matches_single_answers(self):
+        engine = ScoringEngine(StreakScoring())
+        answers, times, streaks = [0, 1, 0, 2], [3.5, 10, 29, 0.1], [4, 0, 1, 2]
+        batch = engine.score(self.CORRECT_A, answers, times, streaks, 30)
+        for i in range(len(answers)):
+            single = engine.score(self.CORRECT_A, [answers[i]], [times[i]], [streaks[i]], 30)
+            self.assertEqual([values[i] for values in batch], [values[0] for values in single])
+
+    def test_for_quiz(self):
+        self.assertIsInstance(ScoringEngine.for_quiz({}).strategy, TimeDecayScoring)
+        engine = ScoringEngine.for_quiz({'scoring': {'strategy': 'streak', 'step': 0.2}})
+        self.assertIsInstance(engine.strategy, StreakScoring)
+        self.assertEqual(engine.strategy.step, 0.2)
+        # Unknown options fall back to the strategy's defaults
+        self.assertEqual(ScoringEngine.for_quiz({'scoring': {'strategy': 'streak', 'bogus': 1}}).strategy.step, 0.1)
+
+    def test_option_index(self):
+        self.assertEqual([option_index(answer) for answer in (2, 0, True, '1', None, 1.0)], [2, 0, -1, -1, -1, -1])
+
+
+class ChatHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create(username='host')
+        cls.game = GameRoom.objects.create(host=host, quiz_data={'title': 'Chat', 'questions': []})
+        other = GameRoom.objects.create(host=host, quiz_data={'title': 'Chat', 'questions': []})
+        start = timezone.now()
+        # Pairs of messages share a timestamp, so ids have to break ties
+        cls.messages = [
+            ChatMessage.objects.create(game_room=cls.game, sender=host, message=f'm{i}',
+                                       timestamp=start + timedelta(seconds=i // 2))
+            for i in range(7)
+        ]
+        ChatMessage.objects.create(game_room=other, sender=host, message='elsewhere', timestamp=start)
+
+    def texts(self, page):
+        messages, has_more = page
+        return [message.message for message in messages], has_more
+
+    def test_cursor_round_trip(self):
+        message = self.messages[3]
+        self.assertEqual(decode_cursor(encode_cursor(message)), (message.timestamp, message.id))
+        for cursor in ('', 'nonsense', encode_cursor(message)[:-3], '!!!'):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_newest_page(self):
+        self.assertEqual(self.texts(chat_page(self.game.id, limit=3)), (['m4', 'm5', 'm6'], True))
+        self.assertEqual(self.texts(chat_page(self.game.id, limit=7)), ([f'm{i}' for i in range(7)], False))
+
+    def test_paging_back(self):
+        seen, before = [], None
+        while True:
+            messages, has_more = chat_page(self.game.id, before=before, limit=2)
+            seen = [message.message for message in messages] + seen
+            if not has_more:
+                break
+            before = encode_cursor(messages[0])
+        self.assertEqual(seen, [f'm{i}' for i in range(7)])
+
+    def test_after(self):
+        cursor = encode_cursor(self.messages[2])
+        self.assertEqual(self.texts(chat_page(self.game.id, after=cursor, limit=3)), (['m3', 'm4', 'm5'], True))
+        self.assertEqual(self.texts(chat_page(self.game.id, after=cursor, limit=4)), (['m3', 'm4', 'm5', 'm6'], False))
+        self.assertEqual(self.texts(chat_page(self.game.id, after=encode_cursor(self.messages[6]))), ([], False))
+
+    def test_page_size(self):
+        self.assertEqual([page_size(value) for value in (None, '', 'x', '0', '20', 10 ** 6)], [50, 50, 50, 1, 20, 200])
+
+
+class ChatOrderTests(LiveRoomsTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.game = make_game(self.host)
+        self.room = rooms.get(self.game.code)
+
+    def test_flushes_commit_in_order(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def slow_write(players):
+            entered.set()
+            release.wait(5)
+
+        self.room.add_chat(self.host.id, 'host', 'first')
+        self.room.set_ready(self.room.get_player('host'), False)
+        with mock.patch.object(roomState, 'write_players', side_effect=slow_write):
+            first = threading.Thread(target=self.room.flush)
+            first.start()
+            self.assertTrue(entered.wait(5))
+            self.room.add_chat(self.host.id, 'host', 'second')
+            second = threading.Thread(target=self.room.flush)
+            second.start()
+            # The later batch waits for the earlier one to commit
+            second.join(0.2)
+            self.assertTrue(second.is_alive())
+            self.assertFalse(ChatMessage.objects.exists())
+            release.set()
+            first.join(5)
+            second.join(5)
+
+        messages, _ = chat_page(self.game.id)
+        self.assertEqual([m.message for m in messages], ['first', 'second'])
+        self.assertEqual(sorted(messages, key=lambda m: m.id), messages)
+
+    def test_timestamps_never_go_back(self):
+        now = timezone.now()
+        with mock.patch.object(roomState.timezone, 'now', side_effect=[now, now - timedelta(seconds=5)]):
+            self.room.add_chat(self.host.id, 'host', 'first')
+            self.room.add_chat(self.host.id, 'host', 'second')
+        self.room.flush()
+        first, second = ChatMessage.objects.order_by('id')
+        messages, _ = chat_page(self.game.id, after=encode_cursor(first))
+        self.assertEqual([m.message for m in messages], ['second'])
+
+
+class SkipListTests(SimpleTestCase):
+    def check(self, skiplist, keys):
+        keys = sorted(keys)
+        self.assertEqual(len(skiplist), len(keys))
+        self.assertEqual(list(skiplist), keys)
+        for position, key in enumerate(keys, 1):
+            self.assertEqual(skiplist.rank(key), position)
+        for start in (1, 2, len(keys) // 2 + 1, len(keys), len(keys) + 1):
+            self.assertEqual(skiplist.slice(start, 7), keys[start - 1:start + 6])
+
+    def test_random_inserts_and_removes(self):
+        rng = random.Random(7)
+        skiplist, keys = SkipList(seed=1), set()
+        for step in range(2000):
+            if keys and rng.random() < 0.4:
+                key = rng.choice(sorted(keys))
+                self.assertTrue(skiplist.remove(key))
+                keys.remove(key)
+            else:
+                key = rng.randrange(10 ** 6)
+                if key not in keys:
+                    skiplist.insert(key)
+                    keys.add(key)
+            if step % 250 == 0:
+                self.check(skiplist, keys)
+        self.check(skiplist, keys)
+
+    def test_missing_keys(self):
+        skiplist = SkipList(seed=1)
+        for key in (10, 20, 30):
+            skiplist.insert(key)
+        self.assertIsNone(skiplist.rank(15))
+        self.assertFalse(skiplist.remove(15))
+        self.assertEqual(skiplist.slice(0, 2), [])
+        self.assertEqual(skiplist.slice(4, 2), [])
+        self.assertEqual(skiplist.slice(2, 0), [])
+        for key in (10, 20, 30):
+            self.assertTrue(skiplist.remove(key))
+        self.check(skiplist, [])
+
+
+class LeaderboardTests(SimpleTestCase):
+    def test_ranking(self):
+        board = Leaderboard()
+        board.add(3, 500)
+        board.add(1, 700)
+        board.add(2, 500)
+        board.add(3, 400)
+        self.assertEqual(board.top(10), [(1, 3, 900), (2, 1, 700), (3, 2, 500)])
+        self.assertEqual(board.top(1, offset=1), [(2, 1, 700)])
+        self.assertEqual(board.rank(2), (3, 500))
+        self.assertIsNone(board.rank(4))
+        # Ties keep user id order
+        board.add(2, 200)
+        self.assertEqual(board.top(10)[1:], [(2, 1, 700), (3, 2, 700)])
+        self.assertEqual(Leaderboard.from_items(board.items()).top(10), board.top(10))
+
+
+class LeaderboardRegistryTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user{i}') for i in range(3)]
+        self.now = timezone.now()
+        self.finish([100, 50, 75], topic='space')
+        path = os.path.join(tempfile.mkdtemp(), 'leaderboards.json')
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        patcher = override_settings(LEADERBOARD_SNAPSHOT_PATH=path)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        snapshots = mock.patch.object(LeaderboardRegistry, '_start_snapshots')
+        snapshots.start()
+        self.addCleanup(snapshots.stop)
+
+    def finish(self, scores, topic=''):
+        game = GameRoom.objects.create(host=self.users[0], quiz_data={'title': 'Quiz', 'questions': []},
+                                       status='completed', ended_at=self.now, topic=topic)
+        for user, score in zip(self.users, scores):
+            Player.objects.create(user=user, game=game, score=score)
+        return game
+
+    def test_snapshot_restore_catches_up(self):
+        registry = LeaderboardRegistry()
+        registry.load()
+        self.assertTrue(registry.snapshot())
+
+        self.finish([10, 80, 0])
+        restored = LeaderboardRegistry()
+        with mock.patch.object(LeaderboardRegistry, '_rebuild', side_effect=AssertionError('not restored')):
+            size, entries, mine = restored.standings('all', 10, user_id=self.users[1].id)
+        self.assertEqual(size, 3)
+        self.assertEqual(entries, [(1, self.users[1].id, 'user1', 130), (2, self.users[0].id, 'user0', 110),
+                                   (3, self.users[2].id, 'user2', 75)])
+        self.assertEqual(mine, (1, 130))
+        self.assertEqual(restored.names(), ['all', 'topic:space', f'week:{week_key(self.now)}'])
+        self.assertEqual(restored.standings('topic:space', 1), (3, [(1, self.users[0].id, 'user0', 100)], None))
+
+        # Games already applied are not counted again
+        restored.sync()
+        self.assertEqual(restored.standings('all', 1)[1], [(1, self.users[1].id, 'user1', 130)])
+
+    def test_unreadable_snapshot_rebuilds(self):
+        with open(LeaderboardRegistry().snapshot_path(), 'w') as f:
+            f.write('{not json')
+        registry = LeaderboardRegistry()
+        self.assertEqual(registry.standings('all', 1)[1], [(1, self.users[0].id, 'user0', 100)])
+
+
+class QuestionStreamParserTests(SimpleTestCase):
+    QUESTIONS = [
+        {'question': 'Which brace closes "{"?', 'options': ['}', ']'], 'correctAnswer': 'A'},
+        {'question': 'Say \\"hi\\"', 'options': [{'text': 'hi', 'id': 'a'}, {'text': '[no]'}], 'correctAnswer': 'A'},
+        {'question': 'Last?', 'options': ['yes', 'no'], 'correctAnswer': 'B'},
+    ]
+
+    def reply(self):
+        return '```json\n' + json.dumps({'title': 'Brace {yourself}', 'questions': self.QUESTIONS}, indent=2) + '\n```'
+
+    def test_questions_complete_as_they_arrive(self):
+        reply = self.reply()
+        parser = QuestionStreamParser()
+        seen = []
+        for i, char in enumerate(reply):
+            for question in parser.feed(char):
+                seen.append(question)
+                # Available as soon as its closing brace arrived
+                self.assertEqual(reply[i], '}')
+        self.assertEqual(seen, self.QUESTIONS)
+        self.assertEqual(parser.title, 'Brace {yourself}')
+        self.assertEqual(parser.finish()['questions'], self.QUESTIONS)
+        self.assertFalse(parser.truncated)
+
+    def test_chunks(self):
+        reply = self.reply()
+        parser = QuestionStreamParser()
+        seen = []
+        for start in range(0, len(reply), 17):
+            seen += parser.feed(reply[start:start + 17])
+        self.assertEqual(seen, self.QUESTIONS)
+
+    def test_truncated_reply(self):
+        reply = self.reply()
+        parser = QuestionStreamParser()
+        parser.feed(reply[:reply.index('Last?')])
+        self.assertEqual(parser.questions, self.QUESTIONS[:2])
+        quiz = parser.finish()
+        self.assertTrue(parser.truncated)
+        self.assertEqual(quiz, {'title': 'Brace {yourself}', 'questions': self.QUESTIONS[:2]})
+
+    def test_nothing_usable(self):
+        parser = QuestionStreamParser()
+        parser.feed('{"title": "Empty", "questions": [{"question": "cut')
+        self.assertEqual(parser.questions, [])
+        with self.assertRaises(QuizParseError):
+            parser.finish()
+
+    def test_ignores_objects_outside_questions(self):
+        parser = QuestionStreamParser()
+        completed = parser.feed('{"meta": {"question": "not one"}, "questions": [{"question": "one"}], "x": [{}]}')
+        self.assertEqual(completed, [{'question': 'one'}])
+
+
+class QuizCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.client = FakeGroq()
+
+    def get(self, cache, topic='Space', client=None):
+        client = client or self.client
+        return cache.get_or_generate(topic, 'easy', 3, 'model',
+                                     lambda: quizPlanner.generate(client, topic, 'easy', 3, 'model'))
+
+    def test_memory_then_store(self):
+        cache = QuizCache(ttl=60, max_entries=4)
+        quiz, source = self.get(cache)
+        self.assertEqual((len(quiz['questions']), source), (3, 'generated'))
+        self.assertEqual(self.get(cache), (quiz, 'memory'))
+        # Another process, or this one after a restart, reads the store
+        cache.clear()
+        self.assertEqual(self.get(cache), (quiz, 'store'))
+        self.assertEqual(self.client.calls, 1)
+
+    def test_expired_entries_are_generated_again(self):
+        cache = QuizCache(ttl=0.05, max_entries=4)
+        self.get(cache)
+        time.sleep(0.1)
+        self.assertEqual(self.get(cache)[1], 'generated')
+        self.assertEqual(self.client.calls, 2)
+        self.assertEqual(GeneratedQuiz.objects.count(), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = QuizCache(ttl=60, max_entries=2)
+        self.get(cache, 'Space')
+        self.get(cache, 'Rivers')
+        self.get(cache, 'Space')
+        self.get(cache, 'Deserts')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(self.get(cache, 'Space')[1], 'memory')
+        self.assertEqual(self.get(cache, 'Rivers')[1], 'store')
+        self.assertEqual(self.client.calls, 3)
+
+    def test_failures_are_not_cached(self):
+        cache = QuizCache(ttl=60, max_entries=4)
+
+        def fail():
+            raise QuizParseError('cut off', '')
+        with self.assertRaises(QuizParseError):
+            cache.get_or_generate('Space', 'easy', 3, 'model', fail)
+        self.assertEqual(self.get(cache)[1], 'generated')
+
+    def test_concurrent_callers_share_one_call(self):
+        cache = QuizCache(ttl=60, max_entries=4)
+        client = FakeGroq(latency=0.2)
+        barrier = threading.Barrier(4)
+        sources = []
+
+        def request():
+            barrier.wait()
+            sources.append(self.get(cache, client=client)[1])
+        threads = [threading.Thread(target=request) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(sources), ['generated', 'shared', 'shared', 'shared'])
+        self.assertEqual(client.calls, 1)
+
+    def test_concurrent_async_callers_share_one_call(self):
+        cache = QuizCache(ttl=60, max_entries=4)
+        client = AsyncFakeGroq(latency=0.1)
+
+        async def generate():
+            completion = await client.chat.completions.create(**completion_args('Space', 3, 'easy', 'model'))
+            return parse_quiz(completion.choices[0].message.content)
+
+        async def requests():
+            return await asyncio.gather(*(cache.aget_or_generate('Space', 'easy', 3, 'model', generate)
+                                          for _ in range(3)))
+        results = async_to_sync(requests)()
+        self.assertEqual(sorted(source for _, source in results), ['generated', 'shared', 'shared'])
+        self.assertEqual(client.calls, 1)
+
+
+@override_settings(QUIZ_CHUNK_SIZE=10, QUIZ_MAX_PARALLEL_PARTS=8)
+class QuizPlannerTests(SimpleTestCase):
+    def texts(self, quiz):
+        return [q['question'] for q in quiz['questions']]
+
+    def test_parts(self):
+        parts = QuizPlan(25).next_parts()
+        self.assertEqual([(p.start, p.count) for p in parts], [(1, 9), (10, 8), (18, 8)])
+        self.assertEqual({(p.parts, p.total) for p in parts}, {(3, 25)})
+        # One part needs no part instructions
+        self.assertIsNone(QuizPlan(5).prompt_part(QuizPlan(5).next_parts()[0]))
+
+    def test_parts_run_in_parallel(self):
+        client = FakeGroq(latency=0.2)
+        started = time.perf_counter()
+        quiz = quizPlanner.generate(client, 'Space', 'easy', 30)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(len(set(self.texts(quiz))), 30)
+
+    @override_settings(FAKE_GROQ_LATENCY=0.2)
+    def test_async_parts_run_in_parallel(self):
+        started = time.perf_counter()
+        quiz = async_to_sync(quizPlanner.agenerate)('Space', 'easy', 30)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(len(set(self.texts(quiz))), 30)
+
+    def test_duplicates_are_merged_and_topped_up(self):
+        # Each part repeats two questions of the one before it
+        client = FakeGroq(overlap=2)
+        quiz = quizPlanner.generate(client, 'Space', 'easy', 20)
+        self.assertEqual(len(quiz['questions']), 20)
+        self.assertEqual(len(set(self.texts(quiz))), 20)
+        # Two parts, then one more for the two duplicates dropped
+        self.assertEqual(client.calls, 3)
+
+    def test_failed_part_is_asked_for_again(self):
+        client = FakeGroq(latency=0.05)
+        create = client.chat.completions.create
+
+        def flaky(**kwargs):
+            if 'write its questions 11-20' in kwargs['messages'][-1]['content']:
+                raise QuizParseError('cut off', '')
+            return create(**kwargs)
+        client.chat.completions.create = flaky
+        quiz = quizPlanner.generate(client, 'Space', 'easy', 20)
+        self.assertEqual(len(set(self.texts(quiz))), 20)
+        self.assertEqual(client.calls, 2)
+
+    def test_all_parts_failing_raises(self):
+        client = FakeGroq()
+
+        def broken(**kwargs):
+            raise QuizParseError('cut off', '')
+        client.chat.completions.create = broken
+        with self.assertRaises(QuizParseError):
+            quizPlanner.generate(client, 'Space', 'easy', 20)
+
+
+@override_settings(ROOM_WORKERS=['http://worker-a:8000', 'http://worker-b:8000/'],
+                   ROOM_WORKER_URL='http://worker-a:8000')
+class RoomAffinityTests(LiveRoomsTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.host = User.objects.create(username='host')
+        self.client = APIClient()
+        self.client.force_authenticate(self.host)
+        self.games = [make_game(self.host) for _ in range(12)]
+        self.remote = next(game for game in self.games if not is_local_room(game.code))
+        self.local = next(game for game in self.games if is_local_room(game.code))
+
+    def test_room_urls_go_to_the_owner(self):
+        for method, path in (('get', 'status/'), ('post', 'start/'), ('post', 'answer/'), ('post', 'next/')):
+            response = getattr(self.client, method)(f'/api/game/{self.remote.code}/{path}?x=1')
+            self.assertEqual(response.status_code, 307, path)
+            self.assertEqual(response['Location'], f'http://worker-b:8000/api/game/{self.remote.code}/{path}?x=1')
+        self.assertIsNone(rooms.peek(self.remote.code))
+        self.assertEqual(self.client.get(f'/api/game/{self.local.code}/status/').status_code, 200)
+
+    def test_codes_in_the_body(self):
+        response = self.client.post('/api/game/join/', {'game_code': self.remote.code}, format='json')
+        self.assertEqual(response.status_code, 307)
+        self.assertEqual(response['Location'], 'http://worker-b:8000/api/game/join/')
+        response = self.client.post('/api/chat/send/', {'pin': self.remote.code, 'message': 'hi'})
+        self.assertEqual(response.status_code, 307)
+        response = self.client.post('/api/game/join/', {'game_code': self.local.code}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class StructuredLoggingTests(SimpleTestCase):
+    def setUp(self):
+        self.records = []
+        handler = logging.Handler()
+        handler.emit = self.records.append
+        logger = logging.getLogger('mindclash.test')
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(setattr, logger, 'propagate', True)
+        self.log = StructuredLogger(logger, RateLimitFilter(rate=1, burst=2))
+
+    def test_fields_become_json(self):
+        self.log.info('answer_received', game='ABC123', answer=2)
+        data = json.loads(JsonFormatter().format(self.records[0]))
+        self.assertEqual({key: data[key] for key in ('level', 'logger', 'event', 'game', 'answer')},
+                         {'level': 'INFO', 'logger': 'mindclash.test', 'event': 'answer_received',
+                          'game': 'ABC123', 'answer': 2})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            self.log.exception('answer_failed')
+        self.assertIn('ValueError: boom', json.loads(JsonFormatter().format(self.records[1]))['exc'])
+
+    def test_rate_limit(self):
+        with mock.patch.object(logs.time, 'monotonic', return_value=100.0):
+            for _ in range(5):
+                self.log.debug('hot_event')
+            # Warnings are never dropped
+            self.log.warning('hot_event')
+        self.assertEqual(len(self.records), 3)
+        # The next record let through says how many were dropped
+        with mock.patch.object(logs.time, 'monotonic', return_value=101.0):
+            self.log.debug('hot_event')
+        self.assertEqual(self.records[-1].fields, {'suppressed': 3})
+
+    def test_queue_handler_writes_lines(self):
+        stream = StringIO()
+        handler = QueueLogHandler(stream=stream)
+        record = logging.LogRecord('mindclash.test', logging.INFO, __file__, 0, 'room_loaded', None, None)
+        record.fields = {'game': 'ABC123'}
+        handler.handle(record)
+        handler.close()
+        line = json.loads(stream.getvalue())
+        self.assertEqual((line['event'], line['game']), ('room_loaded', 'ABC123'))
+
+
+class MetricsTests(SimpleTestCase):
+    def metric(self, cls, name, *args, **kwargs):
+        metric = cls(name, 'Test metric', *args, **kwargs)
+        self.addCleanup(metrics.registry.metrics.pop, name)
+        return metric
+
+    def in_threads(self, fn, count=3):
+        threads = [threading.Thread(target=fn) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_counter_shards_are_added_up(self):
+        counter = self.metric(metrics.Counter, 'test_events_total', ['kind'])
+        counter.inc('a')
+        self.in_threads(lambda: [counter.inc('a'), counter.inc('b', amount=2)])
+        self.assertEqual(counter.values(), {('a',): 4, ('b',): 6})
+        self.assertIn('test_events_total{kind="b"} 6', counter.render())
+
+    def test_histogram_buckets(self):
+        histogram = self.metric(metrics.Histogram, 'test_seconds', buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        self.in_threads(lambda: histogram.observe(0.5), count=1)
+        histogram.observe(5)
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 5.65',
+            'test_seconds_count 4',
+        ])
+
+    def test_gauge(self):
+        gauge = self.metric(metrics.Gauge, 'test_rooms', lambda: {('open',): 2, ('done',): 1}, ['state'])
+        self.assertEqual(gauge.render()[2:], ['test_rooms{state="done"} 1', 'test_rooms{state="open"} 2'])
+        broken = self.metric(metrics.Gauge, 'test_broken', lambda: 1 / 0)
+        self.assertEqual(broken.render(), broken.header())
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_scrape(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE mindclash_http_requests_total counter', response.content.decode())
+        self.assertIn('mindclash_http_requests_total{endpoint="metrics",method="GET",status="401"}',
+                      response.content.decode())
 
-# Create your tests here.
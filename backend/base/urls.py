@@ -1,5 +1,5 @@
 from django.urls import path
-from .service import loginService, logoutService, registerService, homePage, gameService
+from .service import loginService, logoutService, registerService, homePage, gameService, metricsService, leaderboardService, questionSearchService
 from rest_framework.authtoken.views import ObtainAuthToken
 from . import views
 
@@ -14,6 +14,7 @@ urlpatterns = [
     
     path('api/groq-chat/', views.groq_chat, name='groq-chat'),  # GROQ AI endpoint
     path('api/generate-quiz/', views.generate_quiz, name='generate-quiz'),  # Quiz generation endpoint
+    path('api/questions/search/', questionSearchService.search_questions, name='search-questions'),  # Question bank search
     
     path('api/profile/', views.get_profile, name='get-profile'),  # Get user profile
     path('api/profile/update/', views.update_profile, name='update-profile'),  # Update user profile
@@ -31,9 +32,14 @@ urlpatterns = [
     path('api/chat/send/', views.send_chat_message, name='send-chat-message'),
     path('api/chat/<str:pin>/', views.get_chat_messages, name='get-chat-messages'),
     
-    # Leaderboard endpoint
-    path('api/game/<str:game_code>/leaderboard/', views.get_leaderboard, name='get-leaderboard'),
+    # Global leaderboards
+    path('api/leaderboards/all/', leaderboardService.all_time_leaderboard, name='leaderboard-all'),
+    path('api/leaderboards/weekly/', leaderboardService.weekly_leaderboard, name='leaderboard-weekly'),
+    path('api/leaderboards/topic/<str:topic>/', leaderboardService.topic_leaderboard, name='leaderboard-topic'),
 
     # Answer distribution endpoint
     path('api/answer_distribution/<str:pin>/', views.answer_distribution, name='answer_distribution'),
+
+    # Prometheus scrape endpoint
+    path('metrics', metricsService.metrics_view, name='metrics'),
 ]
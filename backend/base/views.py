@@ -6,6 +6,11 @@ from rest_framework.decorators import api_view, authentication_classes, permissi
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from drf_yasg.utils import swagger_auto_schema
+from . import metrics
+from .logs import get_logger
+from .querybudget import query_budget
+
+log = get_logger('quiz')
 
 # Initialize GROQ client
 try:
@@ -13,20 +18,32 @@ try:
         api_key=os.environ.get("GROQ_API_KEY") or settings.GROQ_API_KEY
     )
 except Exception as e:
-    print(f"Error initializing GROQ client: {e}")
+    log.error('groq_client_init_failed', error=str(e))
     client = None
 from rest_framework.authentication import TokenAuthentication
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 import json
 import os
-from .models import UserProfile, GameRoom, Player,ChatMessage
+from .models import UserProfile, GameRoom, Player,ChatMessage, UserStats
 from .serializers import GameRoomSerializer
-
-# Initialize GROQ client with API key from settings
-client = Groq(
-    api_key=settings.GROQ_API_KEY,
-)
+from .service.chatHistory import InvalidCursor, chat_page, encode_cursor, page_size
+from .service import questionBank, quizGenerator, quizPlanner
+from .service.fakeGroq import FakeGroq
+from .service.pregeneration import record_demand, record_served
+from .service.quizCache import quiz_cache
+from .service.quizGenerator import QuizParseError
+from .service.roomState import rooms
+
+# Initialize GROQ client with API key from settings, or the offline fake
+if settings.QUIZ_GENERATOR == 'stub':
+    client = FakeGroq(latency=settings.FAKE_GROQ_LATENCY, tokens_per_second=settings.FAKE_GROQ_TOKENS_PER_SECOND)
+else:
+    client = Groq(
+        api_key=settings.GROQ_API_KEY,
+        base_url=settings.GROQ_BASE_URL,
+        timeout=settings.GROQ_TIMEOUT,
+    )
 
 # Define the request body schema for GROQ chat
 groq_chat_schema = openapi.Schema(
@@ -46,8 +63,10 @@ quiz_generation_schema = openapi.Schema(
     properties={
         'topic': openapi.Schema(type=openapi.TYPE_STRING, description='Quiz topic'),
         'difficulty': openapi.Schema(type=openapi.TYPE_STRING, description='Quiz difficulty level', default="medium"),
-        'count': openapi.Schema(type=openapi.TYPE_INTEGER, description='Number of questions', default=5),
+        'count': openapi.Schema(type=openapi.TYPE_INTEGER, description='Number of questions', default=5,
+                                minimum=1, maximum=settings.QUIZ_MAX_QUESTIONS),
         'model': openapi.Schema(type=openapi.TYPE_STRING, description='GROQ model to use', default="meta-llama/llama-4-scout-17b-16e-instruct"),
+        'fresh': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='Generate new questions instead of drawing them from the question bank', default=False),
     },
     required=['topic']
 )
@@ -116,6 +135,7 @@ def groq_chat(request):
         })
         
     except Exception as e:
+        log.exception('groq_chat_failed')
         return Response({"error": str(e)}, status=500)
 
 # API - http://127.0.0.1:8000/api/generate-quiz/ (POST request)
@@ -282,85 +302,56 @@ def generate_quiz(request):
         topic = data.get('topic')
         difficulty = data.get('difficulty', 'medium')
         count = data.get('count', 5)
-        model = data.get('model', "meta-llama/llama-4-scout-17b-16e-instruct")
+        model = data.get('model', quizGenerator.DEFAULT_MODEL)
         
         if not topic:
             return Response({"error": "Topic is required"}, status=400)
+        try:
+            count = int(count)
+        except (TypeError, ValueError):
+            return Response({"error": "Count must be a number"}, status=400)
+        if not 1 <= count <= settings.QUIZ_MAX_QUESTIONS:
+            return Response({"error": f"Count must be between 1 and {settings.QUIZ_MAX_QUESTIONS}"}, status=400)
         
-        # Create the prompt for quiz generation
-        prompt = f"""Generate a timed quiz of {count} multiple-choice questions on the topic "{topic}" with difficulty level {difficulty}.
-        
-        Format the response as a JSON object with the following structure:
-        {{
-          "title": "Quiz title",
-          "questions": [
-            {{
-              "question": "Question text",
-              "options": ["Option A", "Option B", "Option C", "Option D"],
-              "correctAnswer": "Correct option letter (A, B, C, or D)",
-              "explanation": "Brief explanation of the answer"
-            }},
-            ... more questions
-          ],
-          "recommendedTimeInMinutes": recommended time to complete this quiz
-        }}
-        
-        Make sure all questions are factually accurate and each has exactly 4 answer options.
-        """
-            
-        # Create GROQ completion
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_completion_tokens=2048,
-            top_p=1,
-            stream=False,
-            stop=None,
-        )
-        
-        # Extract response content
-        response_content = completion.choices[0].message.content
-        
-        # Try to extract JSON from the response
+        # Quizzes are assembled from the question bank when it can (and
+        # the pre-generation worker stocks it for popular topics); other
+        # identical requests are answered from the cache, and concurrent
+        # ones share a single call to the model
+        record_demand(topic, difficulty, count)
         try:
-            # Look for JSON in code blocks or in the entire response
-            json_match = response_content.strip()
-            if "```json" in json_match:
-                json_match = json_match.split("```json")[1].split("```")[0].strip()
-            elif "```" in json_match:
-                json_match = json_match.split("```")[1].split("```")[0].strip()
-            
-            # Parse the JSON
-            quiz_data = json.loads(json_match)
-            
-            # Validate the quiz data structure
-            if "title" not in quiz_data or "questions" not in quiz_data:
-                raise ValueError("Invalid quiz data structure")
-                
-            # Return the quiz data
-            return Response({
-                "success": True,
-                "quiz": quiz_data,
-                "topic": topic,
-                "difficulty": difficulty,
-                "count": count
-            })
-            
-        except Exception as json_error:
+            quiz_data = None if data.get('fresh') else questionBank.assemble(topic, difficulty, count)
+            if quiz_data is not None:
+                source = 'bank'
+                metrics.quiz_cache.inc(source)
+                record_served(topic, difficulty, count)
+            else:
+                quiz_data, source = quiz_cache.get_or_generate(
+                    topic, difficulty, count, model,
+                    lambda: quizPlanner.generate(client, topic, difficulty, count, model)
+                )
+        except QuizParseError as json_error:
             # If JSON parsing failed, return the raw response
             return Response({
                 "success": False,
                 "error": f"Failed to parse quiz data: {str(json_error)}",
-                "raw_response": response_content
+                "raw_response": json_error.raw_response
             }, status=400)
+            
+        # Games created from this quiz are ranked under its topic
+        quiz_data.setdefault("topic", topic)
+
+        # Return the quiz data
+        return Response({
+            "success": True,
+            "quiz": quiz_data,
+            "topic": topic,
+            "difficulty": difficulty,
+            "count": count,
+            "cache": source
+        })
         
     except Exception as e:
+        log.exception('generate_quiz_failed')
         return Response({"error": str(e)}, status=500)
 
 # Example of the streaming version (for testing in the terminal)
@@ -461,6 +452,7 @@ def update_profile(request):
             'message': str(e)
         }, status=400)
 
+@query_budget(3)
 @swagger_auto_schema(
     method='get',
     responses={200: "Profile retrieved successfully", 404: "Profile not found"}
@@ -476,15 +468,8 @@ def get_profile(request):
         user = request.user
         profile = UserProfile.objects.get(user=user)
 
-        # Fetch stats across all games
-        player_entries = Player.objects.filter(user=user)
-        total_correct = sum(p.correct_answers for p in player_entries)
-        total_questions = sum(p.total_questions for p in player_entries)
-        best_streak = max((p.best_streak for p in player_entries), default=0)
-
-        # Compute global average time
-        total_time = sum(p.average_time * p.total_questions for p in player_entries)
-        average_time = (total_time / total_questions) if total_questions else 0.0
+        # Lifetime totals over completed games, kept up to date as games end
+        stats = UserStats.objects.filter(user=user).first() or UserStats(user=user)
         
         return Response({
             'success': True,
@@ -494,10 +479,11 @@ def get_profile(request):
                 'bio': profile.bio,
                 'avatar_url': profile.avatar_url,
                 'username': user.username,
-                'correct_answers': total_correct,
-                'total_questions': total_questions,
-                'best_streak': best_streak,
-                'average_time': round(average_time, 2),
+                'games_played': stats.games_played,
+                'correct_answers': stats.correct_answers,
+                'total_questions': stats.total_questions,
+                'best_streak': stats.best_streak,
+                'average_time': round(stats.average_time, 2),
             }
         })
         
@@ -512,34 +498,48 @@ def get_profile(request):
             'message': str(e)
         }, status=400)
 
+@query_budget(6)
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def send_chat_message(request):
     pin = request.data.get("pin")
     message = request.data.get("message")
 
-    try:
-        room = GameRoom.objects.get(code=pin)
-        chat = ChatMessage.objects.create(
-            game_room=room,
-            sender=request.user,
-            message=message
-        )
-        return Response({"message": "Sent"})
-    except GameRoom.DoesNotExist:
+    # Goes through the live room so players on the game socket get it at once
+    room = rooms.get(pin) if pin else None
+    if room is None:
         return Response({"error": "Room not found"}, status=404)
-
+    # Only players of the room can chat, as on the game socket
+    player = room.get_player(user_id=request.user.id)
+    if player is None:
+        return Response({"error": "You are not a player in this game"}, status=403)
+    room.load_chat()
+    chat = room.add_chat(player.user_id, player.username, message if isinstance(message, str) else None)
+    if chat is None:
+        return Response({"error": "Message is empty"}, status=400)
+    rooms.chat_posted(room, chat)
+    return Response({"message": "Sent"})
+
+@query_budget(6)
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_chat_messages(request, pin):
     try:
+        # Messages still waiting in the room's write-behind batch
+        rooms.flush(pin)
         room = GameRoom.objects.get(code=pin)
         
         # Check if user is a player in this game
         if not room.players.filter(user=request.user).exists():
             return Response({"error": "You are not a player in this game"}, status=403)
             
-        messages = ChatMessage.objects.filter(game_room=room).order_by("timestamp")
+        # ?after=<cursor> for messages newer than the cursor (polling),
+        # ?before=<cursor> for older ones (scrolling back), neither for the
+        # newest page; ?limit= caps the page size
+        after = request.query_params.get("after") or None
+        before = request.query_params.get("before") or None
+        messages, has_more = chat_page(room.id, after=after, before=before,
+                                       limit=page_size(request.query_params.get("limit")))
         return Response({
             "success": True,
             "messages": [{
@@ -547,88 +547,35 @@ def get_chat_messages(request, pin):
                 "sender": m.sender.username,
                 "message": m.message,
                 "timestamp": m.timestamp
-            } for m in messages]
-        })
-    except GameRoom.DoesNotExist:
-        return Response({"error": "Game room not found"}, status=404)
-    except Exception as e:
-        return Response({"error": str(e)}, status=400)
-
-@api_view(["GET"])
-@permission_classes([IsAuthenticated])
-def get_leaderboard(request, game_code):
-    try:
-        # Get the game room
-        game_room = GameRoom.objects.get(pin=game_code)
-        
-        # Check if user is a player in this game
-        if not game_room.players.filter(user=request.user).exists():
-            return Response({"error": "You are not a player in this game"}, status=403)
-        
-        # Get all players in the game with their stats
-        players = []
-        for player in game_room.players.all():
-            players.append({
-                'user_id': player.user.id,
-                'username': player.user.username,
-                'score': player.score,
-                'best_streak': player.best_streak,
-                'correct_answers': player.correct_answers,
-                'average_time': player.average_time
-            })
-        
-        # Sort by score descending
-        players = sorted(players, key=lambda x: x['score'], reverse=True)
-        
-        return Response({
-            'success': True,
-            'players': players,
-            'game_title': game_room.quiz_data.get('title', 'Quiz Game') if game_room.quiz_data else 'Quiz Game'
+            } for m in messages],
+            "has_more": has_more,
+            # Pass back as ?after= to get only what was sent since
+            "next_cursor": encode_cursor(messages[-1]) if messages else after,
+            # Pass back as ?before= to page further back
+            "prev_cursor": encode_cursor(messages[0]) if messages else before
         })
-        
     except GameRoom.DoesNotExist:
         return Response({"error": "Game room not found"}, status=404)
+    except InvalidCursor:
+        return Response({"error": "Invalid cursor"}, status=400)
     except Exception as e:
         return Response({"error": str(e)}, status=400)
 
+@query_budget(3)
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def answer_distribution(request, pin):
     try:
-        room = GameRoom.objects.get(code=pin)
-        players = Player.objects.filter(game=room)
+        # Counted incrementally by the live room as answers arrive
+        room = rooms.get(pin)
+        if room is None:
+            return Response({"error": "Room not found"}, status=404)
 
-        # ✅ FIXED: Use the correct field name
-        current_question_index = room.current_question
-
-        # Safely extract question from quiz_data
-        questions = room.quiz_data.get("questions", [])
-        if current_question_index >= len(questions):
+        distribution = room.distribution()
+        if distribution is None:
             return Response({"error": "Invalid question index"}, status=400)
 
-        current_question = questions[current_question_index]
-        options = current_question.get("options", [])
-        correct_index = current_question.get("correct_answer")
-
-        # Build distribution
-        distribution = []
-        for idx, option_text in enumerate(options):
-            count = players.filter(current_answer=idx).count()
-            distribution.append({
-                "answer": option_text,
-                "count": count
-            })
+        return Response(distribution)
 
-        all_answered = all(p.current_answer is not None for p in players)
-        correct_answer_text = options[correct_index] if all_answered else None
-
-        return Response({
-            "distribution": distribution,
-            "correct_answer": correct_answer_text,
-            "all_answered": all_answered
-        })
-
-    except GameRoom.DoesNotExist:
-        return Response({"error": "Room not found"}, status=404)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
\ No newline at end of file
@@ -15,9 +15,11 @@ const Chat = ({ pin, currentUser }) => {
   const [showEmojiPicker, setShowEmojiPicker] = useState(false);
   const [isTyping, setIsTyping] = useState(false);
   const [typingTimeout, setTypingTimeout] = useState(null);
-  const lastMessageCount = useRef(0);
+  const socketRef = useRef(null);
+  const isOpenRef = useRef(false);
 
   const API_URL = 'https://mindclash-mm6g.onrender.com/api';
+  const WS_URL = 'wss://mindclash-mm6g.onrender.com';
 
   const commonEmojis = [
     '😊', '😂', '❤️', '👍', '🎮', '🎯', '🎲', '🎪', '🎨', '🎭',
@@ -42,37 +44,68 @@ const Chat = ({ pin, currentUser }) => {
     scrollToBottom();
   }, [messages]);
 
+  // Messages arrive over the game socket; the REST endpoint is only used
+  // for sending while the socket is down
   useEffect(() => {
-    const fetchMessages = async () => {
-      try {
-        const token = localStorage.getItem('authToken');
-        const response = await axios.get(`${API_URL}/chat/${pin}/`, {
-          headers: { Authorization: `Token ${token}` }
-        });
+    let socket = null;
+    let retry = null;
+    let closed = false;
 
-        // Update unread count if chat is closed and there are new messages
-        if (!isOpen && response.data.messages.length > lastMessageCount.current) {
-          setUnreadCount(prev => prev + (response.data.messages.length - lastMessageCount.current));
+    const connect = (url) => {
+      const token = localStorage.getItem('authToken');
+      socket = new WebSocket(url || `${WS_URL}/ws/game/${pin}/?token=${token}`);
+      socketRef.current = socket;
+
+      socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'game_state') {
+          // Recent history, sent on connect
+          setMessages(data.game.chat || []);
+          setError(null);
+        } else if (data.type === 'chat_message') {
+          setMessages(prev => [...prev, data.message]);
+          if (!isOpenRef.current) {
+            setUnreadCount(prev => prev + 1);
+          }
+        } else if (data.type === 'redirect') {
+          // The room lives on another worker
+          socket.onclose = null;
+          socket.close();
+          connect(`${data.url.replace(/^http/, 'ws')}?token=${token}`);
         }
+      };
 
-        setMessages(response.data.messages);
-        lastMessageCount.current = response.data.messages.length;
-        setError(null);
-      } catch (error) {
-        console.error('Error fetching messages:', error);
-        setError('Failed to load messages');
-      }
+      socket.onclose = () => {
+        if (!closed) {
+          retry = setTimeout(() => connect(), 2000);
+        }
+      };
     };
 
-    fetchMessages();
-    const interval = setInterval(fetchMessages, 3000);
-    return () => clearInterval(interval);
-  }, [pin, isOpen]);
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (socket) socket.close();
+      socketRef.current = null;
+    };
+  }, [pin]);
+
+  useEffect(() => {
+    isOpenRef.current = isOpen;
+  }, [isOpen]);
 
   const handleSendMessage = async (e) => {
     e.preventDefault();
     if (!newMessage.trim()) return;
 
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify({ type: 'chat_message', message: newMessage }));
+      setNewMessage('');
+      return;
+    }
+
     try {
       const token = localStorage.getItem('authToken');
       await axios.post(
@@ -19,6 +19,7 @@
                 // Ensure the quiz data is properly formatted
                 const formattedQuizData = {
                     title: data.title || 'Quiz',
+                    topic: data.topic || '',
                     questions: (data.questions || []).map(question => ({
                         question: question.question || '',
                         options: question.options || [],
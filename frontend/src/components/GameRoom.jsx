@@ -233,7 +233,7 @@ const GameRoom = () => {
   const handleNextQuestionClick = async () => {
     try {
       if (!gameCode || !isHost) return;
-      await GameService.nextQuestion(gameCode);
+      await GameService.nextQuestion(gameCode, gameState?.current_question);
     } catch (err) {
       console.error("Failed to move to next question:", err);
     }
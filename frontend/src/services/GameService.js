@@ -121,11 +121,13 @@ const GameService = {
     /**
      * Move to the next question (host only)
      * @param {string} gameCode - The code of the game
+     * @param {number} [currentQuestion] - The question being left; the server refuses if the game has moved on
      * @returns {Promise} - A promise that resolves when moved to the next question
      */
-    nextQuestion: async (gameCode) => {
+    nextQuestion: async (gameCode, currentQuestion) => {
         try {
-            const response = await api.post(`/api/game/${gameCode}/next/`, {});
+            const body = currentQuestion === undefined ? {} : { current_question: currentQuestion };
+            const response = await api.post(`/api/game/${gameCode}/next/`, body);
             // console.log('Next question response:', response.data);
             return response.data;
         } catch (error) {
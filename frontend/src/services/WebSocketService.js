@@ -9,6 +9,7 @@ class WebSocketService {
         this.gameCode = null;
         this._prevGameState = null;
         this._prevQuestion = null;
+        this._etag = null;
         this.listeners = {
             gameStateUpdate: [],
             gameStarted: [],
@@ -24,21 +25,30 @@ class WebSocketService {
         }
 
         this.gameCode = gameCode;
+        this._etag = null;
         this.polling = true;
         
-        // Start polling for game state updates
-        this.pollInterval = setInterval(() => this.pollGameState(), 2000); // Poll every 2 seconds
-        
-        // Initial poll to get the current state
-        this.pollGameState();
+        // Initial poll to get the current state, then long-poll for changes
+        this.pollGameState().then(() => this.watchGameState(gameCode));
         
         console.log('Started polling for game updates');
         
         return this;
     }
     
-    async pollGameState() {
-        if (!this.polling || !this.gameCode) return;
+    async watchGameState(gameCode) {
+        // Each request is parked by the server until the state changes
+        while (this.polling && this.gameCode === gameCode) {
+            const ok = await this.pollGameState(true);
+            if (!ok) {
+                // Back off before retrying after an error
+                await new Promise(resolve => setTimeout(resolve, 2000));
+            }
+        }
+    }
+    
+    async pollGameState(longPoll = false) {
+        if (!this.polling || !this.gameCode) return false;
         
         try {
             const token = localStorage.getItem('authToken');
@@ -47,10 +57,20 @@ class WebSocketService {
                 throw new Error('Authentication required');
             }
             
-            const response = await axios.get(`${API_URL}/api/game/${this.gameCode}/status/`, {
-                headers: { Authorization: `Token ${token}` }
+            const headers = { Authorization: `Token ${token}` };
+            if (this._etag) {
+                headers['If-None-Match'] = this._etag;
+            }
+            const endpoint = longPoll ? 'poll' : 'status';
+            const response = await axios.get(`${API_URL}/api/game/${this.gameCode}/${endpoint}/`, {
+                headers,
+                validateStatus: status => (status >= 200 && status < 300) || status === 304
             });
             
+            // Nothing changed since the last poll
+            if (response.status === 304) return true;
+            this._etag = response.headers.etag || null;
+            
             if (response.data && response.data.success && response.data.game) {
                 const gameData = response.data.game;
                 if (!gameData) {
@@ -117,6 +137,7 @@ class WebSocketService {
             } else if (response.data && response.data.error) {
                 console.error('Server error while polling game:', response.data.error);
             }
+            return true;
         } catch (error) {
             console.error('Error polling game state:', error);
             if (error.response && error.response.status === 404) {
@@ -124,6 +145,7 @@ class WebSocketService {
                 console.log('Game not found, stopping polling');
                 this.disconnect();
             }
+            return false;
         }
     }
 
@@ -218,7 +240,9 @@ class WebSocketService {
             
             const response = await axios.post(
                 `${API_URL}/api/game/${this.gameCode}/next/`, 
-                {},
+                // The question being left, so a click during the reveal
+                // cannot skip the one the server has just opened
+                this._prevQuestion === undefined ? {} : { current_question: this._prevQuestion },
                 { headers: { Authorization: `Token ${token}` }}
             );
             